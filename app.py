@@ -1,21 +1,57 @@
 # Load Framework library
-from traitlets.traitlets import default
 import streamlit as st
+import instrument
+import pipeline
+import startup
 
-# Load the pages
-import exploratory_app
-import forecasting_app
-import about_data_app
+# Configurating the layout of the page, before any page is rendered
+st.set_page_config(
+    page_title="Household Power Consumption",
+    page_icon="⚡",
+    layout="wide",
+    initial_sidebar_state="expanded",
+)
 
+# The pages, imported with their libraries the first time they are selected
 PAGES = {
-    "Exploratory Data Analysis": exploratory_app,
-    'Forecasting': forecasting_app,
-    'About data': about_data_app,
+    "Exploratory Data Analysis": 'exploratory_app',
+    'Forecasting': 'forecasting_app',
+    'About data': 'about_data_app',
 }
 st.sidebar.title('Navigation')
 selection = st.sidebar.radio("Go to", list(PAGES.keys()))
-page = PAGES[selection]
-page.app()
+
+# Served from the artifacts of pipeline.py, the pages only read them and must not build stale ones
+if pipeline.PRECOMPUTED:
+    stale = pipeline.stale_stages()
+    if stale:
+        st.error('The precomputed artifacts are out of date for '
+                 + ', '.join(f'{meter} ({stage})' for meter, stage in stale)
+                 + '. Run `python pipeline.py` before serving the app.')
+        st.stop()
+
+page = startup.import_page(PAGES[selection])
+
+# The stages of the page, and of the chart jobs it submits, are timed into one run
+run = instrument.start_run(selection)
+# st.stop() and st.rerun() raise out of the page, the run is closed either way
+try:
+    page.app()
+finally:
+    instrument.finish_run()
+
+# Import cost of the pages opened so far in this process
+if st.sidebar.checkbox('Show startup report'):
+    st.sidebar.dataframe(startup.import_report())
+
+# Time and memory of every stage of this run, and of the last runs of the process
+if st.sidebar.checkbox('Show performance panel'):
+    st.sidebar.markdown(f'This run: **{run.seconds:.2f} s**, peak memory **{run.peak_rss / 1048576:.0f} MB**')
+    st.sidebar.dataframe(run.frame())
+    st.sidebar.download_button('Export this run as JSON', run.to_json(),
+                               file_name=f'run-{run.id}.json', mime='application/json')
+    st.sidebar.markdown('Seconds per stage of the recent runs')
+    st.sidebar.dataframe(instrument.history().pivot_table(index='run', columns='stage', values='seconds'))
 
 hide_st_style = """
     <style>
@@ -0,0 +1,113 @@
+# Load standard libraries
+import hashlib
+import json
+import os
+import tempfile
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+import registry
+import forecast_engine
+
+BACKTEST_DIR = os.path.join(ingestion.DATA_DIR, 'backtests')
+
+# Horizons of the Conclusion, every one is scored from the same fits
+HORIZONS = (30, 60, 90)
+
+# Rolling origins: two years of history before the first cutoff, then one cutoff a month
+INITIAL_DAYS = 730
+PERIOD_DAYS = 30
+
+
+def cutoffs(data, horizon=max(HORIZONS), initial=INITIAL_DAYS, period=PERIOD_DAYS):
+    '''Returns the rolling cutoffs that leave a full horizon of data after them'''
+    first = data[ingestion.TIMESTAMP].min()
+    last = data[ingestion.TIMESTAMP].max()
+    start = first + pd.Timedelta(days=initial)
+    end = last - pd.Timedelta(days=horizon - 1)
+    if end < start:
+        return []
+    return list(pd.date_range(start, end, freq=f'{period}D'))
+
+
+def metrics_key(version, models, horizons, origins):
+    '''Hashes what a metrics table depends on'''
+    return hashlib.sha256(json.dumps([
+        version, sorted(models), list(horizons), [str(cutoff) for cutoff in origins],
+        {model: forecast_engine.DEFAULT_PARAMS[model] for model in models},
+    ], sort_keys=True).encode()).hexdigest()
+
+
+def metrics_path(data, version, models, horizons, backtest_dir=BACKTEST_DIR):
+    '''Returns the path of the metrics table of a backtest and its cutoffs'''
+    origins = cutoffs(data, max(horizons))
+    key = metrics_key(version, models, horizons, origins)
+    return os.path.join(backtest_dir, f'metrics-{key[:24]}.npz'), origins
+
+
+def score(actual, predicted, ahead, horizons=HORIZONS):
+    '''Computes RMSE and MAPE of every horizon in one pass over all the forecast days
+
+    ahead holds the number of days between the cutoff and each forecast day,
+    a day counts for every horizon it falls into.
+    '''
+    actual = np.asarray(actual, dtype=np.float64)
+    errors = np.asarray(predicted, dtype=np.float64) - actual
+    inside = (np.asarray(ahead)[None, :] < np.asarray(horizons)[:, None]).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        days = inside.sum(axis=1)
+        rmse = np.sqrt(inside @ errors ** 2 / days)
+        mape = inside @ np.abs(errors / actual) / days * 100
+    return rmse, mape
+
+
+def run(data, version, models=tuple(forecast_engine.FITTERS), horizons=HORIZONS, backtest_dir=BACKTEST_DIR):
+    '''Runs the rolling-origin backtest of the models and returns the path of its metrics table
+
+    Every (model, cutoff) fit goes to the forecast engine process pool at once and
+    predicts the longest horizon only, the shorter horizons are scored from it.
+    '''
+    path, origins = metrics_path(data, version, models, horizons, backtest_dir)
+    if os.path.exists(path):
+        return path
+
+    futures = {(model, cutoff): forecast_engine.submit(model, data, cutoff, max(horizons))
+               for model in models for cutoff in origins}
+    actual = data.set_index(ingestion.TIMESTAMP)[forecast_engine.TARGET]
+    table = {'model': [], 'horizon': [], 'rmse': [], 'mape': [], 'cutoffs': []}
+    for model in models:
+        parts = []
+        for cutoff in origins:
+            forecast = registry.get_artifact(futures[model, cutoff].result()).value
+            stamps = pd.DatetimeIndex(forecast['ds'])
+            parts.append((actual.reindex(stamps).to_numpy(), forecast['yhat'], (stamps - cutoff).days))
+        if parts:
+            values, predicted, ahead = (np.concatenate(column) for column in zip(*parts))
+        else:
+            values = predicted = ahead = np.zeros(0)
+        rmse, mape = score(values, predicted, ahead, horizons)
+        table['model'] += [model] * len(horizons)
+        table['horizon'] += list(horizons)
+        table['rmse'] += list(rmse)
+        table['mape'] += list(mape)
+        table['cutoffs'] += [len(origins)] * len(horizons)
+
+    os.makedirs(backtest_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp.npz', dir=backtest_dir)
+    with os.fdopen(fd, 'wb') as f:
+        np.savez_compressed(f, **{name: np.asarray(values) for name, values in table.items()})
+    os.replace(tmp_path, path)
+    return path
+
+
+def cached_metrics(data, version, models=tuple(forecast_engine.FITTERS), horizons=HORIZONS, backtest_dir=BACKTEST_DIR):
+    '''Returns the metrics table if this backtest already ran, else None'''
+    path, _ = metrics_path(data, version, models, horizons, backtest_dir)
+    return load_metrics(path) if os.path.exists(path) else None
+
+
+def load_metrics(path):
+    '''Reads a metrics table once per process as a DataFrame'''
+    return pd.DataFrame(registry.get_artifact(path).value)
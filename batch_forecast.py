@@ -0,0 +1,131 @@
+# Load standard libraries
+import argparse
+import concurrent.futures
+import os
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+import registry
+import fleet
+import forecast_engine
+
+BATCH_DIR = os.path.join(ingestion.DATA_DIR, 'batch_forecasts')
+
+# Fits queued at once per worker, bounds the inputs and results held in memory
+PENDING_PER_WORKER = 2
+
+SERIES_ID = 'Series_id'
+
+
+def fleet_series(meters=None, targets=(forecast_engine.TARGET,)):
+    '''Groups, cleans and splits the daily data of many meters into one frame per series
+
+    The daily grouping and the cleaning run once over all the meters. A sub
+    metering target is forecast on its own, without the other sub meterings as
+    regressors.
+    '''
+    data = fleet.fleet_frame('day', ingestion.DAILY_MEASURES, meters, by_meter=True, gap_policy='fill')
+    data = forecast_engine.clean_daily(data, by=ingestion.METER_ID)
+    codes, meters = pd.factorize(data[ingestion.METER_ID])
+    bounds = np.searchsorted(codes, np.arange(len(meters) + 1))
+    series = {}
+    for code, meter in enumerate(meters):
+        rows = data.iloc[bounds[code]:bounds[code + 1]]
+        for target in targets:
+            if target == forecast_engine.TARGET:
+                series[meter] = rows
+            else:
+                # The model code always reads the target column
+                series[f'{meter}/{target}'] = rows[[ingestion.TIMESTAMP, target]].rename(
+                    columns={target: forecast_engine.TARGET})
+    return series
+
+
+def forecast_series(series, model='FBProphet', cutoff=forecast_engine.DEFAULT_CUTOFF,
+                    horizon=forecast_engine.DEFAULT_HORIZON, out_dir=None, max_pending=None):
+    '''Fits one model per series on the forecast engine pool and writes every forecast to one columnar output
+
+    At most max_pending fits are queued at once. Finished forecasts come from the
+    engine's disk cache, so a rerun only fits the series whose data changed.
+    Returns the output directory.
+    '''
+    out_dir = out_dir or os.path.join(BATCH_DIR, f'{model}-{pd.Timestamp(cutoff):%Y%m%d}-{horizon}')
+    max_pending = max_pending or forecast_engine.WORKERS * PENDING_PER_WORKER
+    names = list(series)
+    parts, skipped, pending = {}, [], {}
+
+    def _collect(done):
+        for future in done:
+            # Series with identical data share one fit
+            for code in pending.pop(future):
+                try:
+                    parts[code] = registry.load_npz(future.result())
+                except Exception:
+                    skipped.append(names[code])
+
+    for code, name in enumerate(names):
+        data = series[name]
+        regressors = [col for col in forecast_engine.REGRESSORS if col in data]
+        params = dict(forecast_engine.DEFAULT_PARAMS[model], regressors=regressors)
+        try:
+            pending.setdefault(forecast_engine.submit(model, data, cutoff, horizon, params), []).append(code)
+        except ValueError:
+            # Not enough days before or after the cutoff
+            skipped.append(name)
+        if len(pending) >= max_pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            _collect(done)
+    _collect(concurrent.futures.wait(pending).done)
+
+    codes = sorted(parts)
+    columns = {
+        SERIES_ID: np.concatenate([np.full(len(parts[code]['yhat']), code, dtype=np.int32) for code in codes]
+                                  or [np.zeros(0, dtype=np.int32)]),
+        ingestion.TIMESTAMP: np.concatenate([parts[code]['ds'].astype('datetime64[m]').astype(np.int64)
+                                             for code in codes] or [np.zeros(0, dtype=np.int64)]),
+    }
+    for name in ('yhat', 'yhat_lower', 'yhat_upper'):
+        columns[name] = np.concatenate([parts[code][name] for code in codes] or [np.zeros(0)])
+    meta = {
+        'format': ingestion.CACHE_FORMAT,
+        'model': model,
+        'cutoff': str(pd.Timestamp(cutoff)),
+        'horizon': horizon,
+        'series': names,
+        'skipped': skipped,
+        'rows': int(len(columns[SERIES_ID])),
+    }
+    ingestion.write_cache(columns, meta, out_dir)
+    return out_dir
+
+
+def load_batch(out_dir):
+    '''Reads a batch output as a long frame with the series name and the forecast day'''
+    meta = ingestion.read_meta(out_dir)
+    columns = ingestion.load_directory(out_dir, [SERIES_ID, ingestion.TIMESTAMP, 'yhat', 'yhat_lower', 'yhat_upper'])
+    data = pd.DataFrame({name: columns[name] for name in ('yhat', 'yhat_lower', 'yhat_upper')})
+    data.insert(0, 'ds', columns[ingestion.TIMESTAMP].astype('datetime64[m]').astype('datetime64[ns]'))
+    data.insert(0, SERIES_ID, pd.Categorical.from_codes(columns[SERIES_ID], meta['series']))
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Forecasts every meter, or its sub meterings, in one batch.')
+    parser.add_argument('--model', choices=list(forecast_engine.FITTERS), default='FBProphet')
+    parser.add_argument('--meters', nargs='*', help='meter ids, all meters by default')
+    parser.add_argument('--targets', nargs='*', default=[forecast_engine.TARGET],
+                        help='Global_active_power and/or Sub_metering_1..3')
+    parser.add_argument('--cutoff', default=str(forecast_engine.DEFAULT_CUTOFF.date()))
+    parser.add_argument('--horizon', type=int, default=forecast_engine.DEFAULT_HORIZON)
+    parser.add_argument('--out', help='output directory')
+    args = parser.parse_args(argv)
+    series = fleet_series(args.meters, args.targets)
+    out_dir = forecast_series(series, args.model, args.cutoff, args.horizon, args.out)
+    meta = ingestion.read_meta(out_dir)
+    print(f"{len(meta['series']) - len(meta['skipped'])} of {len(meta['series'])} series forecast into {out_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+'''Times the ingestion, aggregation, decomposition and forecasting paths on synthetic meter data.
+
+Every case runs in a fresh process so that its peak RSS is its own. The cases
+run in order on one work directory, each one reuses what the cases before it
+wrote, like the pages do. Nothing is downloaded.
+
+Usage: python benchmarks/bench_pipeline.py [--rows 2M 20M 200M] [--cases ingest ...] [--json results.json]
+'''
+# Load standard libraries
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import synthetic
+
+# Named data set sizes, the UCI household is about 2M rows
+SIZES = {'2M': 2_000_000, '20M': 20_000_000, '200M': 200_000_000}
+
+CASES = ['ingest', 'aggregate', 'rollup', 'decompose', 'forecast']
+
+WORK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'work')
+
+
+def _rows(text):
+    return SIZES[text] if text in SIZES else int(text)
+
+
+def run_ingest(sources, model):
+    '''Parses every meter's file into its columnar cache, the way the app gets each meter
+
+    The household file takes the place of the UCI download, so the app never
+    fetches it. The other meters come in as readings, like meters added with
+    updates.append_meter_readings.
+    '''
+    import ingestion
+    for meter, source in sources.items():
+        if meter == ingestion.DEFAULT_METER:
+            if not os.path.exists(ingestion.SOURCE_PATH):
+                os.makedirs(ingestion.DATA_DIR, exist_ok=True)
+                shutil.copyfile(source, ingestion.SOURCE_PATH)
+            ingestion.build_cache()
+        else:
+            cache_dir = ingestion.meter_paths(meter)['cache_dir']
+            if ingestion.read_meta(cache_dir) is None:
+                ingestion.create_cache(ingestion.read_source(source), cache_dir)
+
+
+def run_aggregate(sources, model):
+    '''Builds the daily and hourly sums and loads the cleaned daily frame, the path of the forecasting page'''
+    import ingestion
+    import forecast_engine
+    for meter in sources:
+        paths = ingestion.meter_paths(meter)
+        daily = ingestion.load_aggregate('daily', aggregate_dir=paths['aggregate_dir'], cache_dir=paths['cache_dir'],
+                                         gap_policy='fill')
+        forecast_engine.clean_daily(daily)
+
+
+def run_rollup(sources, model):
+    '''Builds the rollup pyramid and the day summaries of every meter, then the daily fleet totals'''
+    import ingestion
+    import fleet
+    import rollups
+    import summaries
+    for meter in sources:
+        paths = ingestion.meter_paths(meter)
+        rollups.build_rollups(cache_dir=paths['cache_dir'], rollup_dir=paths['rollup_dir'])
+        summaries.update_summaries(paths['cache_dir'], paths['rollup_dir'])
+    fleet.fleet_frame('day', meters=list(sources), by_meter=True, gap_policy='fill')
+
+
+def run_decompose(sources, model):
+    '''Decomposes every meter's daily and weekly seasonality, the weekly one with STL as well'''
+    import ingestion
+    import decompositions
+    import rollups
+    for meter in sources:
+        paths = ingestion.meter_paths(meter)
+        pyramid = rollups.open_pyramid(cache_dir=paths['cache_dir'], rollup_dir=paths['rollup_dir'])
+        for period, method in (('daily', 'classical'), ('weekly', 'classical'), ('weekly', 'stl')):
+            decompositions.decompose(pyramid, period, method)
+
+
+def run_forecast(sources, model):
+    '''Fits one model per meter on the forecast engine's worker processes'''
+    import batch_forecast
+    series = batch_forecast.fleet_series(list(sources))
+    batch_forecast.forecast_series(series, model)
+
+
+RUNNERS = {
+    'ingest': run_ingest,
+    'aggregate': run_aggregate,
+    'rollup': run_rollup,
+    'decompose': run_decompose,
+    'forecast': run_forecast,
+}
+
+
+def run_child(case, rows, seed, model):
+    '''Runs one case in this process and prints its timings as one JSON line'''
+    import instrument
+    sources = synthetic.generate(rows, seed)
+    # Every later case starts from the caches, made untimed when the ingest case did not run
+    if case != 'ingest':
+        run_ingest(sources, model)
+    run = instrument.start_run(case)
+    RUNNERS[case](sources, model)
+    instrument.finish_run()
+    record = run.to_dict()
+    print(json.dumps({'case': case, 'rows': rows, 'meters': len(sources), 'seconds': record['seconds'],
+                      'peak_rss_mb': record['peak_rss_mb'], 'stages': record['stages']}))
+
+
+def run_case(case, rows, seed, model, work_dir):
+    '''Runs one case in a fresh interpreter with the work directory as its data directory'''
+    env = dict(os.environ, POWER_DATA_DIR=os.path.join(work_dir, 'data'))
+    command = [sys.executable, os.path.abspath(__file__), '--child', case,
+               '--rows', str(rows), '--seed', str(seed), '--model', model]
+    done = subprocess.run(command, env=env, stdout=subprocess.PIPE, text=True)
+    if done.returncode:
+        return {'case': case, 'rows': rows, 'error': f'exit status {done.returncode}'}
+    return json.loads(done.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the data pipeline on synthetic meter data.')
+    parser.add_argument('--rows', nargs='+', default=['2M'], help=f'row counts or {", ".join(SIZES)}')
+    parser.add_argument('--cases', nargs='+', default=CASES, choices=CASES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--model', default='ARIMA', help='model fitted by the forecast case')
+    parser.add_argument('--work-dir', default=WORK_DIR)
+    parser.add_argument('--keep', action='store_true', help='reuse the outputs of the last run')
+    parser.add_argument('--json', help='writes the results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, _rows(args.rows[0]), args.seed, args.model)
+        return
+
+    results = []
+    for rows in map(_rows, args.rows):
+        started = time.perf_counter()
+        synthetic.generate(rows, args.seed)
+        print(f'{rows:,} rows, data generated in {time.perf_counter() - started:.1f} s')
+        work_dir = os.path.join(args.work_dir, f'{rows}-{args.seed}')
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        for case in [case for case in CASES if case in args.cases]:
+            result = run_case(case, rows, args.seed, args.model, work_dir)
+            results.append(result)
+            if 'error' in result:
+                print(f'    {case:<10} failed, {result["error"]}')
+                continue
+            print(f'    {case:<10} {result["seconds"]:9.2f} s  {rows / result["seconds"] / 1e6:8.2f} Mrows/s'
+                  f'  {result["peak_rss_mb"]:9.0f} MB peak RSS')
+
+    if args.json:
+        report = {'python': platform.python_version(), 'platform': platform.platform(),
+                  'cpus': os.cpu_count(), 'seed': args.seed, 'results': results}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
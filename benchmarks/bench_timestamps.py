@@ -0,0 +1,71 @@
+'''Compares the Date/Time parsing paths on synthetic UCI style strings.
+
+Usage: python benchmarks/bench_timestamps.py [rows]
+'''
+# Load standard libraries
+import os
+import sys
+import time
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import timestamps
+
+
+def make_columns(rows):
+    '''Builds Date/Time string columns in the UCI layout, starting on 2006-12-16 17:24'''
+    stamps = pd.date_range('2006-12-16 17:24', periods=rows, freq='min')
+    day_labels = {day: f'{day.day}/{day.month}/{day.year}' for day in stamps.normalize().unique()}
+    dates = stamps.normalize().map(day_labels).to_numpy(dtype=object)
+    times = timestamps.TIME_LABELS[stamps.hour * 60 + stamps.minute]
+    return dates, times
+
+
+def legacy(dates, times):
+    '''The original path used by both pages'''
+    date_time = pd.to_datetime(pd.Series(dates)) + pd.to_timedelta(pd.Series(times))
+    return date_time.values.astype('datetime64[m]').astype(np.int64)
+
+
+def explicit_format(dates, times):
+    '''pandas with an explicit day first format'''
+    date_time = pd.to_datetime(pd.Series(dates), format='%d/%m/%Y') + pd.to_timedelta(pd.Series(times))
+    return date_time.values.astype('datetime64[m]').astype(np.int64)
+
+
+def timed(function, *args, repeat=3):
+    '''Returns the best wall time of a few runs and the last result'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(rows):
+    dates, times = make_columns(rows)
+    # Dropping a few rows turns the input into an irregular sequence
+    keep = np.ones(rows, dtype=bool)
+    keep[::997] = False
+
+    cases = [
+        ('legacy pd.to_datetime (inferred)', legacy, dates, times),
+        ('pd.to_datetime with format', explicit_format, dates, times),
+        ('timestamps.parse_date_time, regular', timestamps.parse_date_time, dates, times),
+        ('timestamps.parse_date_time, irregular', timestamps.parse_date_time, dates[keep], times[keep]),
+    ]
+    reference = explicit_format(dates, times)
+    print(f'{rows:,} rows')
+    for label, function, *args in cases:
+        seconds, result = timed(function, *args)
+        expected = reference if len(result) == rows else reference[keep]
+        status = 'ok' if np.array_equal(result, expected) else 'MISMATCH'
+        print(f'{label:<40} {seconds * 1000:10.1f} ms  {len(result) / seconds / 1e6:8.2f} Mrows/s  {status}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2075259)
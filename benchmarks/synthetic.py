@@ -0,0 +1,181 @@
+'''Writes deterministic synthetic meter data in the layout of the UCI household file.
+
+Every meter is a household of at most meter_rows minutes, the UCI household by
+default, so 20M and 200M rows are 10 and 100 households. The same seed and
+rows always give the same bytes.
+
+Usage: python benchmarks/synthetic.py rows [--seed 0] [--out benchmarks/data]
+'''
+# Load standard libraries
+import argparse
+import concurrent.futures
+import os
+import sys
+import zipfile
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ingestion
+import timestamps
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Length and start of the UCI household
+METER_ROWS = 2075259
+START = pd.Timestamp('2006-12-16 17:24')
+
+# Days generated at once, bounds the memory of the generator
+CHUNK_DAYS = 64
+
+# Outages per day and their mean length in minutes, about 1.25% of the rows are '?' as in the UCI file
+OUTAGES_PER_DAY = 0.05
+OUTAGE_MINUTES = 360
+
+COLUMNS = ['Date', 'Time'] + ingestion.MEASURES
+
+# Decimals of every written measure, as in the UCI file
+_DECIMALS = np.array([f'.{i:03d}' for i in range(1000)], dtype=object)
+
+
+def meter_name(index):
+    '''The first synthetic meter takes the place of the UCI household'''
+    return ingestion.DEFAULT_METER if index == 0 else f'synthetic-{index:03d}'
+
+
+def meter_rows(rows, per_meter=METER_ROWS):
+    '''Splits the rows into households of at most per_meter rows'''
+    full, rest = divmod(rows, per_meter)
+    return [per_meter] * full + ([rest] if rest else [])
+
+
+def _date_labels(days):
+    '''Formats epoch days as the d/m/yyyy labels of the UCI file'''
+    dates = days.astype('datetime64[D]').astype(object)
+    return np.array([f'{day.day}/{day.month}/{day.year}' for day in dates], dtype=object)
+
+
+def _profile(minute_of_day, day_of_week, day_of_year):
+    '''Expected household load in kW: a morning and an evening peak, busier weekends and colder winters'''
+    hour = minute_of_day / 60
+    daily = 0.6 * np.exp(-((hour - 7.5) / 1.2) ** 2) + 1.1 * np.exp(-((hour - 20) / 2) ** 2)
+    weekly = np.where(day_of_week >= 5, 1.25, 1.0)
+    yearly = 1 + 0.35 * np.cos(2 * np.pi * (day_of_year - 15) / 365.25)
+    return (0.35 + daily) * weekly * yearly
+
+
+def _bursts(rng, active, rate, length, level, n):
+    '''Switches an appliance on for runs of minutes, more often when the household is busy'''
+    on = np.zeros(n, dtype=bool)
+    starts = np.flatnonzero(rng.random(n) < rate * active)
+    lengths = rng.geometric(1 / length, len(starts))
+    for start, run in zip(starts, lengths):
+        on[start:start + run] = True
+    return np.where(on, level * rng.uniform(0.8, 1.0, n), 0)
+
+
+def chunk_frame(meter, first, n, seed=0):
+    '''Generates n minutes of one meter starting at the epoch minute first, as a UCI style frame'''
+    rng = np.random.default_rng([seed, meter, first])
+    stamps = first + np.arange(n, dtype=np.int64)
+    days = stamps // timestamps.MINUTES_PER_DAY
+    minute_of_day = stamps % timestamps.MINUTES_PER_DAY
+    day_of_week = (days + 3) % 7
+    day_of_year = days - days.astype('datetime64[D]').astype('datetime64[Y]').astype('datetime64[D]').astype(np.int64)
+
+    # Households differ in size, every meter keeps its own scale
+    scale = np.random.default_rng([seed, meter]).uniform(0.6, 1.6)
+    busy = _profile(minute_of_day, day_of_week, day_of_year) * scale
+    # Sub meterings in watt hour per minute: kitchen, laundry with the fridge, water heater and air conditioner
+    sub_1 = _bursts(rng, busy, 0.002, 25, 37, n)
+    sub_2 = np.maximum(_bursts(rng, busy, 0.001, 60, 30, n), (minute_of_day % 40 < 12) * 1.0)
+    sub_3 = _bursts(rng, 1.0 - 0.3 * busy / busy.max(), 0.004, 90, 18, n)
+    unmetered = busy * 1000 / 60 * rng.gamma(4, 0.25, n)
+    active = (sub_1 + sub_2 + sub_3 + unmetered) * 60 / 1000
+    reactive = np.abs(0.12 + 0.08 * rng.standard_normal(n)) * (1 + (sub_2 > 1))
+    voltage = 240.5 + 3 * np.sin(2 * np.pi * minute_of_day / timestamps.MINUTES_PER_DAY) + rng.normal(0, 1.5, n)
+    intensity = np.round(np.hypot(active, reactive) * 1000 / voltage / 0.2) * 0.2
+
+    data = pd.DataFrame({
+        'Global_active_power': np.round(active, 3),
+        'Global_reactive_power': np.round(reactive, 3),
+        'Voltage': np.round(voltage, 2),
+        'Global_intensity': intensity,
+        'Sub_metering_1': np.round(sub_1),
+        'Sub_metering_2': np.round(sub_2),
+        'Sub_metering_3': np.round(sub_3),
+    })
+    # Outages keep their timestamps and lose every measure, written as '?'
+    missing = np.zeros(n, dtype=bool)
+    for start in np.flatnonzero(rng.random(n) < OUTAGES_PER_DAY / timestamps.MINUTES_PER_DAY):
+        missing[start:start + int(rng.exponential(OUTAGE_MINUTES)) + 1] = True
+    data.loc[missing] = np.nan
+
+    labels = _date_labels(np.unique(days))
+    data.insert(0, 'Date', labels[days - days[0]])
+    data.insert(1, 'Time', timestamps.TIME_LABELS[minute_of_day])
+    return data
+
+
+def format_lines(data):
+    '''Formats a frame as ';' separated lines with three decimals and '?' for missing values
+
+    Every value is split into its integer part and its thousandths, both
+    formatted by numpy, which is several times faster than DataFrame.to_csv.
+    '''
+    lines = data['Date'].to_numpy(dtype=object) + ';' + data['Time'].to_numpy(dtype=object)
+    for col in ingestion.MEASURES:
+        values = data[col].to_numpy(dtype=np.float64)
+        missing = np.isnan(values)
+        millis = np.rint(np.where(missing, 0, values) * 1000).astype(np.int64)
+        text = (millis // 1000).astype(str).astype(object) + _DECIMALS[millis % 1000]
+        text[missing] = '?'
+        lines = lines + ';' + text
+    return '\n'.join(lines.tolist()) + '\n'
+
+
+def write_meter(path, meter, rows, seed=0):
+    '''Writes one meter's rows as a zipped ';' separated file like the UCI download'''
+    first = int(START.value // 60_000_000_000)
+    tmp_path = path + '.part'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        with archive.open('household_power_consumption.txt', 'w', force_zip64=True) as text:
+            text.write((';'.join(COLUMNS) + '\n').encode('ascii'))
+            step = CHUNK_DAYS * timestamps.MINUTES_PER_DAY
+            for offset in range(0, rows, step):
+                chunk = chunk_frame(meter, first + offset, min(step, rows - offset), seed)
+                text.write(format_lines(chunk).encode('ascii'))
+    os.replace(tmp_path, path)
+    return path
+
+
+def generate(rows, seed=0, out_dir=DATA_DIR, per_meter=METER_ROWS, workers=None):
+    '''Writes the synthetic meters of a data set once, one meter per worker process, and returns {meter: path}'''
+    paths, missing = {}, []
+    for index, count in enumerate(meter_rows(rows, per_meter)):
+        path = paths[meter_name(index)] = os.path.join(out_dir, f'{rows}-{seed}', f'{meter_name(index)}.zip')
+        if not os.path.exists(path):
+            missing.append((path, index, count, seed))
+    if missing:
+        with concurrent.futures.ProcessPoolExecutor(min(workers or os.cpu_count() or 1, len(missing))) as pool:
+            for _ in pool.map(write_meter, *zip(*missing)):
+                pass
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Writes deterministic synthetic meter data in the UCI layout.')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=DATA_DIR)
+    parser.add_argument('--meter-rows', type=int, default=METER_ROWS, help='rows per household')
+    args = parser.parse_args(argv)
+    for meter, path in generate(args.rows, args.seed, args.out, args.meter_rows).items():
+        print(f'{meter:<16} {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Load standard libraries
+import os
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+
+# Seasonal period of every decomposition, as the rollup level it runs on and the buckets per cycle
+PERIODS = {
+    'daily': ('hour', 24),
+    'weekly': ('day', 7),
+    'monthly': ('day', 30),
+    'yearly': ('day', 365),
+}
+METHODS = ['classical', 'stl']
+COMPONENTS = ['observed', 'trend', 'seasonal', 'resid']
+
+
+def decomposition_dir(rollup_dir, period, method, measure):
+    '''Decompositions are stored next to the rollup levels they are computed from'''
+    return os.path.join(rollup_dir, 'decompositions', f'{measure}-{period}-{method}')
+
+
+def _series(pyramid, level, measure):
+    '''Returns the bucket sums of a level, buckets without readings interpolated from their neighbours'''
+    _, columns = pyramid.query(level, measures=[measure], stats=('sum', 'count'))
+    sums = np.asarray(columns[f'{measure}_sum'], dtype=np.float64)
+    sums = np.where(np.asarray(columns[f'{measure}_count']) > 0, sums, np.nan)
+    values = pd.Series(sums).interpolate(limit_direction='both').to_numpy()
+    return np.asarray(columns[ingestion.TIMESTAMP]), values
+
+
+def compute(stamps, values, cycle, method='classical'):
+    '''Splits a series into trend, seasonal and residual components'''
+    if len(values) < 2 * cycle:
+        raise ValueError(f'A period of {cycle} buckets needs at least {2 * cycle} buckets of data')
+    if method == 'stl':
+        from statsmodels.tsa.seasonal import STL
+        # The seasonal smoother spans about one cycle and needs an odd length
+        result = STL(values, period=cycle, seasonal=max(7, cycle | 1), robust=True).fit()
+    else:
+        from statsmodels.tsa.seasonal import seasonal_decompose
+        result = seasonal_decompose(values, period=cycle)
+    return {
+        ingestion.TIMESTAMP: np.asarray(stamps, dtype=np.int64),
+        'observed': np.asarray(result.observed, dtype=np.float64),
+        'trend': np.asarray(result.trend, dtype=np.float64),
+        'seasonal': np.asarray(result.seasonal, dtype=np.float64),
+        'resid': np.asarray(result.resid, dtype=np.float64),
+    }
+
+
+def decompose(pyramid, period='weekly', method='classical', measure='Global_active_power'):
+    '''Returns a decomposition as a frame, computed once per dataset version and then read from disk'''
+    if period not in PERIODS or method not in METHODS:
+        raise KeyError(f'Unknown decomposition {period}/{method}')
+    directory = decomposition_dir(pyramid.rollup_dir, period, method, measure)
+    # Chart jobs asking for the same decomposition compute it once
+    with ingestion.directory_lock(directory):
+        meta = ingestion.read_meta(directory)
+        if meta is None or meta['version'] != pyramid.version:
+            level, cycle = PERIODS[period]
+            columns = compute(*_series(pyramid, level, measure), cycle, method)
+            meta = {'format': ingestion.CACHE_FORMAT, 'version': pyramid.version, 'level': level,
+                    'cycle': cycle, 'rows': int(len(columns[ingestion.TIMESTAMP]))}
+            ingestion.write_cache(columns, meta, directory)
+        columns = ingestion.load_directory(directory, [ingestion.TIMESTAMP] + COMPONENTS, mmap_mode='r')
+    data = pd.DataFrame({name: columns[name] for name in COMPONENTS})
+    data.insert(0, ingestion.TIMESTAMP,
+                np.asarray(columns[ingestion.TIMESTAMP]).astype('datetime64[m]').astype('datetime64[ns]'))
+    return data
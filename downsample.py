@@ -0,0 +1,73 @@
+# Load Data libraries
+import numpy as np
+
+# Width of a wide layout chart and the points kept per horizontal pixel
+CHART_WIDTH_PX = 1200
+POINTS_PER_PX = 2
+MAX_POINTS = CHART_WIDTH_PX * POINTS_PER_PX
+
+
+def _as_float(values):
+    '''Converts numbers or datetimes into float64 for the area computations'''
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return values.astype(np.float64)
+
+
+def lttb(x, y, threshold):
+    '''Returns the indices kept by Largest-Triangle-Three-Buckets downsampling'''
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    xf, yf = _as_float(x), _as_float(y)
+
+    # First and last points are always kept, the rest is split into equal buckets
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = xf[hi:next_hi].mean()
+        avg_y = yf[hi:next_hi].mean()
+        # Keeping the point that forms the largest triangle with the previous pick and the next average
+        area = np.abs((xf[a] - avg_x) * (yf[lo:hi] - yf[a]) - (xf[a] - xf[lo:hi]) * (avg_y - yf[a]))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(y, buckets):
+    '''Returns the indices of the min and max point of equal sized buckets'''
+    n = len(y)
+    if 2 * buckets >= n:
+        return np.arange(n)
+    size = -(-n // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = _as_float(y)
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    low = offsets + np.where(np.isnan(padded), np.inf, padded).argmin(axis=1)
+    high = offsets + np.where(np.isnan(padded), -np.inf, padded).argmax(axis=1)
+    return np.unique(np.concatenate([low, high, [0, n - 1]]).clip(0, n - 1))
+
+
+def xy(x, y, max_points=MAX_POINTS, method='lttb'):
+    '''Downsamples a trace to at most max_points, dropping missing values first
+
+    When x is None the positions of y are used, like a Plotly trace without x.
+    '''
+    y = np.asarray(y)
+    x = np.arange(len(y)) if x is None else np.asarray(x)
+    if len(y) <= max_points:
+        return x, y
+    finite = np.flatnonzero(~np.isnan(_as_float(y)))
+    x, y = x[finite], y[finite]
+    if method == 'minmax':
+        keep = minmax(y, max_points // 2)
+    else:
+        keep = lttb(x, y, max_points)
+    return x[keep], y[keep]
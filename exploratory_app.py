@@ -1,32 +1,22 @@
 # Load Framework library
-from traitlets.traitlets import default
 import streamlit as st
 
 # Load Data libraries
 import pandas as pd
 import numpy as np
+import ingestion
+import store
+import rollups
+import downsample
+import jobs
+import fleet
+import decompositions
+import summaries
+import rolling
 
 # Load Viz libraries
 import plotly.graph_objects as go
-import plotly.express as px
-import plotly.figure_factory as ff
 from plotly.subplots import make_subplots
-import seaborn as sns
-import matplotlib.pyplot as plt
-
-# Load statistic libraries
-from statsmodels.tsa.seasonal import seasonal_decompose
-import statsmodels
-import statsmodels.api as sm
-from statsmodels.tsa.stattools import coint, adfuller
-
-# Configurating the layout of the page
-st.set_page_config(
-    page_title="Household Power Consumption",
-    page_icon="⚡",
-    layout="wide",
-    initial_sidebar_state="expanded",
-)
 
 def app():
     st.markdown(""" ## Page: **Exploratory Data Analysis**""")
@@ -48,62 +38,86 @@ def app():
     #create a canvas for each item
     interactive =  st.beta_container()
 
-    # Loading the data
-    # data_url = ('household_power_consumption_final.csv')
-    data_url = 'https://archive.ics.uci.edu/ml/machine-learning-databases/00235/household_power_consumption.zip'
-
-    # @st.cache(persist=True)
-    # def load_data():
-    #     '''Loads the data and converts Date into Datetime'''
-    #     data = pd.read_csv(data_url, low_memory=False)
-    #     data['Date_time'] = pd.to_datetime(data['Date_time'])
-    #     return data
-
-    @st.cache(persist=True)
-    def load_data():
-        '''Loads the data and converts Date into Datetime'''
-        data = pd.read_csv(data_url, delimiter=';', low_memory=False)
-        # Converting the date and time columns into Datetime series
-        data['Date_time'] = pd.to_datetime(data.pop('Date')) + pd.to_timedelta(data.pop('Time'))
-        # Replacing '?' to NaN values
-        data.replace('?', np.nan, inplace=True)
-        # Dropping all NaN values
-        # data.dropna(how="any", inplace=True)
-        # Converting the data types for all columns except date_time and week_num
-        cols = [i for i in data.columns if i not in ['Date_time']]
-        for col in cols:
-            data[col] = pd.to_numeric(data[col], downcast='integer')
-
-        return data
-
-    # Saving the data into df variable
-    data = load_data()
+    # Picking the meter, only its partitions are read
+    meters = ingestion.meter_ids()
+    meter = st.sidebar.selectbox('Meter', meters)
+    meter_paths = ingestion.meter_paths(meter)
+
+    # Opening the memory-mapped minute store shared by all sessions
+    minute_store = store.open_store(cache_dir=meter_paths['cache_dir'])
 
     # Data preview
     st.markdown('Data preview: _contains the first 20 records_')
 
     # Showing first 5 rows
-    st.write(data.head(20))
+    st.write(minute_store.head(20))
 
-    # Calculate memory usage
-    memory_usage = round(data.memory_usage(deep=True).sum()/1048576,2)
+    # Calculate the size of the store on disk
+    memory_usage = round(minute_store.nbytes/1048576,2)
 
     # Warning message
     st.warning(
-        f'The full data uses **{memory_usage} MB** and has over 2 Mil records. It takes lots of time to load!')
+        f'The full data uses **{memory_usage} MB** and has over 2 Mil records. It is shown page by page!')
 
-    # Display full data base on checkbox.
+    # Display full data base on checkbox, one page at a time
     if st.checkbox('Show full data'):
-        data
+        col_from, col_to, col_sort, col_order = st.beta_columns(4)
+        date_from = col_from.date_input('From', value=minute_store.first.date())
+        date_to = col_to.date_input('To', value=minute_store.last.date())
+        sort_by = col_sort.selectbox('Sort by', ['Date_time'] + minute_store.measures)
+        ascending = col_order.selectbox('Order', ['Ascending', 'Descending']) == 'Ascending'
+
+        # Counting the rows of the range to know the number of pages
+        range_end = pd.Timestamp(date_to) + pd.Timedelta(days=1)
+        lo, hi = minute_store.bounds(date_from, range_end)
+        pages = max(1, -(-(hi - lo) // store.PAGE_ROWS))
+        page_number = st.number_input(f'Page (of {pages})', min_value=1, max_value=pages, value=1)
+
+        # Only the rows of the visible page are read and sent to the browser
+        data_page, total_rows = minute_store.page(
+            number=page_number - 1,
+            start=date_from,
+            end=range_end,
+            sort_by=sort_by,
+            ascending=ascending)
+        st.write(data_page)
+        st.markdown(f'_Showing {len(data_page)} of {total_rows} records_')
 
     st.markdown("""____""")
 
-    # Grouping the data on daily interval by ascending date
-    data_daily_grp = data.groupby(
-        pd.Grouper(key='Date_time', freq='D')).agg({'Global_active_power':'sum', 
-                                                    'Sub_metering_1':'sum', 
-                                                    'Sub_metering_2':'sum', 
-                                                    'Sub_metering_3':'sum'}).reset_index()
+    # Loading the daily sums from the precomputed rollups
+    pyramid = rollups.open_pyramid(cache_dir=meter_paths['cache_dir'], rollup_dir=meter_paths['rollup_dir'])
+    # Days with less than half of their readings are left out
+    data_daily_grp = pyramid.frame('day', measures=ingestion.DAILY_MEASURES + ['Unmetered_energy'], stat='sum',
+                                   gap_policy='skip')
+
+    # Figures are cached per dataset version and widget values
+    dataset_version = pyramid.version
+
+    # Charts are built in background jobs and shown as each one finishes
+    charts = jobs.Charts()
+
+    # Comparing the meters when more than one is ingested
+    if len(meters) > 1 and st.checkbox('Show fleet overview'):
+        def build_fleet():
+            '''Builds the daily total of all meters and the number of meters reporting'''
+            data_fleet = fleet.fleet_frame('day', measures=['Global_active_power'], meters=meters)
+            fig_fleet = make_subplots(specs=[[{'secondary_y':True}]])
+            x_plot, y_plot = downsample.xy(data_fleet['Date_time'], data_fleet['Global_active_power'])
+            fig_fleet.add_trace(go.Scatter(x=x_plot, y=y_plot, name='Global_active_power'))
+            x_plot, y_plot = downsample.xy(data_fleet['Date_time'], data_fleet['meters'])
+            fig_fleet.add_trace(go.Scatter(x=x_plot, y=y_plot, name='Meters reporting'), secondary_y=True)
+            fig_fleet.update_layout(
+                title={
+                'text': f"<b>Daily Global Active Power of {len(meters)} meters</b>",
+                'y':0.9,
+                'x':0.5,
+                'xanchor': 'center',
+                'yanchor': 'top'},
+                paper_bgcolor='#2E3137')
+            return fig_fleet
+
+        charts.add(st.empty(), fleet.fleet_version(meters), 'fleet', build_fleet)
 
     st.markdown(""" ### **EXPLORATORY DATA ANALYSES** """)
 
@@ -119,60 +133,82 @@ def app():
     attributes to compare and see the correlation between them.
     """)
 
-    # Excluding all 0 values
-    data_daily_grp = data_daily_grp.loc[data_daily_grp.ne(0).all(axis=1)]
-
     # Creating list of all columns/attributes to select
     attribute_select = st.multiselect(
         'Which attributes to plot?', 
         options = list(data_daily_grp.columns[1:]), 
         default = ['Global_active_power'])
 
-    # Plotting the Line chart
-    # Activating secondary Y axes
-    fig = make_subplots(specs=[[{'secondary_y':True}]])
-
-    # Creating bool variable
-    secondary_y=True
-
-    # Looping through each attribute to append on correct axes
-    for name in attribute_select:
-        if name != 'Global_active_power':
-            secondary_y=False
-        else:
-            secondary_y=True
+    # Zooming into a date range re-queries the rollups at a finer resolution
+    first_day = data_daily_grp['Date_time'].min().to_pydatetime()
+    last_day = (data_daily_grp['Date_time'].max() + pd.Timedelta(days=1)).to_pydatetime()
+    zoom_start, zoom_end = st.slider(
+        'Zoom to dates',
+        min_value=first_day,
+        max_value=last_day,
+        value=(first_day, last_day),
+        format='YYYY-MM-DD')
+    def build_line():
+        '''Builds the line chart of the selected attributes'''
+        level, data_zoom = pyramid.query(
+            start=zoom_start, end=zoom_end,
+            measures=attribute_select,
+            stats=('sum', 'count'),
+            max_points=4*downsample.MAX_POINTS)
+
+        # Plotting the Line chart
+        # Activating secondary Y axes
+        fig = make_subplots(specs=[[{'secondary_y':True}]])
+
+        # Creating bool variable
+        secondary_y=True
+
+        # Looping through each attribute to append on correct axes
+        for name in attribute_select:
+            if name != 'Global_active_power':
+                secondary_y=False
+            else:
+                secondary_y=True
         
-        # Ploting the selected attribute
-        fig.add_trace(go.Scatter(
-        x=data_daily_grp['Date_time'],
-        y=data_daily_grp[name],
-        name=name
-        ), secondary_y=secondary_y)
-
-        # Setting up the names
-        fig.update_yaxes(title_text="<b>Power</b> watt-hour [W/h]", secondary_y=False, gridcolor='#4a4e69')
-        fig.update_yaxes(title_text="<b>Power</b> kilowatt [kW]", secondary_y=True, gridcolor='#4a4e69')
-        fig.update_xaxes(title_text="<b>Dates", showgrid=False)
-
-        # Setting up the layout
-        fig.update_layout(
-            title={
-            'text': "<b>Daily Power Consumption - 2006 - 2010</b>",
-            'y':0.9,
-            'x':0.5,
-            'xanchor': 'center',
-            'yanchor': 'top'},
-            paper_bgcolor='#2E3137', 
-            autosize=True, 
-            legend=dict(
-                        orientation="h",
-                        yanchor="top",
-                        y=1.12,
-                        xanchor="center",
-                        x=0.5))
-                        
-    # Showing the plot
-    st.plotly_chart(fig, use_container_width=True)
+            # Leaving a gap where the bucket has no valid readings
+            y_zoom = np.where(data_zoom[f'{name}_count'] > 0, data_zoom[f'{name}_sum'], np.nan)
+            x_zoom = np.asarray(data_zoom['Date_time']).astype('datetime64[m]')
+
+            # Ploting the selected attribute with at most a few points per pixel
+            x_plot, y_plot = downsample.xy(x_zoom, y_zoom)
+            fig.add_trace(go.Scatter(
+            x=x_plot,
+            y=y_plot,
+            name=name
+            ), secondary_y=secondary_y)
+
+            # Setting up the names
+            fig.update_yaxes(title_text="<b>Power</b> watt-hour [W/h]", secondary_y=False, gridcolor='#4a4e69')
+            fig.update_yaxes(title_text="<b>Power</b> kilowatt [kW]", secondary_y=True, gridcolor='#4a4e69')
+            fig.update_xaxes(title_text="<b>Dates", showgrid=False)
+
+            # Setting up the layout
+            fig.update_layout(
+                title={
+                'text': f"<b>{rollups.LEVEL_TITLES[level]} Power Consumption - {zoom_start.year} - {zoom_end.year}</b>",
+                'y':0.9,
+                'x':0.5,
+                'xanchor': 'center',
+                'yanchor': 'top'},
+                paper_bgcolor='#2E3137', 
+                autosize=True, 
+                legend=dict(
+                            orientation="h",
+                            yanchor="top",
+                            y=1.12,
+                            xanchor="center",
+                            x=0.5))
+        return fig
+
+    # Appends outside of the zoomed range keep the cached line chart
+    zoom_version = minute_store.range_version(zoom_start, zoom_end)
+    charts.add(st.empty(), zoom_version, 'line', build_line,
+               attributes=attribute_select, zoom=(zoom_start, zoom_end))
 
     st.markdown("""We can confirm the suggestion from above by showing
     the correlation between each attributes.""")
@@ -182,240 +218,303 @@ def app():
     Meanwhile the correlation with Sub Metering 1 & 2 is 0.46.
     """)
 
+    # Correlation and box statistics come from the merged summaries, whatever the resolution
+    # Hours and days with less than half of their readings are left out, like the daily charts
+    resolution = st.selectbox('Resolution', ['minute', 'hour', 'day'], index=2,
+                              format_func=rollups.LEVEL_TITLES.get)
+
     # Setting up the plot
     st.subheader('Correlation Matrix')
 
-    z=data_daily_grp.corr().values
-    x=['Global Active Power','Sub 1','Sub 2','Sub 3']
-    y=['Global Active Power','Sub 1','Sub 2','Sub 3']
-    z_text = np.round(z, decimals=2)
-
-    fig_corr = ff.create_annotated_heatmap(
-                                        z, 
-                                        x=x, 
-                                        y=y, 
-                                        annotation_text=z_text,
-                                        colorscale='blues',
-                                        hoverinfo='z')
-
-        # Setting up the layout
-    fig_corr.update_layout(title_text='<b>Correlation Matrix</b>', 
-                            title_x=0.5,
-                            xaxis_showgrid=False,
-                            yaxis_showgrid=False,
-                            yaxis_autorange='reversed',
-                            paper_bgcolor='#2E3137',
-                            showlegend=True,
-                            autosize=True)
-
-    # Showing the plot
-    st.plotly_chart(fig_corr, use_container_width=True)
+    def build_corr():
+        '''Builds the correlation heatmap'''
+        # Imported on first build, cached figures never need it
+        import plotly.figure_factory as ff
+
+        moments, _ = summaries.range_summary(pyramid, level=resolution, measures=ingestion.DAILY_MEASURES,
+                                             gap_policy='skip')
+        z=moments.correlation()
+        x=['Global Active Power','Sub 1','Sub 2','Sub 3']
+        y=['Global Active Power','Sub 1','Sub 2','Sub 3']
+        z_text = np.round(z, decimals=2)
+
+        fig_corr = ff.create_annotated_heatmap(
+                                            z, 
+                                            x=x, 
+                                            y=y, 
+                                            annotation_text=z_text,
+                                            colorscale='blues',
+                                            hoverinfo='z')
+
+            # Setting up the layout
+        fig_corr.update_layout(title_text='<b>Correlation Matrix</b>', 
+                                title_x=0.5,
+                                xaxis_showgrid=False,
+                                yaxis_showgrid=False,
+                                yaxis_autorange='reversed',
+                                paper_bgcolor='#2E3137',
+                                showlegend=True,
+                                autosize=True)
+        return fig_corr
+
+    charts.add(st.empty(), dataset_version, 'corr', build_corr, resolution=resolution)
 
     st.subheader("""Boxplot""")
 
-    # Activating seconday Y axes
-    fig_box = make_subplots(specs=[[{'secondary_y':True}]])
-
-    # Plotting each attribute
-    fig_box.add_trace(go.Box(y=data_daily_grp['Sub_metering_1'], 
-                            name='Sub_1'), secondary_y=False)
-
-    fig_box.add_trace(go.Box(y=data_daily_grp['Sub_metering_2'], 
-                            name='Sub_2'), secondary_y=False)
-
-    fig_box.add_trace(go.Box(y=data_daily_grp['Sub_metering_3'], 
-                            name='Sub_3'), secondary_y=False)
+    def build_box():
+        '''Builds the box plots'''
+        # Activating seconday Y axes
+        fig_box = make_subplots(specs=[[{'secondary_y':True}]])
+
+        _, digests = summaries.range_summary(pyramid, level=resolution, measures=ingestion.DAILY_MEASURES,
+                                             gap_policy='skip')
+
+        # Plotting each attribute from its quartiles and fences
+        for measure, name in [('Sub_metering_1', 'Sub_1'), ('Sub_metering_2', 'Sub_2'),
+                              ('Sub_metering_3', 'Sub_3'), ('Global_active_power', 'Active Power')]:
+            box = {stat: [value] for stat, value in digests[measure].box().items()}
+            fig_box.add_trace(go.Box(x=[name], name=name, **box),
+                              secondary_y=measure == 'Global_active_power')
+
+        # Setting the names of y axes for each plot
+        fig_box.update_yaxes(title_text="Watt-hour <b>[Wh]</b>")
+        fig_box.update_yaxes(title_text="Kilowatt <b>[kW]</b>", secondary_y=True)
+
+        # Setting the grid lines and their colors
+        fig_box.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#4a4e69')
+        fig_box.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#4a4e69')
+
+        # Fixing the tickval on the x axes
+        fig_box.update_xaxes(tickfont=dict(size=10))
+
+        # Setting the layout
+        fig_box.update_layout(title_text='<b>Sub Metering and Active Power Averages</b>', 
+                        title_x=0.5,
+                        paper_bgcolor='#2E3137',
+                        autosize=True,
+                        yaxis=dict(showgrid=True),
+                        legend=dict(orientation="h",
+                        yanchor="bottom",
+                        y=1,
+                        xanchor="center",
+                        x=0.5))
+        return fig_box
 
-    fig_box.add_trace(go.Box(y=data_daily_grp['Global_active_power'], 
-                            name='Active Power'), secondary_y=True)
+    charts.add(st.empty(), dataset_version, 'box', build_box, resolution=resolution)
 
-    # Setting the names of y axes for each plot
-    fig_box.update_yaxes(title_text="Watt-hour <b>[Wh]</b>")
-    fig_box.update_yaxes(title_text="Kilowatt <b>[kW]</b>", secondary_y=True)
+    # Distribution plot
+    st.subheader('Distribution Plots')
 
-    # Setting the grid lines and their colors
-    fig_box.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#4a4e69')
-    fig_box.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#4a4e69')
+    # Creating a single value selection box
+    attribute_select_sng = st.selectbox("Please select an attribute", list(data_daily_grp.columns[1:]))
 
-    # Fixing the tickval on the x axes
-    fig_box.update_xaxes(tickfont=dict(size=10))
+    def build_displot():
+        '''Builds the distribution plot of the selected attribute'''
+        # Creating variable that holds the data
+        hist_data = [list(data_daily_grp[attribute_select_sng].values)]
+        # Creating variable to hold the names of the attributes
+        group_labels = [attribute_select_sng]
+
+        # Plotting the data using displot
+        import plotly.figure_factory as ff
+        fig_displot = ff.create_distplot(hist_data, group_labels=group_labels,
+                                bin_size=190, show_rug=False)
+    
+        # Setting the grid lines and their colors
+        fig_displot.update_xaxes(showgrid=True, gridcolor='#4a4e69')
+        fig_displot.update_yaxes(showgrid=True, gridcolor='#4a4e69')
 
-    # Setting the layout
-    fig_box.update_layout(title_text='<b>Sub Metering and Active Power Averages</b>', 
+        # Updating the layout
+        fig_displot.update_layout(title_text=(f'<b>Displot for {attribute_select_sng}</b>'), 
                     title_x=0.5,
                     paper_bgcolor='#2E3137',
                     autosize=True,
                     yaxis=dict(showgrid=True),
-                    legend=dict(orientation="h",
-                    yanchor="bottom",
-                    y=1,
-                    xanchor="center",
-                    x=0.5))
-    # Showing the plot
-    st.plotly_chart(fig_box, use_container_width=True)
+                    showlegend=False)
+        return fig_displot
 
-    # Distribution plot
-    st.subheader('Distribution Plots')
-
-    # Creating a single value selection box
-    attribute_select_sng = st.selectbox("Please select an attribute", list(data_daily_grp.columns[1:]))
-
-    # Creating variable that holds the data
-    hist_data = [list(data_daily_grp[attribute_select_sng].values)]
-    # Creating variable to hold the names of the attributes
-    group_labels = [attribute_select_sng]
-
-    # Plotting the data using displot
-    fig_displot = ff.create_distplot(hist_data, group_labels=group_labels,
-                            bin_size=190, show_rug=False)
-    
-    # Setting the grid lines and their colors
-    fig_displot.update_xaxes(showgrid=True, gridcolor='#4a4e69')
-    fig_displot.update_yaxes(showgrid=True, gridcolor='#4a4e69')
-
-    # Updating the layout
-    fig_displot.update_layout(title_text=(f'<b>Displot for {attribute_select_sng}</b>'), 
-                title_x=0.5,
-                paper_bgcolor='#2E3137',
-                autosize=True,
-                yaxis=dict(showgrid=True),
-                showlegend=False)
-    # Showing the plot
-    st.plotly_chart(fig_displot, use_container_width=True)
+    charts.add(st.empty(), dataset_version, 'displot', build_displot, attribute=attribute_select_sng)
 
     # PAIRPLOT
     st.subheader('Pairplot')
-    # Setting up the plot
-    fig_pair = go.Figure(data=go.Splom(
-                dimensions=[dict(label='Global Active Power',
-                                 values=data_daily_grp['Global_active_power']),
-                            dict(label='Sub 1',
-                                 values=data_daily_grp['Sub_metering_1']),
-                            dict(label='Sub 2',
-                                 values=data_daily_grp['Sub_metering_2']),
-                            dict(label='Sub 3',
-                                 values=data_daily_grp['Sub_metering_3'])], 
-                showupperhalf=False,
-                diagonal_visible=False,
-                marker=dict(
-                            showscale=False, # colors encode categorical variables
-                            line_color='white', line_width=0.5)
-                ))
-
-    # Setting up the layout
-    fig_pair.update_layout(
-        title_text='<b>All attributes - Scatter plot</b>',
-        title_x=0.5,
-        dragmode='select',
-        paper_bgcolor='#2E3137',
-        autosize=True,
-        hovermode='closest')
-    # Showing the plot
-    st.plotly_chart(fig_pair, use_container_width=True)
+    def build_pair():
+        '''Builds the scatter matrix'''
+        # Setting up the plot
+        fig_pair = go.Figure(data=go.Splom(
+                    dimensions=[dict(label='Global Active Power',
+                                     values=data_daily_grp['Global_active_power']),
+                                dict(label='Sub 1',
+                                     values=data_daily_grp['Sub_metering_1']),
+                                dict(label='Sub 2',
+                                     values=data_daily_grp['Sub_metering_2']),
+                                dict(label='Sub 3',
+                                     values=data_daily_grp['Sub_metering_3'])], 
+                    showupperhalf=False,
+                    diagonal_visible=False,
+                    marker=dict(
+                                showscale=False, # colors encode categorical variables
+                                line_color='white', line_width=0.5)
+                    ))
+
+        # Setting up the layout
+        fig_pair.update_layout(
+            title_text='<b>All attributes - Scatter plot</b>',
+            title_x=0.5,
+            dragmode='select',
+            paper_bgcolor='#2E3137',
+            autosize=True,
+            hovermode='closest')
+        return fig_pair
+
+    charts.add(st.empty(), dataset_version, 'pair', build_pair)
+
+    # ENERGY BREAKDOWN
+    st.subheader('Energy Breakdown')
+    st.markdown("""The unmetered energy (global_active_power*1000/60 - sub_metering_1 - 
+    sub_metering_2 - sub_metering_3) is stored at ingest next to the measured attributes, 
+    together with the apparent power and the power factor.""")
+
+    def build_breakdown():
+        '''Builds the daily energy per sub metering and the daily mean power factor'''
+        data_factor = pyramid.frame('day', measures=['Power_factor'], stat='mean', gap_policy='skip')
+        fig_breakdown = make_subplots(specs=[[{'secondary_y':True}]])
+        for measure, name in [('Sub_metering_1', 'Sub_1'), ('Sub_metering_2', 'Sub_2'),
+                              ('Sub_metering_3', 'Sub_3'), ('Unmetered_energy', 'Unmetered')]:
+            x_energy, y_energy = downsample.xy(data_daily_grp['Date_time'], data_daily_grp[measure])
+            fig_breakdown.add_trace(go.Scatter(x=x_energy, y=y_energy, name=name, stackgroup='energy'),
+                                    secondary_y=False)
+        x_factor, y_factor = downsample.xy(data_factor['Date_time'], data_factor['Power_factor'])
+        fig_breakdown.add_trace(go.Scatter(x=x_factor, y=y_factor, name='Power Factor',
+                                           line=dict(color='white', width=1)), secondary_y=True)
+
+        # Setting the names of y axes for each plot
+        fig_breakdown.update_yaxes(title_text="Watt-hour <b>[Wh]</b>")
+        fig_breakdown.update_yaxes(title_text="Power Factor", secondary_y=True)
+        fig_breakdown.update_layout(title_text='<b>Daily Energy per Sub Metering</b>',
+                        title_x=0.5,
+                        paper_bgcolor='#2E3137',
+                        autosize=True,
+                        legend=dict(orientation="h",
+                        yanchor="bottom",
+                        y=1,
+                        xanchor="center",
+                        x=0.5))
+        return fig_breakdown
+
+    charts.add(st.empty(), dataset_version, 'breakdown', build_breakdown)
 
     # MOVING AVERAGES
     st.subheader('Moving Average')
 
-    #Testing stationary
-    ts = data_daily_grp[['Date_time', 'Global_active_power']]
-    ts.set_index('Date_time', inplace=True)
-    mte = data_daily_grp['Global_active_power']
+    # Windows are counted in buckets of the chosen resolution
+    col_level, col_windows = st.beta_columns(2)
+    mv_level = col_level.selectbox('Moving average resolution', ['hour', 'day'], index=1,
+                                   format_func=rollups.LEVEL_TITLES.get)
+    mv_windows = col_windows.multiselect('Windows', [3, 7, 12, 24, 30, 168], default=[12])
 
-    #
-    def TestStationaryAdfuller(ts, cutoff = 0.01):
-        ts_test = adfuller(ts, autolag = 'AIC')
-        ts_test_output = pd.Series(ts_test[0:4], index=['Test Statistic','p-value','#Lags Used','Number of Observations Used'])
-        
-        for key,value in ts_test[4].items():
-            ts_test_output['Critical Value (%s)'%key] = value
-        print(ts_test_output)
-        
-        if ts_test[1] <= cutoff:
-            print("Strong evidence against the null hypothesis, reject the null hypothesis. Data has no unit root, hence it is stationary")
-        else:
-            print("Weak evidence against null hypothesis, time series has a unit root, indicating it is non-stationary ")
-
-    # Moving Averages
-    moving_avg = mte.rolling(12).mean()
-
-    fig_mv = go.Figure()
-
-    fig_mv.add_trace(go.Scatter(
-        y=mte, name='Global Active Power'
-    ))
-
-    fig_mv.add_trace(go.Scatter(
-        y=moving_avg, name='Moving Average'
-    ))
-
-    # Title settings
-    fig_mv.update_layout(
-        title={
-            'text': '<b>Moving Average on Global Active Power</b>',
-            'y':0.9,
-            'x':0.5,
-            'xanchor': 'center',
-            'yanchor': 'top'})
-
-    # Legend settings
-    fig_mv.update_layout(legend=dict(
-        orientation="h",
-        yanchor="bottom",
-        y=1,
-        xanchor="right",
-        x=1),
-        paper_bgcolor='#2E3137'
-        )
-    st.plotly_chart(fig_mv, use_container_width=True)
+    def build_moving_average():
+        '''Builds the moving average chart'''
+        # Moving Averages
+        moving = rolling.rolling_frame(pyramid, mv_level, 'Global_active_power', mv_windows or [12])
+
+        fig_mv = go.Figure()
+
+        x_mte, y_mte = downsample.xy(moving['Date_time'], moving['Global_active_power'])
+        fig_mv.add_trace(go.Scatter(
+            x=x_mte, y=y_mte, name='Global Active Power'
+        ))
+
+        for window in mv_windows or [12]:
+            x_avg, y_avg = downsample.xy(moving['Date_time'], moving[f'mean_{window}'])
+            fig_mv.add_trace(go.Scatter(
+                x=x_avg, y=y_avg, name=f'Moving Average ({window})'
+            ))
+
+        # Title settings
+        fig_mv.update_layout(
+            title={
+                'text': '<b>Moving Average on Global Active Power</b>',
+                'y':0.9,
+                'x':0.5,
+                'xanchor': 'center',
+                'yanchor': 'top'})
+
+        # Legend settings
+        fig_mv.update_layout(legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1,
+            xanchor="right",
+            x=1),
+            paper_bgcolor='#2E3137'
+            )
+        return fig_mv
+
+    charts.add(st.empty(), dataset_version, 'moving_average', build_moving_average,
+               level=mv_level, windows=sorted(mv_windows))
 
     # DECOMPOSITION
-    st.subheader('Daily Seasonal Decompose')
-    mte.index = pd.to_datetime(data_daily_grp['Date_time'])
-    decomposition = seasonal_decompose(mte, freq=7)
-
-    trend = decomposition.trend
-    seasonal = decomposition.seasonal
-    residual = decomposition.resid
-
-    fig_dec = make_subplots(rows=4, cols=1)
-
-    fig_dec.add_trace(go.Scatter(
-        y=mte, name='Original'
-    ), row=1, col=1)
-
-    fig_dec.add_trace(go.Scatter(
-        y=trend, name='Trend'
-    ), row=2, col=1)
-
-    fig_dec.add_trace(go.Scatter(
-        y=seasonal, name='Seasonality'
-    ), row=3, col=1)
-
-    fig_dec.add_trace(go.Scatter(
-        y=residual, name='Residuals'
-    ), row=4, col=1)
-
-    # Title settings
-    fig_dec.update_layout(
-        title={
-            'text': '<b>Daily Decomposition of Trend/Seasonality/Residuality</b>',
-            'y':0.96,
-            'x':0.5,
-            'xanchor': 'center',
-            'yanchor': 'top'},
-            height=800)
-
-    # Legend settings
-    fig_dec.update_layout(legend=dict(
-        orientation="h",
-        yanchor="bottom",
-        y=1,
-        xanchor="right",
-        x=1),
-        paper_bgcolor='#2E3137'
-        )
-
-    st.plotly_chart(fig_dec, use_container_width=True)
+    st.subheader('Seasonal Decompose')
+    col_period, col_method = st.beta_columns(2)
+    period = col_period.selectbox('Seasonality', list(decompositions.PERIODS), index=1)
+    method = col_method.selectbox('Method', ['Classical', 'STL'])
+    def build_decomposition():
+        '''Builds the seasonal decomposition chart'''
+        # Computed once per dataset version and stored next to the rollups
+        decomposition = decompositions.decompose(pyramid, period, method.lower())
+        dates = decomposition['Date_time']
+
+        trend = decomposition['trend']
+        seasonal = decomposition['seasonal']
+        residual = decomposition['resid']
+
+        fig_dec = make_subplots(rows=4, cols=1)
+
+        x_dec, y_dec = downsample.xy(dates, decomposition['observed'])
+        fig_dec.add_trace(go.Scatter(
+            x=x_dec, y=y_dec, name='Original'
+        ), row=1, col=1)
+
+        x_dec, y_dec = downsample.xy(dates, trend)
+        fig_dec.add_trace(go.Scatter(
+            x=x_dec, y=y_dec, name='Trend'
+        ), row=2, col=1)
+
+        x_dec, y_dec = downsample.xy(dates, seasonal)
+        fig_dec.add_trace(go.Scatter(
+            x=x_dec, y=y_dec, name='Seasonality'
+        ), row=3, col=1)
+
+        x_dec, y_dec = downsample.xy(dates, residual)
+        fig_dec.add_trace(go.Scatter(
+            x=x_dec, y=y_dec, name='Residuals'
+        ), row=4, col=1)
+
+        # Title settings
+        fig_dec.update_layout(
+            title={
+                'text': f'<b>{period.capitalize()} Decomposition of Trend/Seasonality/Residuality</b>',
+                'y':0.96,
+                'x':0.5,
+                'xanchor': 'center',
+                'yanchor': 'top'},
+                height=800)
+
+        # Legend settings
+        fig_dec.update_layout(legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1,
+            xanchor="right",
+            x=1),
+            paper_bgcolor='#2E3137'
+            )
+        return fig_dec
+
+    # Periods longer than half of the data cannot be decomposed
+    charts.add(st.empty(), dataset_version, 'decomposition', build_decomposition,
+               errors={ValueError: f'No {period} decomposition for this data: {{error}}'},
+               period=period, method=method)
 
     
     # CONCLUSION
@@ -437,3 +536,6 @@ def app():
     """)
 
     st.markdown('Now, we can move on to the **Forecasting.**')
+
+    # Drawing the charts still being built, in the order they finish
+    charts.fill()
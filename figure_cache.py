@@ -0,0 +1,107 @@
+# Load standard libraries
+import collections
+import json
+import threading
+
+# Load Viz libraries
+import plotly.io as pio
+import instrument
+
+# Caps of the process-wide figure cache
+MAX_ENTRIES = 256
+MAX_BYTES = 64 * 1048576
+
+
+class FigureCache:
+    '''LRU cache of serialized Plotly figures with an entry and a size cap'''
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(version, figure_id, **widgets):
+        '''Builds a hashable key from the dataset version, the figure and the widget values'''
+        return version, figure_id, json.dumps(widgets, sort_keys=True, default=str)
+
+    def get(self, key):
+        '''Returns the cached figure JSON and marks it as recently used, or None'''
+        with self._lock:
+            fig_json = self._entries.get(key)
+            if fig_json is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fig_json
+
+    def put(self, key, fig_json):
+        '''Stores a figure JSON and evicts the least recently used entries over the caps'''
+        size = len(fig_json)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= len(self._entries.pop(key))
+            self._entries[key] = fig_json
+            self.nbytes += size
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def figure(self, version, figure_id, build, **widgets):
+        '''Returns the cached figure, calling build() only when it is not cached yet'''
+        key = self.key(version, figure_id, **widgets)
+        fig_json = self.get(key)
+        if fig_json is None:
+            with instrument.stage('figure_build'):
+                fig = build()
+            with instrument.stage('figure_serialize'):
+                fig_json = fig.to_json()
+            self.put(key, fig_json)
+            return fig
+        return pio.from_json(fig_json)
+
+    def figure_json(self, version, figure_id, build, **widgets):
+        '''Returns the cached figure JSON, calling build() only when it is not cached yet'''
+        key = self.key(version, figure_id, **widgets)
+        fig_json = self.get(key)
+        if fig_json is None:
+            with instrument.stage('figure_build'):
+                fig = build()
+            with instrument.stage('figure_serialize'):
+                fig_json = fig.to_json()
+            self.put(key, fig_json)
+        return fig_json
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# One cache shared by every session of the process
+_CACHE = FigureCache()
+
+
+def cached_figure(version, figure_id, build, **widgets):
+    '''Returns a figure from the process-wide cache, building it on a miss'''
+    return _CACHE.figure(version, figure_id, build, **widgets)
+
+
+def cached_figure_json(version, figure_id, build, **widgets):
+    '''Returns a figure's JSON from the process-wide cache, building it on a miss'''
+    return _CACHE.figure_json(version, figure_id, build, **widgets)
+
+
+def lookup_json(version, figure_id, **widgets):
+    '''Returns a figure's JSON when the process-wide cache has it, or None'''
+    return _CACHE.get(FigureCache.key(version, figure_id, **widgets))
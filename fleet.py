@@ -0,0 +1,96 @@
+# Load standard libraries
+import hashlib
+import os
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+import gaps
+import instrument
+import rollups
+
+
+@instrument.timed('groupby')
+def group_by(keys, values):
+    '''Sums the value columns per unique combination of the integer key columns
+
+    One sort orders every row by its keys, every value column is then reduced
+    with a single reduceat, whatever the number of groups. Returns the keys of
+    every group and the sums of every value column.
+    '''
+    order = np.lexsort(keys[::-1])
+    keys = [np.asarray(key)[order] for key in keys]
+    if not len(order):
+        return keys, {name: np.zeros(0) for name in values}
+    change = np.zeros(len(order), dtype=bool)
+    change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    first_rows = np.flatnonzero(change)
+    sums = {name: np.add.reduceat(np.asarray(column)[order], first_rows) for name, column in values.items()}
+    return [key[first_rows] for key in keys], sums
+
+
+def fleet_version(meters=None):
+    '''Returns a label that changes whenever one of the meters gets new readings'''
+    digest = hashlib.sha256()
+    for meter in meters or ingestion.meter_ids():
+        meta = ingestion.read_meta(ingestion.meter_paths(meter)['cache_dir'])
+        digest.update(f'{meter}:{ingestion.dataset_version(meta) if meta else None};'.encode())
+    return digest.hexdigest()[:24]
+
+
+def fleet_columns(level='day', measures=ingestion.DAILY_MEASURES, meters=None):
+    '''Concatenates the rollup sums and counts of many meters into long columns with a meter code'''
+    meters = list(meters or ingestion.meter_ids())
+    parts = []
+    for code, meter in enumerate(meters):
+        paths = ingestion.meter_paths(meter)
+        rollups.build_rollups(cache_dir=paths['cache_dir'], rollup_dir=paths['rollup_dir'])
+        level_dir = os.path.join(paths['rollup_dir'], level)
+        columns = {name: np.load(os.path.join(level_dir, name + '.npy'), mmap_mode='r')
+                   for name in [ingestion.TIMESTAMP] + [f'{measure}_{stat}' for measure in measures
+                                                        for stat in ('sum', 'count')]}
+        columns[ingestion.METER_ID] = np.full(len(columns[ingestion.TIMESTAMP]), code, dtype=np.int32)
+        # Minutes every bucket should have, within the span of the meter's readings
+        partitions = [part for part in ingestion.read_meta(paths['cache_dir'])['partitions'] if part['rows']]
+        columns['expected'] = gaps.expected_minutes(
+            columns[ingestion.TIMESTAMP], rollups.bucket_widths(level, columns[ingestion.TIMESTAMP]),
+            min(part['start'] for part in partitions), max(part['end'] for part in partitions))
+        parts.append(columns)
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]} if parts else {}
+    return meters, columns
+
+
+def fleet_frame(level='day', measures=ingestion.DAILY_MEASURES, meters=None, by_meter=False,
+                gap_policy='zero', min_coverage=gaps.MIN_COVERAGE):
+    '''Returns the sums of the measures over many meters, per bucket or per meter and bucket
+
+    The meters column counts the meters with at least one reading in the bucket.
+    gap_policy applies to every meter's own buckets before they are summed, see
+    gaps.POLICIES.
+    '''
+    meters, columns = fleet_columns(level, measures, meters)
+    if not columns:
+        return pd.DataFrame(columns=[ingestion.TIMESTAMP] + list(measures) + ['meters'])
+    keys = [columns[ingestion.METER_ID], columns[ingestion.TIMESTAMP]] if by_meter else [columns[ingestion.TIMESTAMP]]
+    values = {measure: columns[f'{measure}_sum'] for measure in measures}
+    kept = np.ones(len(columns[ingestion.TIMESTAMP]), dtype=bool)
+    if gap_policy != 'zero':
+        for measure in measures:
+            values[measure], _, keep = gaps.apply_policy(
+                columns[ingestion.TIMESTAMP], values[measure], columns[f'{measure}_count'], columns['expected'],
+                gap_policy, min_coverage, series=columns[ingestion.METER_ID])
+            kept &= keep
+    reporting = np.zeros(len(columns[ingestion.TIMESTAMP]), dtype=bool)
+    for measure in measures:
+        reporting |= columns[f'{measure}_count'] > 0
+    values['meters'] = reporting.astype(np.int64)
+    keys, sums = group_by([key[kept] for key in keys], {name: column[kept] for name, column in values.items()})
+
+    data = pd.DataFrame(sums)
+    data.insert(0, ingestion.TIMESTAMP, keys[-1].astype('datetime64[m]').astype('datetime64[ns]'))
+    if by_meter:
+        data.insert(0, ingestion.METER_ID, np.asarray(meters, dtype=object)[keys[0]])
+    return data
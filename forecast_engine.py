@@ -0,0 +1,233 @@
+# Load standard libraries
+import concurrent.futures
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+import registry
+
+FORECAST_DIR = os.path.join(ingestion.DATA_DIR, 'forecasts')
+
+# Fits run in worker processes so the pages never block on Stan or statsmodels
+WORKERS = int(os.environ.get('POWER_FORECAST_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Split and target used by the notebooks and the stored forecasts
+DEFAULT_CUTOFF = pd.Timestamp('2010-09-13')
+DEFAULT_HORIZON = 90
+TARGET = 'Global_active_power'
+REGRESSORS = ['Sub_metering_1', 'Sub_metering_2', 'Sub_metering_3']
+
+# Parameters of the multivariate models of the notebooks
+DEFAULT_PARAMS = {
+    'FBProphet': {
+        'yearly_seasonality': True,
+        'weekly_seasonality': True,
+        'daily_seasonality': True,
+        'monthly_period': 30.5,
+        'monthly_fourier_order': 5,
+        'regressors': REGRESSORS,
+    },
+    # Best auto-ARIMA model of the notebook: ARIMA(2,0,1)(0,0,0)[0] intercept
+    'ARIMA': {
+        'order': [2, 0, 1],
+        'seasonal_order': [0, 0, 0, 0],
+        'trend': 'c',
+        'regressors': REGRESSORS,
+    },
+}
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_PENDING = {}
+_PENDING_LOCK = threading.Lock()
+
+
+def clean_daily(data, by=None):
+    '''Fills the days left without data with the mean and drops outlier days, for one or many series at once
+
+    Missing readings are handled by the gap policy of the aggregate, days it
+    leaves as NaN get the mean of their series. by names a series id column.
+    Days outside 100 < Global_active_power < 3000 are removed like in the notebooks.
+    '''
+    values = data[TARGET].to_numpy(dtype=np.float64)
+    codes = pd.factorize(data[by])[0] if by else np.zeros(len(values), dtype=np.int64)
+    valid = ~np.isnan(values)
+    # Per series mean of the valid days in two bincounts
+    sums = np.bincount(codes, weights=np.where(valid, values, 0))
+    counts = np.bincount(codes, weights=valid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    filled = np.where(valid, values, means[codes])
+    data = data.assign(**{TARGET: filled})
+    return data[(filled < 3000) & (filled > 100)]
+
+
+def daily_data(meter=ingestion.DEFAULT_METER):
+    '''Loads the cleaned daily sums of a meter, the data every model of the app is fitted on'''
+    paths = ingestion.meter_paths(meter)
+    data = ingestion.load_aggregate('daily', aggregate_dir=paths['aggregate_dir'], cache_dir=paths['cache_dir'],
+                                    gap_policy='fill')
+    return clean_daily(data)
+
+
+def split(data, cutoff=DEFAULT_CUTOFF, horizon=DEFAULT_HORIZON):
+    '''Splits cleaned daily data into the days before the cutoff and the horizon after it'''
+    cutoff = pd.Timestamp(cutoff)
+    stamps = data[ingestion.TIMESTAMP]
+    train = data[stamps < cutoff]
+    test = data[(stamps >= cutoff) & (stamps < cutoff + pd.Timedelta(days=horizon))]
+    return train, test
+
+
+def arrays(frame, regressors):
+    '''Keeps the columns a fit needs as plain arrays, cheap to send to a worker'''
+    columns = {ingestion.TIMESTAMP: frame[ingestion.TIMESTAMP].to_numpy(dtype='datetime64[ns]'),
+               TARGET: frame[TARGET].to_numpy(dtype=np.float64)}
+    for name in regressors:
+        columns[name] = frame[name].to_numpy(dtype=np.float64)
+    return columns
+
+
+def forecast_key(model, train, test, params):
+    '''Hashes the model, its parameters and the exact rows it is fitted and evaluated on'''
+    digest = hashlib.sha256(json.dumps([model, params], sort_keys=True).encode())
+    for columns in (train, test):
+        for name in sorted(columns):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(columns[name]).tobytes())
+    return digest.hexdigest()
+
+
+def fit_prophet(train, test, params):
+    '''Fits the multivariate Prophet model and predicts the test days'''
+    from fbprophet import Prophet
+
+    model = Prophet(
+        yearly_seasonality=params['yearly_seasonality'],
+        weekly_seasonality=params['weekly_seasonality'],
+        daily_seasonality=params['daily_seasonality'])
+    model.add_seasonality(
+        name='monthly',
+        period=params['monthly_period'],
+        fourier_order=params['monthly_fourier_order'])
+    for name in params['regressors']:
+        model.add_regressor(name)
+
+    rename = {ingestion.TIMESTAMP: 'ds', TARGET: 'y'}
+    model.fit(pd.DataFrame(train).rename(columns=rename))
+    forecast = model.predict(pd.DataFrame(test).rename(columns=rename))
+    return {
+        'ds': forecast['ds'].to_numpy(dtype='datetime64[ns]'),
+        'yhat': forecast['yhat'].to_numpy(dtype=np.float64),
+        'yhat_lower': forecast['yhat_lower'].to_numpy(dtype=np.float64),
+        'yhat_upper': forecast['yhat_upper'].to_numpy(dtype=np.float64),
+    }
+
+
+def fit_sarimax(train, test, params):
+    '''Fits the SARIMAX model with the sub meterings as exogenous inputs and predicts the test days'''
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    exog = params['regressors']
+    model = SARIMAX(
+        train[TARGET],
+        exog=np.column_stack([train[name] for name in exog]) if exog else None,
+        order=tuple(params['order']),
+        seasonal_order=tuple(params['seasonal_order']),
+        trend=params['trend'])
+    fitted = model.fit(disp=False)
+    prediction = fitted.get_forecast(
+        len(test[TARGET]),
+        exog=np.column_stack([test[name] for name in exog]) if exog else None)
+    bounds = np.asarray(prediction.conf_int())
+    return {
+        'ds': test[ingestion.TIMESTAMP],
+        'yhat': np.asarray(prediction.predicted_mean, dtype=np.float64),
+        'yhat_lower': bounds[:, 0].astype(np.float64),
+        'yhat_upper': bounds[:, 1].astype(np.float64),
+    }
+
+
+FITTERS = {
+    'FBProphet': fit_prophet,
+    'ARIMA': fit_sarimax,
+}
+
+
+def _fit(model, train, test, params, path):
+    '''Runs in a worker process: fits one model and writes its forecast atomically'''
+    forecast = FITTERS[model](train, test, params)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # The page and a background pipeline run may fit the same forecast at once
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp.npz', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        np.savez_compressed(f, **forecast)
+    os.replace(tmp_path, path)
+    return path
+
+
+def pool():
+    '''Returns the process-wide worker pool, starting it on first use'''
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = concurrent.futures.ProcessPoolExecutor(max_workers=WORKERS)
+        return _POOL
+
+
+def _reset_pool():
+    '''Drops a pool broken by a crashed worker so the next fit starts a new one'''
+    global _POOL
+    with _POOL_LOCK:
+        _POOL = None
+
+
+def submit(model, data, cutoff=DEFAULT_CUTOFF, horizon=DEFAULT_HORIZON, params=None, forecast_dir=FORECAST_DIR):
+    '''Returns a future of the forecast file of one model
+
+    Forecasts already on disk resolve at once, a configuration that is already
+    being fitted shares the running fit.
+    '''
+    params = params or DEFAULT_PARAMS[model]
+    train, test = split(data, cutoff, horizon)
+    if not len(train) or not len(test):
+        raise ValueError(f'No days to fit before or to forecast after the cutoff {cutoff}')
+    train, test = arrays(train, params['regressors']), arrays(test, params['regressors'])
+    key = forecast_key(model, train, test, params)
+    path = os.path.join(forecast_dir, f'{model}-{key[:24]}.npz')
+
+    with _PENDING_LOCK:
+        future = _PENDING.get(key)
+        if future is not None:
+            return future
+        if os.path.exists(path):
+            future = concurrent.futures.Future()
+            future.set_result(path)
+            return future
+        try:
+            future = pool().submit(_fit, model, train, test, params, path)
+        except concurrent.futures.process.BrokenProcessPool:
+            _reset_pool()
+            future = pool().submit(_fit, model, train, test, params, path)
+        _PENDING[key] = future
+
+    def _done(done):
+        with _PENDING_LOCK:
+            _PENDING.pop(key, None)
+        if not done.cancelled() and isinstance(done.exception(), concurrent.futures.process.BrokenProcessPool):
+            _reset_pool()
+
+    future.add_done_callback(_done)
+    return future
+
+
+def forecasts(models, data, cutoff=DEFAULT_CUTOFF, horizon=DEFAULT_HORIZON, timeout=None, forecast_dir=FORECAST_DIR):
+    '''Fits the models in parallel, or reads their cached forecasts, and returns them as dicts of arrays'''
+    futures = {model: submit(model, data, cutoff, horizon, forecast_dir=forecast_dir) for model in models}
+    return {model: registry.get_artifact(future.result(timeout)).value for model, future in futures.items()}
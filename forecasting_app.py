@@ -1,24 +1,21 @@
 # Load Framework library
-import fbprophet
-from traitlets.traitlets import default
 import streamlit as st
 
 # Load Data libraries
 import pandas as pd
-import numpy as np
+import ingestion
+import downsample
+import jobs
+import registry
+import forecast_engine
+import backtest
+import order_search
+import pipeline
 
 # Load Viz libraries
 import plotly.graph_objects as go
-import plotly.express as px
-import plotly.figure_factory as ff
 from plotly.subplots import make_subplots
 
-# Load ML libraries
-from fbprophet import Prophet, models
-from fbprophet.diagnostics import cross_validation, performance_metrics
-from fbprophet.plot import plot, plot_plotly, plot_components_plotly
-import pickle
-
 def app():
     st.markdown(""" ## Page: **Forecasting**""")
 
@@ -36,72 +33,52 @@ def app():
     clearly has seasonalities and why we are going with the selected models.
                     """)
 
-    # Loading the data
-    # data_url = ('household_power_consumption_final.csv')
-    data_url = 'https://archive.ics.uci.edu/ml/machine-learning-databases/00235/household_power_consumption.zip'
-
-
-    # @st.cache(persist=True)
-    # def load_data():
-    #     '''Loads the data and converts Date into Datetime'''
-    #     data = pd.read_csv(data_url, low_memory=False)
-    #     data['Date_time'] = pd.to_datetime(data['Date_time'])
-    #     data_daily_grp = data.groupby(
-    #     pd.Grouper(key='Date_time', freq='D')).agg({'Global_active_power':'sum', 
-    #                                                 'Sub_metering_1':'sum', 
-    #                                                 'Sub_metering_2':'sum', 
-    #                                                 'Sub_metering_3':'sum'}).reset_index()
-
-    @st.cache(persist=True)
-    def load_data():
-        '''Loads the data and converts Date into Datetime'''
-        data = pd.read_csv(data_url, delimiter=';', low_memory=False, 
-                            usecols=['Date', 'Time', 'Global_active_power',
-                                    'Sub_metering_1', 'Sub_metering_2', 'Sub_metering_3'])
-        # Converting the date and time columns into Datetime series
-        data['Date_time'] = pd.to_datetime(data.pop('Date')) + pd.to_timedelta(data.pop('Time'))
-        # Replacing '?' to NaN values
-        data.replace('?', np.nan, inplace=True)
-        # Dropping all NaN values
-        # data.dropna(how="any", inplace=True)
-        # Converting the data types for all columns except date_time and week_num
-        cols = [i for i in data.columns if i not in ['Date_time']]
-        for col in cols:
-            data[col] = pd.to_numeric(data[col], downcast='integer')
-
-        data_daily_grp = data.groupby(
-        pd.Grouper(key='Date_time', freq='D')).agg({'Global_active_power':'sum', 
-                                                    'Sub_metering_1':'sum', 
-                                                    'Sub_metering_2':'sum', 
-                                                    'Sub_metering_3':'sum'}).reset_index()
-    
-        # Converting all zero values to the mean of Global_active_power
-        data_daily_grp['Global_active_power'] = data_daily_grp['Global_active_power'].replace(0, np.nan).fillna(data_daily_grp['Global_active_power'].mean())
-
-        # Removing all outliers from Global_active_power
-        data_daily_grp = data_daily_grp[((data_daily_grp['Global_active_power'] < 3000) & (data_daily_grp['Global_active_power'] > 100))]
-        
-        return data_daily_grp
+    # Picking the meter, only its partitions are read
+    meter = st.sidebar.selectbox('Meter', ingestion.meter_ids())
+    meter_paths = ingestion.meter_paths(meter)
+
+    # Figures and data are cached per dataset version and widget values
+    dataset_version = ingestion.dataset_version(ingestion.build_aggregates(
+        aggregate_dir=meter_paths['aggregate_dir'], cache_dir=meter_paths['cache_dir']))
+
+    # Loading the daily aggregates from the shared ingestion layer
+    @st.cache(allow_output_mutation=True)
+    def load_data(dataset_version, meter):
+        '''Loads the data and groups it on daily interval'''
+        # Daily sums with the missing days filled and the outliers of Global_active_power removed,
+        # the same data pipeline.py fits the forecasts on
+        return forecast_engine.daily_data(meter)
 
     # Saving the data into df variable
-    data_daily_grp = load_data()
+    data_daily_grp = load_data(dataset_version, meter)
 
     # FORECASTING - FBPROPHET
     # Renaming the columns
     # data_daily_grp = data_daily_grp.rename(columns={'Date_time':'ds', 'Global_active_power':'y'})
 
-    # Train - Test Split -> test data will have 90 days
-    threshold_date = pd.to_datetime('2010-09-13')
+    # Plotting the train and test split
+    st.subheader('Plot Train and Test split')
 
-    # threashold_date1 = len(data_daily_grp)-90
-    mask = data_daily_grp['Date_time'] < threshold_date
+    # Train - Test Split -> test data will have 90 days by default, both can be changed
+    col_cutoff, col_horizon = st.beta_columns(2)
+    # The default cutoff is kept inside the dates of the selected meter
+    last_date = data_daily_grp['Date_time'].max()
+    first_cutoff = min(data_daily_grp['Date_time'].min() + pd.Timedelta(days=365), last_date)
+    threshold_date = pd.to_datetime(col_cutoff.date_input(
+        'Train / test cutoff',
+        value=min(max(forecast_engine.DEFAULT_CUTOFF, first_cutoff), last_date).date(),
+        min_value=first_cutoff.date(),
+        max_value=last_date.date()))
+    horizon = col_horizon.slider('Forecast horizon (days)', min_value=7, max_value=365,
+                                 value=forecast_engine.DEFAULT_HORIZON)
+    # The stored forecasts are those of the UCI household, other meters read the ones of pipeline.py
+    stored_split = (threshold_date, horizon) == (forecast_engine.DEFAULT_CUTOFF, forecast_engine.DEFAULT_HORIZON) \
+        and meter == ingestion.DEFAULT_METER
 
     # Spliting the data
-    data_train = data_daily_grp[mask][['Date_time', 'Global_active_power']]
-    data_test = data_daily_grp[~mask][['Date_time', 'Global_active_power']]
-
-    # Plotting the train and test split
-    st.subheader('Plot Train and Test split')
+    data_train, data_test = forecast_engine.split(data_daily_grp, threshold_date, horizon)
+    data_train = data_train[['Date_time', 'Global_active_power']]
+    data_test = data_test[['Date_time', 'Global_active_power']]
     st_train = len(data_train)
     st_test = len(data_test)
 
@@ -112,42 +89,49 @@ def app():
         While the test data will contain {st_test} days and preventing
         the model from observing that data, in order to evaluate it later.
     """)
-    # Plotting the train and test dataset
-    fig_split = make_subplots()
-    fig_split.add_trace(go.Scatter(
-        x=data_train['Date_time'],
-        y=data_train['Global_active_power'],
-        name='Y_Train'
-        ))
-
-    fig_split.add_trace(go.Scatter(
-        x=data_test['Date_time'],
-        y=data_test['Global_active_power'],
-        name='Y_Test'
-        ))
-
-    # Setting up the names
-    fig_split.update_yaxes(title_text="<b>Power</b> kilowatt [kW]", gridcolor='#4a4e69')
-    fig_split.update_xaxes(title_text="<b>Dates", showgrid=False)
-
-    # Setting up the layout
-    fig_split.update_layout(
-        title={
-        'text': "<b>Train and Test data split</b>",
-        'y':0.9,
-        'x':0.5,
-        'xanchor': 'center',
-        'yanchor': 'top'},
-        paper_bgcolor='#2E3137', 
-        autosize=True, 
-        legend=dict(
-                    orientation="h",
-                    yanchor="top",
-                    y=1.12,
-                    xanchor="center",
-                    x=0.5))
-    # Showing the plot
-    st.plotly_chart(fig_split, use_container_width=True)
+    def build_split():
+        '''Builds the train and test split chart'''
+        # Plotting the train and test dataset
+        fig_split = make_subplots()
+        x_train, y_train = downsample.xy(data_train['Date_time'], data_train['Global_active_power'])
+        fig_split.add_trace(go.Scatter(
+            x=x_train,
+            y=y_train,
+            name='Y_Train'
+            ))
+
+        x_test, y_test = downsample.xy(data_test['Date_time'], data_test['Global_active_power'])
+        fig_split.add_trace(go.Scatter(
+            x=x_test,
+            y=y_test,
+            name='Y_Test'
+            ))
+
+        # Setting up the names
+        fig_split.update_yaxes(title_text="<b>Power</b> kilowatt [kW]", gridcolor='#4a4e69')
+        fig_split.update_xaxes(title_text="<b>Dates", showgrid=False)
+
+        # Setting up the layout
+        fig_split.update_layout(
+            title={
+            'text': "<b>Train and Test data split</b>",
+            'y':0.9,
+            'x':0.5,
+            'xanchor': 'center',
+            'yanchor': 'top'},
+            paper_bgcolor='#2E3137', 
+            autosize=True, 
+            legend=dict(
+                        orientation="h",
+                        yanchor="top",
+                        y=1.12,
+                        xanchor="center",
+                        x=0.5))
+        return fig_split
+
+    # Charts are built in background jobs and shown as each one finishes
+    charts = jobs.Charts()
+    charts.add(st.empty(), dataset_version, 'split', build_split, cutoff=threshold_date, horizon=horizon)
     st.markdown("____")
 
     # Decomposition
@@ -181,114 +165,176 @@ def app():
         - stepwise=True,
     ''')
 
-    # Loading the FBProphet Forecast
-    path = 'FBProphet_model_pickle.sav'
-
-    pickle_in_fbp = open(path, 'rb')
-    forecast_fbp = pickle.load(pickle_in_fbp)
-
-    # Loading the ARIMA Forecast
-    path = 'ARIMA_model_pickle.sav'
-
-    pickle_in_arm = open(path, 'rb')
-    forecast_arm = pickle.load(pickle_in_arm)
-
-    # Adding the Arima forecast to test data for ploting
-    data_test['Forecast_Arima'] = forecast_arm
+    # Searching the ARIMA order on the selected split, each fit is kept per training window
+    if st.button('Search the ARIMA order'):
+        with st.spinner('Fitting the candidate orders...'):
+            order_result = order_search.search(data_daily_grp, threshold_date)
+        st.markdown(f'''
+            Best model: **SARIMAX{order_result['order']}{order_result['seasonal_order']}**
+            with AIC {order_result['aic']:.1f} -
+            {order_result['fits']} fits, {order_result['cache_hits']} read from the cache
+        ''')
 
     # Ploting the Multivariate model
     attribute_select = st.multiselect(
     'Please select a model:', 
     options = ('Global_active_power', 'FBProphet', 'ARIMA'), 
     default = ['Global_active_power'])
-        
-    # Ploting the selected attribute
-    fig_fore = go.Figure()
-
-    # Looping through each attribute
-    for name in attribute_select:
-        if name == 'Global_active_power':
-            fig_fore.add_trace(go.Scatter(
-                x=data_test['Date_time'],
-                y=data_test['Global_active_power'],
-                name='Test data',
-                marker=dict(color='#DB6443')
-                ))
-
-        if name == 'FBProphet':
-            fig_fore.add_trace(go.Scatter(
-                x=forecast_fbp['ds'],
-                y=forecast_fbp['yhat'],
-                name='FBProphet Forecast',
-                marker=dict(color='#2a9d8f')
-                ))
-        if name == 'ARIMA':
-            fig_fore.add_trace(go.Scatter(
-                x=data_test['Date_time'],
-                y=data_test['Forecast_Arima'],
-                name='ARIMA Forecast',
-                marker=dict(color='#f2cc8f')
-                ))
-
-    # Setting up the names
-    fig_fore.update_yaxes(title_text="<b>Power</b> kilowatt [kW]", gridcolor='#4a4e69')
-    fig_fore.update_xaxes(title_text="<b>Dates", showgrid=False)
-
-    # Time range slider
-    fig_fore.update_layout(
-        xaxis=dict(
-            rangeslider=dict(
-                visible=True),
-            type="date"
+
+    # The selected models, besides the test data
+    models = [name for name in attribute_select if name in forecast_engine.FITTERS]
+    if stored_split:
+        def load_forecasts():
+            '''Loads the stored FBProphet and ARIMA Forecasts, once per process'''
+            forecast_arm = registry.load_forecast('ARIMA')
+            forecast_arm = {'ds': data_test['Date_time'].to_numpy()[:len(forecast_arm['yhat'])], 'yhat': forecast_arm['yhat']}
+            return registry.load_forecast('FBProphet'), forecast_arm
+        forecasts_version = registry.forecasts_version()
+    else:
+        def load_forecasts():
+            '''Refits the selected models in parallel worker processes, seen splits come from disk'''
+            refits = forecast_engine.forecasts(models, data_daily_grp, threshold_date, horizon)
+            return refits.get('FBProphet'), refits.get('ARIMA')
+        forecasts_version = 'refit'
+
+    def build_forecast():
+        '''Builds the forecast chart of the selected models'''
+        # Fitting runs in the chart's background job, the page does not wait for it
+        forecast_fbp, forecast_arm = load_forecasts()
+
+        # Ploting the selected attribute
+        fig_fore = go.Figure()
+
+        # Looping through each attribute
+        for name in attribute_select:
+            if name == 'Global_active_power':
+                x_plot, y_plot = downsample.xy(data_test['Date_time'], data_test['Global_active_power'])
+                fig_fore.add_trace(go.Scatter(
+                    x=x_plot,
+                    y=y_plot,
+                    name='Test data',
+                    marker=dict(color='#DB6443')
+                    ))
+
+            if name == 'FBProphet':
+                x_plot, y_plot = downsample.xy(forecast_fbp['ds'], forecast_fbp['yhat'])
+                fig_fore.add_trace(go.Scatter(
+                    x=x_plot,
+                    y=y_plot,
+                    name='FBProphet Forecast',
+                    marker=dict(color='#2a9d8f')
+                    ))
+            if name == 'ARIMA':
+                x_plot, y_plot = downsample.xy(forecast_arm['ds'], forecast_arm['yhat'])
+                fig_fore.add_trace(go.Scatter(
+                    x=x_plot,
+                    y=y_plot,
+                    name='ARIMA Forecast',
+                    marker=dict(color='#f2cc8f')
+                    ))
+
+        # Setting up the names
+        fig_fore.update_yaxes(title_text="<b>Power</b> kilowatt [kW]", gridcolor='#4a4e69')
+        fig_fore.update_xaxes(title_text="<b>Dates", showgrid=False)
+
+        # Time range slider
+        fig_fore.update_layout(
+            xaxis=dict(
+                rangeslider=dict(
+                    visible=True),
+                type="date"
+            )
         )
-    )
-
-    # Setting up the layout
-    fig_fore.update_layout(
-        title={
-        'text': "<b>Forecasting 90 days using FBProphet & ARIMA</b>",
-        'y':0.95,
-        'x':0.5,
-        'xanchor': 'center',
-        'yanchor': 'top'},
-        paper_bgcolor='#2E3137', 
-        autosize=True,
-        height=500,
-        legend=dict(
-                    orientation="h",
-                    yanchor="top",
-                    y=1.2,
-                    xanchor="center",
-                    x=0.5))
-    # Showing the plot
-    st.plotly_chart(fig_fore, use_container_width=True)
+
+        # Setting up the layout
+        fig_fore.update_layout(
+            title={
+            'text': f"<b>Forecasting {horizon} days using {' & '.join(models)}</b>" if models
+                    else f"<b>Test data of the {horizon} days forecast horizon</b>",
+            'y':0.95,
+            'x':0.5,
+            'xanchor': 'center',
+            'yanchor': 'top'},
+            paper_bgcolor='#2E3137', 
+            autosize=True,
+            height=500,
+            legend=dict(
+                        orientation="h",
+                        yanchor="top",
+                        y=1.2,
+                        xanchor="center",
+                        x=0.5))
+        return fig_fore
+
+    # Nothing to fit or to forecast when the cutoff leaves no days on one side
+    if len(data_train) and len(data_test):
+        charts.add(st.empty(), dataset_version, 'forecast', build_forecast,
+                   errors={ValueError: 'No forecast for this split: {error}'},
+                   models=attribute_select, artifacts=forecasts_version, cutoff=threshold_date, horizon=horizon)
+    else:
+        st.warning(f'No days to fit before or to forecast after the cutoff {threshold_date.date()}, '
+                   'please pick an earlier cutoff.')
     st.markdown("____")
 
     st.subheader('Conclusion:')
-    st.markdown('''
-        The Multivariate FBProphet Model performs signaficantly better 
-        than the Multivariate ARIMA Model.
-
-        The model trained on FBProphet algoritham performs 14% better
-        according the MAPE (Mean Absolute Percentage Error) metric,
-        for 30 days of forcasting, which is our goal, to predict the
-        next month of Power Consumption.
-
-        A summary of the models bellow:
-
-        ---
-        >Comparing the performance of the models for **30 days** forecast:
-        - FBProphet vs ARIMA **RMSE**: 160 vs 440 - kWh on Global_active_power
-        - FBProphet vs ARIMA **MAPE**: 7% vs 21% - kWh on Global_active_power
-        ---
-        >Comparing the performance of the models for **60 days** forecast:
-        - FBProphet vs ARIMA **RMSE**: 197 vs 325 - kWh on Global_active_power
-        - FBProphet vs ARIMA **MAPE**: 9% vs 15% - kWh on Global_active_power
-        ---
-        >Comparing the performance of the models for **90 days** forecast:
-        - FBProphet vs ARIMA **RMSE**: 230 vs 354 - kWh on Global_active_power
-        - FBProphet vs ARIMA **MAPE**: 11% vs 25% - kWh on Global_active_power
-    ''')
+
+    # The 30/60/90 days metrics come from a rolling-origin backtest cached per dataset version,
+    # of the models pipeline.py precomputed it for
+    backtest_models = pipeline.built_models()
+    metrics = backtest.cached_metrics(data_daily_grp, dataset_version, backtest_models)
+    if metrics is None:
+        st.markdown(f'''
+            The models are compared with a rolling-origin backtest: {' and '.join(backtest_models)}
+            are refitted on every cutoff and scored on the 30, 60 and 90 days after it.
+            The backtest has not run yet for this version of the data.
+        ''')
+        if st.button('Run the backtest'):
+            with st.spinner('Fitting the models on every cutoff...'):
+                metrics = backtest.load_metrics(backtest.run(data_daily_grp, dataset_version, backtest_models))
+
+    if metrics is not None and len(metrics):
+        mape = metrics.pivot(index='horizon', columns='model', values='mape')
+        rmse = metrics.pivot(index='horizon', columns='model', values='rmse')
+        first = mape.index[0]
+        ranked = list(mape.loc[first].sort_values().index)
+        best = ranked[0]
+        # A single model backtest, as pipeline.py --models builds, has nothing to compare with
+        if len(ranked) > 1:
+            other = ranked[1]
+            st.markdown(f'''
+                The Multivariate {best} Model performs better
+                than the Multivariate {other} Model.
+
+                The model trained on {best} algoritham performs {mape.loc[first, other] - mape.loc[first, best]:.0f}% better
+                according the MAPE (Mean Absolute Percentage Error) metric,
+                for {first} days of forcasting, which is our goal, to predict the
+                next month of Power Consumption.
+
+                A summary of the models over {metrics['cutoffs'].iloc[0]} rolling cutoffs bellow:
+            ''')
+            for days in mape.index:
+                st.markdown(f'''
+                    ---
+                    >Comparing the performance of the models for **{days} days** forecast:
+                    - {best} vs {other} **RMSE**: {rmse.loc[days, best]:.0f} vs {rmse.loc[days, other]:.0f} - kWh on Global_active_power
+                    - {best} vs {other} **MAPE**: {mape.loc[days, best]:.0f}% vs {mape.loc[days, other]:.0f}% - kWh on Global_active_power
+                ''')
+        else:
+            st.markdown(f'''
+                Only the Multivariate {best} Model was backtested, it has a
+                MAPE (Mean Absolute Percentage Error) of {mape.loc[first, best]:.0f}%
+                for {first} days of forcasting, which is our goal, to predict the
+                next month of Power Consumption.
+
+                A summary of the model over {metrics['cutoffs'].iloc[0]} rolling cutoffs bellow:
+            ''')
+            for days in mape.index:
+                st.markdown(f'''
+                    ---
+                    >The performance of the model for **{days} days** forecast:
+                    - {best} **RMSE**: {rmse.loc[days, best]:.0f} - kWh on Global_active_power
+                    - {best} **MAPE**: {mape.loc[days, best]:.0f}% - kWh on Global_active_power
+                ''')
     st.markdown("____")
 
     st.subheader('Futher goal:')
@@ -297,3 +343,6 @@ def app():
         - Run the data through LSTM model
         - Compare it against FBProphet
     ''')
+
+    # Drawing the charts still being built, in the order they finish
+    charts.fill()
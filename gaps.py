@@ -0,0 +1,112 @@
+# Load Data libraries
+import numpy as np
+
+# How the buckets of an aggregate handle missing readings:
+#   zero - sums as they are, gaps count as zero
+#   nan  - buckets below the minimum coverage are NaN
+#   skip - buckets below the minimum coverage are dropped
+#   fill - buckets below the minimum coverage are interpolated from their neighbours
+# Every policy but zero scales the sum of a partly covered bucket up to the whole bucket.
+POLICIES = ['zero', 'nan', 'skip', 'fill']
+
+# Share of a bucket's minutes that need a reading for the bucket to count
+MIN_COVERAGE = 0.5
+
+
+def validity_mask(columns, measures):
+    '''Packs the validity of every measure of a row into one byte, bit i set when measure i is present'''
+    if len(measures) > 8:
+        raise ValueError('The validity mask holds at most 8 measures')
+    mask = np.zeros(len(columns[measures[0]]) if measures else 0, dtype=np.uint8)
+    for bit, measure in enumerate(measures):
+        mask |= (~np.isnan(columns[measure])).astype(np.uint8) << bit
+    return mask
+
+
+def measure_valid(mask, bit):
+    '''Unpacks the validity of one measure from a validity mask'''
+    return (mask >> bit) & 1 == 1
+
+
+def gap_intervals(stamps, mask, complete):
+    '''Returns the [start, end) epoch minute intervals where a measure is missing or no row exists
+
+    complete is the mask value of a row with every measure present. Rows with a
+    missing measure and the minutes skipped between rows are merged into
+    intervals as an (n, 2) array.
+    '''
+    stamps = np.asarray(stamps, dtype=np.int64)
+    bad = np.flatnonzero(mask != complete)
+    holes = np.flatnonzero(np.diff(stamps) > 1)
+    starts = np.concatenate([stamps[bad], stamps[holes] + 1])
+    ends = np.concatenate([stamps[bad] + 1, stamps[holes + 1]])
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], ends[order]
+    if not len(starts):
+        return np.zeros((0, 2), dtype=np.int64)
+    # Touching intervals merge, they never overlap
+    first = np.flatnonzero(np.r_[True, starts[1:] != ends[:-1]])
+    last = np.r_[first[1:] - 1, len(starts) - 1]
+    return np.column_stack([starts[first], ends[last]])
+
+
+def missing_minutes(gaps, starts, ends):
+    '''Counts the gap minutes inside every [start, end) range, two binary searches per range'''
+    gaps = np.asarray(gaps, dtype=np.int64).reshape(-1, 2)
+    before = np.r_[0, np.cumsum(gaps[:, 1] - gaps[:, 0])]
+
+    def _until(t):
+        # Gap minutes before t: the gaps starting before t, minus the part of the last one after t
+        t = np.asarray(t, dtype=np.int64)
+        k = np.searchsorted(gaps[:, 0], t, 'left')
+        overhang = np.where(k > 0, np.maximum(gaps[np.maximum(k - 1, 0), 1] - t, 0), 0) if len(gaps) else 0
+        return before[k] - overhang
+
+    return _until(ends) - _until(starts)
+
+
+def expected_minutes(starts, widths, first=None, last=None):
+    '''Minutes of every bucket that lie within the span of the data, the first and last buckets are partial'''
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = starts + widths
+    if first is not None:
+        starts = np.maximum(starts, first)
+    if last is not None:
+        ends = np.minimum(ends, last + 1)
+    return np.maximum(ends - starts, 0)
+
+
+def apply_policy(stamps, values, counts, expected, policy='zero', min_coverage=MIN_COVERAGE, series=None,
+                 additive=True):
+    '''Applies a gap policy to bucket values in one vectorized pass
+
+    counts are the valid minutes of every bucket and expected the minutes it
+    should have. Sums are additive and get scaled up to the whole bucket, means,
+    minimums and maximums are not. series optionally holds a code per bucket so
+    that the fill policy only interpolates within one series. Returns the
+    values, the coverage of every bucket and the mask of the buckets kept.
+    '''
+    sums = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        coverage = np.where(expected > 0, np.asarray(counts) / np.maximum(expected, 1), 0.0)
+    keep = np.ones(len(sums), dtype=bool)
+    if policy not in POLICIES:
+        raise KeyError(f'Unknown gap policy {policy}')
+    if policy == 'zero':
+        return sums, coverage, keep
+
+    enough = coverage >= min_coverage
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = np.where(enough, sums / np.minimum(coverage, 1) if additive else sums, np.nan)
+    if policy == 'skip':
+        keep = enough
+    elif policy == 'fill':
+        stamps = np.asarray(stamps, dtype=np.float64)
+        codes = np.zeros(len(values), dtype=np.int64) if series is None else np.asarray(series)
+        for code in np.unique(codes[~enough]):
+            rows = codes == code
+            known = rows & enough
+            if known.any():
+                missing = rows & ~enough
+                values[missing] = np.interp(stamps[missing], stamps[known], values[known])
+    return values, coverage, keep
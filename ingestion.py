@@ -0,0 +1,622 @@
+# Load standard libraries
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import threading
+import urllib.request
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import gaps
+import instrument
+import timestamps
+
+# Location of the UCI dataset and of the local copies
+DATA_URL = 'https://archive.ics.uci.edu/ml/machine-learning-databases/00235/household_power_consumption.zip'
+DATA_DIR = os.environ.get('POWER_DATA_DIR', 'data')
+SOURCE_PATH = os.path.join(DATA_DIR, 'household_power_consumption.zip')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+AGGREGATE_DIR = os.path.join(DATA_DIR, 'aggregates')
+
+# The UCI household keeps the top level directories, every other meter gets its own
+DEFAULT_METER = 'household'
+METER_DIR = os.path.join(DATA_DIR, 'meters')
+METER_ID = 'Meter_id'
+
+# Columns of the columnar cache
+TIMESTAMP = 'Date_time'
+MEASURES = ['Global_active_power', 'Global_reactive_power', 'Voltage',
+            'Global_intensity', 'Sub_metering_1', 'Sub_metering_2', 'Sub_metering_3']
+
+# Measures computed from the metered ones at ingest, stored and rolled up like any other measure
+DERIVED_MEASURES = ['Unmetered_energy', 'Apparent_power', 'Power_factor']
+
+# Per row validity bitmask and gap interval index stored with every partition
+VALIDITY = 'Validity'
+GAPS = 'Gaps'
+
+# Measures needed by the daily aggregates and the models
+DAILY_MEASURES = ['Global_active_power', 'Sub_metering_1', 'Sub_metering_2', 'Sub_metering_3']
+
+# Rows parsed at once by the streaming ingestion
+CHUNK_ROWS = 500000
+
+# The source is the first partition of the cache, appended readings follow
+PARTITION_NAME = 'part-%05d'
+
+# Width in minutes of the streamed aggregates
+AGGREGATE_LEVELS = {'daily': timestamps.MINUTES_PER_DAY, 'hourly': 60}
+
+# Bump when the layout of the cache changes
+CACHE_FORMAT = 3
+
+# One lock per derived cache directory, see directory_lock
+_DIRECTORY_LOCKS = {}
+_DIRECTORY_LOCKS_LOCK = threading.Lock()
+
+
+def fetch_source(url=DATA_URL, path=SOURCE_PATH):
+    '''Downloads the source zip once and returns its local path'''
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.part'
+        with instrument.stage('download'):
+            urllib.request.urlretrieve(url, tmp_path)
+        os.replace(tmp_path, path)
+    return path
+
+
+def file_checksum(path, block_size=1 << 20):
+    '''Returns the sha256 checksum of a file'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def derive_columns(columns):
+    '''Adds the derived measures to columns holding every metered measure, in a few array operations
+
+    Unmetered_energy is the active energy in watt hour per minute not measured
+    by the sub meterings, Apparent_power is in kVA and Power_factor is the share
+    of the apparent power that is active.
+    '''
+    active = np.asarray(columns['Global_active_power'], dtype=np.float64)
+    reactive = np.asarray(columns['Global_reactive_power'], dtype=np.float64)
+    apparent = np.hypot(active, reactive)
+    unmetered = active * 1000 / 60 - columns['Sub_metering_1'] - columns['Sub_metering_2'] - columns['Sub_metering_3']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        factor = np.where(apparent > 0, active / apparent, np.nan)
+    return dict(columns,
+                Unmetered_energy=unmetered.astype(np.float32),
+                Apparent_power=apparent.astype(np.float32),
+                Power_factor=factor.astype(np.float32))
+
+
+def _source_measures(measures):
+    '''Returns the metered measures to read for the measures, the inputs of derived measures included'''
+    if any(col in DERIVED_MEASURES for col in measures):
+        return MEASURES
+    return list(measures)
+
+
+def _read_csv(path, measures, **kwargs):
+    '''Reads the raw csv/zip with typed columns'''
+    measures = _source_measures(measures)
+    return pd.read_csv(path, delimiter=';', low_memory=False, na_values=['?'],
+                       usecols=['Date', 'Time'] + list(measures),
+                       dtype=dict({'Date': str, 'Time': str},
+                                  **{col: np.float32 for col in measures}),
+                       **kwargs)
+
+
+def _to_columns(data, measures):
+    '''Converts a parsed frame into numpy columns with epoch minute timestamps'''
+    with instrument.stage('datetime_build'):
+        columns = {TIMESTAMP: timestamps.parse_date_time(data['Date'].to_numpy(dtype=object),
+                                                         data['Time'].to_numpy(dtype=object))}
+    with instrument.stage('numeric_coercion'):
+        for col in _source_measures(measures):
+            columns[col] = data[col].to_numpy(dtype=np.float32)
+        if any(col in DERIVED_MEASURES for col in measures):
+            columns = derive_columns(columns)
+    return {name: columns[name] for name in [TIMESTAMP] + list(measures)}
+
+
+def read_source(path, measures=MEASURES):
+    '''Parses the raw csv/zip into typed numpy columns'''
+    with instrument.stage('csv_parse'):
+        data = _read_csv(path, measures)
+    return _to_columns(data, measures)
+
+
+def iter_source(path, measures=MEASURES, chunksize=CHUNK_ROWS):
+    '''Parses the raw csv/zip in bounded chunks of typed numpy columns'''
+    with _read_csv(path, measures, chunksize=chunksize) as reader:
+        while True:
+            # Only the parsing is timed, not the consumer of the chunks
+            with instrument.stage('csv_parse'):
+                chunk = next(reader, None)
+            if chunk is None:
+                return
+            yield _to_columns(chunk, measures)
+
+
+def sort_columns(columns):
+    '''Orders the columns by timestamp so the timestamp column can serve as a sorted index'''
+    stamps = columns[TIMESTAMP]
+    if np.all(stamps[1:] >= stamps[:-1]):
+        return columns
+    order = np.argsort(stamps, kind='stable')
+    return {name: values[order] for name, values in columns.items()}
+
+
+def write_columns(columns, directory):
+    '''Writes one .npy file per column'''
+    os.makedirs(directory, exist_ok=True)
+    for name, values in columns.items():
+        np.save(os.path.join(directory, name + '.npy'), values)
+
+
+def write_meta(meta, directory):
+    '''Replaces the meta file of a directory atomically'''
+    tmp_path = os.path.join(directory, 'meta.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, 'meta.json'))
+
+
+def write_cache(columns, meta, cache_dir, partition=None):
+    '''Writes the columns, optionally into a partition, plus the meta file, atomically
+
+    Every writer gets its own temporary directory next to the cache, so a
+    concurrent writer never removes the files of another one, and swaps it in
+    under the directory_lock of the cache.
+    '''
+    parent = os.path.dirname(os.path.abspath(cache_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(cache_dir) + '.tmp-', dir=parent)
+    try:
+        write_columns(columns, os.path.join(tmp_dir, partition) if partition else tmp_dir)
+        write_meta(meta, tmp_dir)
+        with directory_lock(cache_dir):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            os.replace(tmp_dir, cache_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def directory_lock(directory):
+    '''Returns the process-wide lock serializing the rebuilds of a derived cache directory
+
+    Chart jobs run on threads and may all find the same stale directory, the
+    lock makes one rebuild it while the others wait and then find it current.
+    Reentrant, so a build may call the update of the same directory.
+    '''
+    key = os.path.abspath(directory)
+    with _DIRECTORY_LOCKS_LOCK:
+        return _DIRECTORY_LOCKS.setdefault(key, threading.RLock())
+
+
+def locks_directory(argument):
+    '''Decorates a build so that every call holds the directory_lock of its directory argument'''
+    def decorate(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            with directory_lock(bound.arguments[argument]):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def load_directory(directory, columns, mmap_mode=None):
+    '''Loads the .npy files of the columns of a directory'''
+    return {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode) for name in columns}
+
+
+def read_meta(cache_dir):
+    '''Returns the meta of the cache or None when there is no valid cache'''
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('format') != CACHE_FORMAT:
+        return None
+    return meta
+
+
+def _source_checksum(path, meta):
+    '''Reuses the stored checksum while the source file is untouched'''
+    stat = os.stat(path)
+    if meta and meta.get('source_size') == stat.st_size and meta.get('source_mtime') == stat.st_mtime:
+        return meta['checksum'], stat
+    return file_checksum(path), stat
+
+
+def meter_dir(meter=DEFAULT_METER):
+    '''Returns the directory holding the cache, aggregates and rollups of a meter'''
+    meter = str(meter)
+    if meter == DEFAULT_METER:
+        return DATA_DIR
+    if not meter or meter.startswith('.') or os.sep in meter or (os.altsep and os.altsep in meter):
+        raise ValueError(f'Invalid meter id {meter!r}')
+    return os.path.join(METER_DIR, meter)
+
+
+def meter_paths(meter=DEFAULT_METER):
+    '''Returns the cache, aggregate and rollup directories of a meter as keyword arguments'''
+    root = meter_dir(meter)
+    return {
+        'cache_dir': os.path.join(root, 'cache'),
+        'aggregate_dir': os.path.join(root, 'aggregates'),
+        'rollup_dir': os.path.join(root, 'rollups'),
+    }
+
+
+def meter_ids():
+    '''Returns the UCI household followed by every meter with a cache'''
+    meters = []
+    if os.path.isdir(METER_DIR):
+        meters = sorted(name for name in os.listdir(METER_DIR)
+                        if os.path.exists(os.path.join(METER_DIR, name, 'cache', 'meta.json')))
+    return [DEFAULT_METER] + [meter for meter in meters if meter != DEFAULT_METER]
+
+
+def _complete_columns(columns, names):
+    '''Returns the timestamps and float32 measures in time order, missing measures as NaN'''
+    stamps = np.asarray(columns[TIMESTAMP], dtype=np.int64)
+    return sort_columns(dict(
+        {TIMESTAMP: stamps},
+        **{col: np.asarray(columns[col], dtype=np.float32) if col in columns
+           else np.full(len(stamps), np.nan, dtype=np.float32)
+           for col in names if col != TIMESTAMP}))
+
+
+def create_cache(columns, cache_dir, measures=MEASURES):
+    '''Writes the first partition of a meter that has readings but no source file'''
+    columns = derive_columns(_complete_columns(columns, measures))
+    digest = hashlib.sha256()
+    for values in columns.values():
+        digest.update(values.tobytes())
+    meta = {
+        'format': CACHE_FORMAT,
+        'checksum': digest.hexdigest(),
+        'rows': int(len(columns[TIMESTAMP])),
+        'columns': {name: str(values.dtype) for name, values in columns.items()},
+        'version': 0,
+        'partitions': [_partition_meta(PARTITION_NAME % 0, columns, 0)],
+    }
+    write_cache(dict(columns, **validity_columns(columns, measures)), meta, cache_dir, partition=PARTITION_NAME % 0)
+    return meta
+
+
+def _from_readings(meta):
+    '''Caches created from meter readings have no source file to compare with'''
+    return meta is not None and 'source_size' not in meta
+
+
+@locks_directory('cache_dir')
+def build_cache(source=None, cache_dir=CACHE_DIR):
+    '''Parses the source once into the columnar cache unless it is already current'''
+    meta = read_meta(cache_dir)
+    if _from_readings(meta):
+        return add_derived(cache_dir)
+    source = source or fetch_source()
+    checksum, stat = _source_checksum(source, meta)
+    if meta and meta['checksum'] == checksum:
+        if (meta.get('source_size'), meta.get('source_mtime')) != (stat.st_size, stat.st_mtime):
+            # A copied or unpacked source keeps its content, the next check is a stat again
+            write_meta(dict(meta, source_size=stat.st_size, source_mtime=stat.st_mtime), cache_dir)
+        return add_derived(cache_dir)
+
+    columns = derive_columns(sort_columns(read_source(source)))
+    meta = {
+        'format': CACHE_FORMAT,
+        'checksum': checksum,
+        'source_size': stat.st_size,
+        'source_mtime': stat.st_mtime,
+        'rows': int(len(columns[TIMESTAMP])),
+        'columns': {name: str(values.dtype) for name, values in columns.items()},
+        'version': 0,
+        'partitions': [_partition_meta(PARTITION_NAME % 0, columns, 0)],
+    }
+    write_cache(dict(columns, **validity_columns(columns, MEASURES)), meta, cache_dir, partition=PARTITION_NAME % 0)
+    return meta
+
+
+@locks_directory('cache_dir')
+def add_derived(cache_dir=CACHE_DIR):
+    '''Adds the derived measures to a cache written before they existed, partition by partition
+
+    The partition files are written before the meta lists the new columns, an
+    interrupted upgrade is simply done again.
+    '''
+    meta = read_meta(cache_dir)
+    missing = [col for col in DERIVED_MEASURES if col not in meta['columns']]
+    if not missing:
+        return meta
+    for part in meta['partitions']:
+        derived = derive_columns(partition_columns(part['name'], MEASURES, cache_dir))
+        for col in missing:
+            tmp_path = os.path.join(cache_dir, part['name'], col + '.tmp.npy')
+            np.save(tmp_path, derived[col])
+            os.replace(tmp_path, os.path.join(cache_dir, part['name'], col + '.npy'))
+    meta = dict(meta, columns=dict(meta['columns'], **{col: 'float32' for col in missing}))
+    write_meta(meta, cache_dir)
+    return meta
+
+
+def _partition_meta(name, columns, version):
+    '''Describes one partition of the cache'''
+    stamps = columns[TIMESTAMP]
+    return {
+        'name': name,
+        'rows': int(len(stamps)),
+        'start': int(stamps[0]) if len(stamps) else None,
+        'end': int(stamps[-1]) if len(stamps) else None,
+        'version': version,
+    }
+
+
+def dataset_version(meta):
+    '''Returns a short label that changes with the source and with every append'''
+    return f"{meta['checksum'][:12]}.{meta.get('version', 0)}"
+
+
+def range_version(meta, start=None, end=None):
+    '''Returns the last version that changed the epoch minutes in [start, end)'''
+    versions = [part['version'] for part in meta['partitions']
+                if part['rows'] and (start is None or part['end'] >= start)
+                and (end is None or part['start'] < end)]
+    return f"{meta['checksum'][:12]}.{max(versions, default=0)}"
+
+
+def partition_columns(partition, columns=None, cache_dir=CACHE_DIR, mmap_mode='r'):
+    '''Opens the columns of one partition of the cache'''
+    columns = columns or MEASURES
+    names = [TIMESTAMP] + [col for col in columns if col != TIMESTAMP]
+    return load_directory(os.path.join(cache_dir, partition), names, mmap_mode)
+
+
+def validity_columns(columns, measures):
+    '''Returns the validity bitmask of every row and the gap intervals written next to a partition'''
+    mask = gaps.validity_mask(columns, measures)
+    return {VALIDITY: mask, GAPS: gaps.gap_intervals(columns[TIMESTAMP], mask, (1 << len(measures)) - 1)}
+
+
+def partition_validity(partition, cache_dir=CACHE_DIR, mmap_mode='r'):
+    '''Opens the validity bitmask and the gap index of a partition, adding them to older partitions first'''
+    directory = os.path.join(cache_dir, partition)
+    if not os.path.exists(os.path.join(directory, GAPS + '.npy')):
+        validity = validity_columns(partition_columns(partition, MEASURES, cache_dir), MEASURES)
+        # The gap index is written last, it marks the validity files as complete
+        for name in (VALIDITY, GAPS):
+            tmp_path = os.path.join(directory, name + '.tmp.npy')
+            np.save(tmp_path, validity[name])
+            os.replace(tmp_path, os.path.join(directory, name + '.npy'))
+    return load_directory(directory, [VALIDITY, GAPS], mmap_mode)
+
+
+@locks_directory('cache_dir')
+def append_partition(columns, cache_dir=CACHE_DIR, aggregate_dir=AGGREGATE_DIR):
+    '''Writes newer readings as a new partition and bumps the dataset version
+
+    The readings must all be later than the last cached timestamp. The streamed
+    aggregates, when present, are updated for the touched days and hours only.
+    '''
+    if read_meta(cache_dir) is None:
+        raise FileNotFoundError(f'No columnar cache in {cache_dir}')
+    meta = add_derived(cache_dir)
+    stamps = np.asarray(columns[TIMESTAMP], dtype=np.int64)
+    if not len(stamps):
+        return meta
+    columns = derive_columns(_complete_columns(columns, MEASURES))
+    last = max(part['end'] for part in meta['partitions'] if part['rows'])
+    if columns[TIMESTAMP][0] <= last:
+        raise ValueError('Appended readings have to be newer than the cached data')
+
+    version = meta['version'] + 1
+    name = PARTITION_NAME % len(meta['partitions'])
+    tmp_dir = os.path.join(cache_dir, name + '.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    write_columns(dict(columns, **validity_columns(columns, MEASURES)), tmp_dir)
+    os.replace(tmp_dir, os.path.join(cache_dir, name))
+    meta = dict(meta,
+                version=version,
+                rows=meta['rows'] + len(stamps),
+                partitions=meta['partitions'] + [_partition_meta(name, columns, version)])
+    write_meta(meta, cache_dir)
+    update_aggregates(aggregate_dir, cache_dir)
+    return meta
+
+
+def load_columns(columns=None, source=None, cache_dir=CACHE_DIR):
+    '''Opens the cached columns as read-only memory maps, joining the partitions if needed'''
+    meta = build_cache(source, cache_dir)
+    parts = [partition_columns(part['name'], columns, cache_dir) for part in meta['partitions']]
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def load_minute_frame(columns=None, source=None, cache_dir=CACHE_DIR):
+    '''Returns the minute level data with a Date_time column'''
+    arrays = load_columns(columns, source, cache_dir)
+    data = pd.DataFrame({name: np.asarray(values) for name, values in arrays.items()})
+    data[TIMESTAMP] = arrays[TIMESTAMP].astype('datetime64[m]').astype('datetime64[ns]')
+    return data
+
+
+class BucketAccumulator:
+    '''Running per-bucket sums and valid counts, grown as new buckets appear'''
+
+    def __init__(self, width, measures):
+        self.width = width
+        self.measures = list(measures)
+        self.first = None
+        self.sums = np.zeros((len(self.measures), 0))
+        self.counts = np.zeros((len(self.measures), 0), dtype=np.int64)
+
+    @classmethod
+    def from_columns(cls, columns, width, measures):
+        '''Resumes the accumulation from previously written columns'''
+        accumulator = cls(width, measures)
+        if len(columns[TIMESTAMP]):
+            accumulator.first = int(columns[TIMESTAMP][0]) // width
+            accumulator.sums = np.stack([np.asarray(columns[col], dtype=np.float64) for col in measures])
+            accumulator.counts = np.stack([np.asarray(columns[col + '_count'], dtype=np.int64) for col in measures])
+        return accumulator
+
+    def _grow(self, low, high):
+        '''Extends the arrays so that buckets low..high fit'''
+        if self.first is None:
+            self.first = low
+        before = max(self.first - low, 0)
+        after = max(high - (self.first + self.sums.shape[1] - 1), 0)
+        if before or after:
+            self.sums = np.pad(self.sums, ((0, 0), (before, after)))
+            self.counts = np.pad(self.counts, ((0, 0), (before, after)))
+            self.first -= before
+
+    @instrument.timed('groupby')
+    def add(self, columns):
+        '''Folds one chunk of columns into the running totals'''
+        stamps = columns[TIMESTAMP]
+        if not len(stamps):
+            return
+        buckets = stamps // self.width
+        self._grow(int(buckets.min()), int(buckets.max()))
+        offsets = buckets - self.first
+        size = self.sums.shape[1]
+        for i, col in enumerate(self.measures):
+            values = columns[col]
+            valid = ~np.isnan(values)
+            self.sums[i] += np.bincount(offsets[valid], weights=values[valid], minlength=size)
+            self.counts[i] += np.bincount(offsets[valid], minlength=size)
+
+    def columns(self):
+        '''Returns the bucket start times, the sums and the valid counts as columns'''
+        first = self.first or 0
+        result = {TIMESTAMP: (first + np.arange(self.sums.shape[1], dtype=np.int64)) * self.width}
+        for i, col in enumerate(self.measures):
+            result[col] = self.sums[i]
+            result[col + '_count'] = self.counts[i]
+        return result
+
+
+def stream_aggregates(source=None, measures=DAILY_MEASURES, chunksize=CHUNK_ROWS):
+    '''Aggregates the source into daily and hourly sums without holding the minute table'''
+    source = source or fetch_source()
+    accumulators = {level: BucketAccumulator(width, measures) for level, width in AGGREGATE_LEVELS.items()}
+    for columns in iter_source(source, measures, chunksize):
+        for accumulator in accumulators.values():
+            accumulator.add(columns)
+    return accumulators
+
+
+def _write_aggregates(accumulators, meta, aggregate_dir):
+    '''Writes the daily and hourly aggregates, the daily meta marks them as complete'''
+    for level in ('hourly', 'daily'):
+        columns = accumulators[level].columns()
+        write_cache(columns, dict(meta, rows=int(len(columns[TIMESTAMP]))),
+                     os.path.join(aggregate_dir, level))
+
+
+@locks_directory('aggregate_dir')
+def update_aggregates(aggregate_dir=AGGREGATE_DIR, cache_dir=CACHE_DIR):
+    '''Folds the partitions appended since the aggregates were written into them'''
+    meta = read_meta(os.path.join(aggregate_dir, 'daily'))
+    cache_meta = read_meta(cache_dir)
+    if meta is None or cache_meta is None or meta['checksum'] != cache_meta['checksum']:
+        return meta
+    partitions = [part for part in cache_meta['partitions'] if part['version'] > meta['version']]
+    if not partitions:
+        return meta
+
+    measures = meta['measures']
+    names = [TIMESTAMP] + measures + [col + '_count' for col in measures]
+    accumulators = {
+        level: BucketAccumulator.from_columns(load_directory(os.path.join(aggregate_dir, level), names),
+                                              width, measures)
+        for level, width in AGGREGATE_LEVELS.items()}
+    # Only the days and hours covered by the new partitions change
+    for part in partitions:
+        columns = partition_columns(part['name'], measures, cache_dir)
+        for accumulator in accumulators.values():
+            accumulator.add(columns)
+    meta = dict(meta, version=cache_meta['version'])
+    _write_aggregates(accumulators, meta, aggregate_dir)
+    return meta
+
+
+@locks_directory('aggregate_dir')
+def build_aggregates(source=None, aggregate_dir=AGGREGATE_DIR, measures=DAILY_MEASURES, cache_dir=CACHE_DIR):
+    '''Streams the source into the daily and hourly aggregates unless they are already current'''
+    meta = read_meta(os.path.join(aggregate_dir, 'daily'))
+    cache_meta = read_meta(cache_dir)
+    if _from_readings(cache_meta):
+        # Without a source file every partition of the cache is folded into empty aggregates
+        if not (meta and meta['checksum'] == cache_meta['checksum'] and set(measures) <= set(meta['measures'])):
+            meta = {'format': CACHE_FORMAT, 'checksum': cache_meta['checksum'],
+                    'measures': list(measures), 'version': -1}
+            empty = {level: BucketAccumulator(width, measures) for level, width in AGGREGATE_LEVELS.items()}
+            _write_aggregates(empty, meta, aggregate_dir)
+        return update_aggregates(aggregate_dir, cache_dir)
+
+    source = source or fetch_source()
+    checksum, stat = _source_checksum(source, meta)
+    if not (meta and meta['checksum'] == checksum and set(measures) <= set(meta['measures'])):
+        meta = {
+            'format': CACHE_FORMAT,
+            'checksum': checksum,
+            'source_size': stat.st_size,
+            'source_mtime': stat.st_mtime,
+            'measures': list(measures),
+            'version': 0,
+        }
+        _write_aggregates(stream_aggregates(source, measures), meta, aggregate_dir)
+    elif (meta.get('source_size'), meta.get('source_mtime')) != (stat.st_size, stat.st_mtime):
+        write_meta(dict(meta, source_size=stat.st_size, source_mtime=stat.st_mtime),
+                   os.path.join(aggregate_dir, 'daily'))
+    # Readings appended to the cache after the source are folded in afterwards
+    return update_aggregates(aggregate_dir, cache_dir)
+
+
+def load_aggregate(level='daily', source=None, aggregate_dir=AGGREGATE_DIR, measures=DAILY_MEASURES,
+                   cache_dir=CACHE_DIR, gap_policy='zero', min_coverage=gaps.MIN_COVERAGE):
+    '''Returns the daily or hourly sums as a frame with a Date_time column
+
+    gap_policy decides how days or hours with missing readings are treated, see
+    gaps.POLICIES. With skip, a bucket is dropped when any measure lacks coverage.
+    '''
+    build_aggregates(source, aggregate_dir, measures, cache_dir)
+    level_dir = os.path.join(aggregate_dir, level)
+    stamps = np.load(os.path.join(level_dir, TIMESTAMP + '.npy'))
+    values = {col: np.load(os.path.join(level_dir, col + '.npy')) for col in measures}
+    if gap_policy != 'zero' and len(stamps):
+        partitions = [part for part in read_meta(cache_dir)['partitions'] if part['rows']]
+        width = AGGREGATE_LEVELS[level]
+        expected = gaps.expected_minutes(stamps, width, min(part['start'] for part in partitions),
+                                         max(part['end'] for part in partitions))
+        keep = np.ones(len(stamps), dtype=bool)
+        for col in measures:
+            counts = np.load(os.path.join(level_dir, col + '_count.npy'))
+            values[col], _, kept = gaps.apply_policy(stamps, values[col], counts, expected, gap_policy, min_coverage)
+            keep &= kept
+        stamps = stamps[keep]
+        values = {col: column[keep] for col, column in values.items()}
+    data = pd.DataFrame(values)
+    data.insert(0, TIMESTAMP, stamps.astype('datetime64[m]').astype('datetime64[ns]'))
+    return data
@@ -0,0 +1,207 @@
+# Load standard libraries
+import collections
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+# Load Data libraries
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Stages timed across the app, in pipeline order
+STAGES = ['download', 'csv_parse', 'datetime_build', 'numeric_coercion', 'groupby',
+          'model_load', 'figure_build', 'figure_serialize']
+
+# Finished runs kept in memory for the panel
+MAX_RUNS = 20
+
+# When set, every finished run is also written there as one JSON file
+PROFILE_DIR = os.environ.get('POWER_PROFILE_DIR')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# The run the stages of the current page run or job are recorded into
+_CURRENT = contextvars.ContextVar('instrument_run', default=None)
+_RUN_IDS = itertools.count(1)
+_RUNS = collections.deque(maxlen=MAX_RUNS)
+_RUNS_LOCK = threading.Lock()
+
+
+def rss_bytes():
+    '''Returns the resident memory of the process, or its peak where /proc is not available'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    '''Returns the peak resident memory of the process, 0 when the platform does not report it'''
+    if resource is None:
+        return 0
+    # Linux reports kilobytes, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class StageStats:
+    '''Calls, time and resident memory change of one stage'''
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rss_delta = 0
+        self.rss_after = 0
+
+    def add(self, seconds, rss_before, rss_after):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rss_delta += rss_after - rss_before
+        self.rss_after = rss_after
+
+    def to_dict(self):
+        return {'calls': self.calls, 'seconds': round(self.seconds, 6), 'max_seconds': round(self.max_seconds, 6),
+                'rss_delta_mb': round(self.rss_delta / 1048576, 3), 'rss_after_mb': round(self.rss_after / 1048576, 3)}
+
+
+class Run:
+    '''The stages recorded during one page run, the jobs it submitted included'''
+
+    def __init__(self, name):
+        self.id = next(_RUN_IDS)
+        self.name = name
+        self.started = time.time()
+        self.seconds = None
+        self.rss_start = rss_bytes()
+        self.peak_rss = None
+        self.stages = collections.defaultdict(StageStats)
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, rss_before, rss_after):
+        with self._lock:
+            self.stages[stage].add(seconds, rss_before, rss_after)
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._started
+        self.peak_rss = peak_rss_bytes()
+
+    def to_dict(self):
+        '''Returns the run as plain values, ready for JSON'''
+        with self._lock:
+            stages = {name: self.stages[name].to_dict()
+                      for name in sorted(self.stages, key=lambda name: (STAGES + [name]).index(name))}
+        return {
+            'id': self.id,
+            'name': self.name,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'seconds': None if self.seconds is None else round(self.seconds, 6),
+            'rss_start_mb': round(self.rss_start / 1048576, 3),
+            'peak_rss_mb': None if self.peak_rss is None else round(self.peak_rss / 1048576, 3),
+            'stages': stages,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def frame(self):
+        '''Returns one row per stage with its calls, seconds and memory change'''
+        stages = self.to_dict()['stages']
+        return pd.DataFrame([dict(stage=name, **stats) for name, stats in stages.items()],
+                            columns=['stage', 'calls', 'seconds', 'max_seconds', 'rss_delta_mb', 'rss_after_mb'])
+
+
+def start_run(name):
+    '''Starts recording the stages of this thread, and of the jobs it submits, into a new run'''
+    run = Run(name)
+    _CURRENT.set(run)
+    return run
+
+
+def current_run():
+    return _CURRENT.get()
+
+
+def finish_run():
+    '''Closes the current run, keeps it for the panel and writes it to PROFILE_DIR when set'''
+    run = _CURRENT.get()
+    if run is None:
+        return None
+    run.finish()
+    _CURRENT.set(None)
+    with _RUNS_LOCK:
+        _RUNS.append(run)
+    if PROFILE_DIR:
+        export_run(run, PROFILE_DIR)
+    return run
+
+
+def export_run(run, directory):
+    '''Writes a run as a JSON file and returns its path'''
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{time.strftime("%Y%m%dT%H%M%S", time.localtime(run.started))}-{run.id}.json')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(run.to_json())
+    os.replace(tmp_path, path)
+    return path
+
+
+def recent_runs():
+    '''Returns the finished runs kept in memory, the latest last'''
+    with _RUNS_LOCK:
+        return list(_RUNS)
+
+
+def history():
+    '''Returns one row per finished run and stage, to compare runs with each other'''
+    rows = []
+    for run in recent_runs():
+        record = run.to_dict()
+        for name, stats in record['stages'].items():
+            rows.append(dict(run=record['id'], page=record['name'], stage=name, **stats))
+    return pd.DataFrame(rows, columns=['run', 'page', 'stage', 'calls', 'seconds', 'max_seconds',
+                                       'rss_delta_mb', 'rss_after_mb'])
+
+
+@contextlib.contextmanager
+def stage(name):
+    '''Times a block and the change of resident memory across it into the current run
+
+    Outside of a run the block runs untimed. Stages may nest, the time of an
+    inner stage is counted in the outer one as well. Memory is process-wide, so
+    stages running at the same time on other threads show in each other's change.
+    '''
+    run = _CURRENT.get()
+    if run is None:
+        yield
+        return
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.record(name, time.perf_counter() - started, rss_before, rss_bytes())
+
+
+def timed(name):
+    '''Decorates a function so that every call is timed as a stage'''
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
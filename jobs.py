@@ -0,0 +1,115 @@
+# Load standard libraries
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+
+# Load Viz libraries
+import plotly.io as pio
+import figure_cache
+
+# Threads running the heavy page steps, numpy, pandas and statsmodels release the GIL in their kernels
+WORKERS = int(os.environ.get('POWER_JOB_WORKERS', min(4, os.cpu_count() or 1)))
+
+_LOOP = None
+_LOOP_LOCK = threading.Lock()
+# Running jobs by key, shared by every session of the process
+_JOBS = {}
+_JOBS_LOCK = threading.Lock()
+
+
+def _loop():
+    '''Starts the event loop thread and its worker threads on first use'''
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(WORKERS, thread_name_prefix='job'))
+            threading.Thread(target=loop.run_forever, name='jobs', daemon=True).start()
+            _LOOP = loop
+    return _LOOP
+
+
+async def _run(context, fn):
+    '''Runs a blocking callable on the worker threads without blocking the event loop'''
+    return await asyncio.get_running_loop().run_in_executor(None, context.run, fn)
+
+
+def _forget(key, future):
+    with _JOBS_LOCK:
+        if _JOBS.get(key) is future:
+            del _JOBS[key]
+
+
+def submit(key, fn):
+    '''Schedules fn() and returns a Future of its result
+
+    A job submitted while an identical one, by key, is still running gets the
+    running job's Future, so concurrent sessions compute it once. The job runs
+    in a copy of the submitter's context, its stages are timed into the
+    submitter's instrument run.
+    '''
+    with _JOBS_LOCK:
+        future = _JOBS.get(key)
+        if future is not None:
+            return future
+        future = _JOBS[key] = asyncio.run_coroutine_threadsafe(_run(contextvars.copy_context(), fn), _loop())
+    # Finished jobs are dropped, their results live in the caches they fill
+    future.add_done_callback(lambda done: _forget(key, done))
+    return future
+
+
+def figure(version, figure_id, build, **widgets):
+    '''Returns a Future of a figure's JSON, built on the job pool unless the figure cache has it'''
+    fig_json = figure_cache.lookup_json(version, figure_id, **widgets)
+    if fig_json is not None:
+        future = concurrent.futures.Future()
+        future.set_result(fig_json)
+        return future
+    key = ('figure',) + figure_cache.FigureCache.key(version, figure_id, **widgets)
+    return submit(key, lambda: figure_cache.cached_figure_json(version, figure_id, build, **widgets))
+
+
+class Charts:
+    '''The chart placeholders of one page run, each filled with its figure as soon as its job is done
+
+    Placeholders keep their place on the page, so the page can be written top to
+    bottom while the figures are built in the background.
+    '''
+
+    def __init__(self):
+        self._pending = {}
+
+    def add(self, placeholder, version, figure_id, build, errors=None, **widgets):
+        '''Submits a figure job for a placeholder
+
+        errors maps exception types to a message template with an {error} field,
+        shown in place of the chart when the build fails with that exception.
+        Any other failure shows a generic message, the rest of the page still draws.
+        '''
+        future = figure(version, figure_id, build, **widgets)
+        if future.done():
+            self._draw(placeholder, future, errors)
+        else:
+            placeholder.info(f'Building the {figure_id.replace("_", " ")} chart...')
+            self._pending[future] = (placeholder, errors)
+
+    @staticmethod
+    def _draw(placeholder, future, errors):
+        try:
+            fig_json = future.result()
+        except Exception as error:
+            message = next((text for kind, text in (errors or {}).items() if isinstance(error, kind)), None)
+            if message is None:
+                placeholder.error(f'The chart could not be built: {type(error).__name__}: {error}')
+            else:
+                placeholder.warning(message.format(error=error))
+            return
+        placeholder.plotly_chart(pio.from_json(fig_json), use_container_width=True)
+
+    def fill(self, timeout=None):
+        '''Draws every pending chart in the order its job finishes'''
+        for future in concurrent.futures.as_completed(list(self._pending), timeout):
+            placeholder, errors = self._pending.pop(future)
+            self._draw(placeholder, future, errors)
@@ -0,0 +1,146 @@
+# Load standard libraries
+import hashlib
+import json
+import os
+import time
+import warnings
+
+# Load Data libraries
+import numpy as np
+import ingestion
+import forecast_engine
+
+SEARCH_DIR = os.path.join(ingestion.DATA_DIR, 'order_search')
+
+# Stepwise search settings of the notebook's auto-ARIMA model
+SEARCH_PARAMS = {
+    'start_p': 1, 'start_q': 1, 'max_p': 5, 'max_q': 5, 'd': 0,
+    'start_P': 0, 'start_Q': 0, 'max_P': 2, 'max_Q': 2, 'D': 1, 'm': 0,
+}
+
+# Search budget, the search stops early once either is spent
+MAX_FITS = 40
+MAX_SECONDS = 120
+
+
+def data_version(train, regressors=forecast_engine.REGRESSORS):
+    '''Hashes the training window, readings appended after the cutoff leave it unchanged'''
+    digest = hashlib.sha256()
+    for name in [ingestion.TIMESTAMP, forecast_engine.TARGET] + list(regressors):
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(train[name]).tobytes())
+    return digest.hexdigest()[:24]
+
+
+def fit_order(train, regressors, order, seasonal_order, trend):
+    '''Runs in a worker process: fits one candidate and returns its AIC, infinite when the fit fails'''
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            model = SARIMAX(
+                train[forecast_engine.TARGET],
+                exog=np.column_stack([train[name] for name in regressors]) if regressors else None,
+                order=order, seasonal_order=seasonal_order, trend=trend)
+            fitted = model.fit(disp=False)
+        return {'aic': float(fitted.aic), 'converged': bool(fitted.mle_retvals.get('converged', True))}
+    except (ValueError, np.linalg.LinAlgError):
+        return {'aic': float('inf'), 'converged': False}
+
+
+def _trend(order, seasonal_order):
+    '''Keeps an intercept only for models without differencing'''
+    return 'c' if order[1] + seasonal_order[1] == 0 else 'n'
+
+
+def _memo_path(version, order, seasonal_order, search_dir):
+    name = '-'.join(map(str, order)) + '_' + '-'.join(map(str, seasonal_order))
+    return os.path.join(search_dir, version, name + '.json')
+
+
+def _read_memo(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_memo(path, result):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(result, f)
+    os.replace(tmp_path, path)
+
+
+def _neighbours(order, seasonal_order, params):
+    '''Returns the candidates one step away in p, q, P or Q, like a stepwise auto-ARIMA'''
+    (p, d, q), (P, D, Q, m) = order, seasonal_order
+    steps = [(p + dp, q + dq, P, Q) for dp, dq in ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, 1))]
+    if m > 1:
+        steps += [(p, q, P + dP, Q + dQ) for dP, dQ in ((-1, 0), (1, 0), (0, -1), (0, 1))]
+    return [((p_, d, q_), (P_, D, Q_, m)) for p_, q_, P_, Q_ in steps
+            if 0 <= p_ <= params['max_p'] and 0 <= q_ <= params['max_q']
+            and 0 <= P_ <= params['max_P'] and 0 <= Q_ <= params['max_Q']]
+
+
+def search(data, cutoff=forecast_engine.DEFAULT_CUTOFF, params=None, regressors=forecast_engine.REGRESSORS,
+           max_fits=MAX_FITS, max_seconds=MAX_SECONDS, search_dir=SEARCH_DIR):
+    '''Stepwise SARIMAX order search on the days before the cutoff, lowest AIC wins
+
+    Every round fits the untried neighbours of the best model concurrently in the
+    forecast engine pool. Each (order, seasonal_order, data version) result is kept
+    on disk, so searching again only fits the candidates never tried on this window.
+    '''
+    params = dict(SEARCH_PARAMS, **(params or {}))
+    train, _ = forecast_engine.split(data, cutoff, 0)
+    train = forecast_engine.arrays(train, regressors)
+    version = data_version(train, regressors)
+    m = params['m']
+    D = params['D'] if m > 1 else 0
+
+    results = {}
+    fits = hits = 0
+    started = time.perf_counter()
+    candidates = [((params['start_p'], params['d'], params['start_q']), (params['start_P'], D, params['start_Q'], m)),
+                  ((0, params['d'], 0), (0, D, 0, m)),
+                  ((1, params['d'], 0), (1 if m > 1 else 0, D, 0, m)),
+                  ((0, params['d'], 1), (0, D, 1 if m > 1 else 0, m))]
+    while candidates:
+        tried = len(results)
+        futures = {}
+        for order, seasonal_order in dict.fromkeys(candidates):
+            path = _memo_path(version, order, seasonal_order, search_dir)
+            memo = _read_memo(path)
+            if memo is not None:
+                results[order, seasonal_order] = memo
+                hits += 1
+            elif fits + len(futures) < max_fits and time.perf_counter() - started < max_seconds:
+                futures[order, seasonal_order] = (path, forecast_engine.pool().submit(
+                    fit_order, train, regressors, order, seasonal_order, _trend(order, seasonal_order)))
+        for key, (path, future) in futures.items():
+            results[key] = future.result()
+            _write_memo(path, results[key])
+            fits += 1
+        if len(results) == tried:
+            # Budget spent before any candidate of this round could be fitted
+            break
+        # Stepwise: move to the best model so far and try its untried neighbours
+        best = min(results, key=lambda key: results[key]['aic'])
+        candidates = [key for key in _neighbours(*best, params) if key not in results]
+
+    if not results:
+        raise ValueError('The search budget does not allow a single fit')
+    best = min(results, key=lambda key: results[key]['aic'])
+    return {
+        'order': best[0],
+        'seasonal_order': best[1],
+        'trend': _trend(*best),
+        'aic': results[best]['aic'],
+        'data_version': version,
+        'fits': fits,
+        'cache_hits': hits,
+        'complete': not candidates,
+        'trace': [(order, seasonal_order, result['aic']) for (order, seasonal_order), result in results.items()],
+    }
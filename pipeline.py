@@ -0,0 +1,350 @@
+# Load standard libraries
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+# Load Data libraries
+import ingestion
+import rollups
+import summaries
+import rolling
+import decompositions
+import forecast_engine
+import backtest
+
+# Manifest of the artifacts built for every meter and the inputs they were built from
+MANIFEST_PATH = os.path.join(ingestion.DATA_DIR, 'pipeline.json')
+
+# Meters built at once, one process each
+WORKERS = int(os.environ.get('POWER_PIPELINE_WORKERS', os.cpu_count() or 1))
+
+# Set when the app is served from the artifacts of this pipeline, the pages then never build them
+PRECOMPUTED = os.environ.get('POWER_PRECOMPUTED') == '1'
+
+# Stages in build order, the data stages run per meter in worker processes and
+# the model stages on the forecast engine's pool
+DATA_STAGES = ['cache', 'aggregates', 'rollups', 'summaries', 'rolling', 'decompositions']
+MODEL_STAGES = ['forecasts', 'backtest']
+STAGES = DATA_STAGES + MODEL_STAGES
+
+# Moving averages of the exploratory page prebuilt at its default window
+ROLLING_LEVELS = ['hour', 'day']
+ROLLING_WINDOWS = [12]
+
+
+def _config(stage, models):
+    '''What a stage builds besides the data, a change rebuilds it'''
+    if stage == 'rolling':
+        return [ROLLING_LEVELS, ROLLING_WINDOWS]
+    if stage == 'decompositions':
+        return [decompositions.PERIODS, decompositions.METHODS]
+    if stage == 'forecasts':
+        return [sorted(models), str(forecast_engine.DEFAULT_CUTOFF), forecast_engine.DEFAULT_HORIZON,
+                {model: forecast_engine.DEFAULT_PARAMS[model] for model in models}]
+    if stage == 'backtest':
+        return [sorted(models), list(backtest.HORIZONS), backtest.INITIAL_DAYS, backtest.PERIOD_DAYS]
+    return []
+
+
+def _source_key(meter):
+    '''The input of the cache stage: the source file of the UCI household, the readings of any other meter'''
+    if meter == ingestion.DEFAULT_METER and os.path.exists(ingestion.SOURCE_PATH):
+        # Whole seconds, what survives packing the artifacts into an archive
+        stat = os.stat(ingestion.SOURCE_PATH)
+        return [stat.st_size, int(stat.st_mtime)]
+    meta = ingestion.read_meta(ingestion.meter_paths(meter)['cache_dir'])
+    return meta and ingestion.dataset_version(meta)
+
+
+def fingerprints(meter, models=tuple(forecast_engine.FITTERS)):
+    '''Hashes the inputs of every stage of a meter, None for the stages after a missing cache'''
+    meta = ingestion.read_meta(ingestion.meter_paths(meter)['cache_dir'])
+    version = meta and ingestion.dataset_version(meta)
+    inputs = {'cache': _source_key(meter)}
+    for stage in STAGES[1:]:
+        inputs[stage] = version and [version, _config(stage, models)]
+    return {stage: value and hashlib.sha256(json.dumps([stage, ingestion.CACHE_FORMAT, value]).encode())
+            .hexdigest()[:24] for stage, value in inputs.items()}
+
+
+def read_manifest(path=MANIFEST_PATH):
+    '''Returns the manifest of the last pipeline run, empty when it never ran'''
+    if not os.path.exists(path):
+        return {'format': ingestion.CACHE_FORMAT, 'version': 0, 'meters': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, path=MANIFEST_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def built_models(manifest=None):
+    '''Returns the models of the last pipeline run, every model when it never ran'''
+    manifest = manifest or read_manifest()
+    return tuple(manifest.get('models', forecast_engine.FITTERS))
+
+
+def stale_stages(meters=None, manifest=None):
+    '''Returns the (meter, stage) pairs whose inputs changed since the pipeline built them
+
+    Only stat calls and small manifest reads, cheap enough for every page run.
+    '''
+    manifest = manifest or read_manifest()
+    models = built_models(manifest)
+    stages = manifest.get('stages', STAGES)
+    stale = []
+    for meter in meters or ingestion.meter_ids():
+        built = manifest['meters'].get(meter, {}).get('stages', {})
+        stale += [(meter, stage) for stage, fingerprint in fingerprints(meter, models).items()
+                  if stage in stages and (fingerprint is None or built.get(stage, {}).get('fingerprint') != fingerprint)]
+    return stale
+
+
+def build_cache(meter, paths):
+    if meter == ingestion.DEFAULT_METER:
+        if not os.path.exists(ingestion.SOURCE_PATH) and ingestion.read_meta(paths['cache_dir']) is None:
+            raise FileNotFoundError(f'No local copy of the dataset at {ingestion.SOURCE_PATH}, '
+                                    'pass --source or --download')
+        ingestion.build_cache(cache_dir=paths['cache_dir'])
+    else:
+        ingestion.add_derived(paths['cache_dir'])
+
+
+def build_aggregates(meter, paths):
+    ingestion.build_aggregates(aggregate_dir=paths['aggregate_dir'], cache_dir=paths['cache_dir'])
+
+
+def build_rollups(meter, paths):
+    rollups.build_rollups(cache_dir=paths['cache_dir'], rollup_dir=paths['rollup_dir'])
+
+
+def build_summaries(meter, paths):
+    summaries.update_summaries(paths['cache_dir'], paths['rollup_dir'])
+
+
+def build_rolling(meter, paths):
+    pyramid = rollups.open_pyramid(cache_dir=paths['cache_dir'], rollup_dir=paths['rollup_dir'])
+    for level in ROLLING_LEVELS:
+        rolling.rolling_frame(pyramid, level, 'Global_active_power', ROLLING_WINDOWS)
+
+
+def build_decompositions(meter, paths):
+    '''Decomposes every period with every method on threads, statsmodels spends most of it in numpy'''
+    pyramid = rollups.open_pyramid(cache_dir=paths['cache_dir'], rollup_dir=paths['rollup_dir'])
+
+    def _decompose(period, method):
+        try:
+            decompositions.decompose(pyramid, period, method)
+        except ValueError as error:
+            # Periods longer than half of the data cannot be decomposed, the page says so
+            return f'{period}/{method}: {error}'
+
+    jobs = [(period, method) for period in decompositions.PERIODS for method in decompositions.METHODS]
+    with concurrent.futures.ThreadPoolExecutor(min(len(jobs), os.cpu_count() or 1)) as pool:
+        skipped = [note for note in pool.map(lambda job: _decompose(*job), jobs) if note]
+    return '; '.join(skipped) or None
+
+
+BUILDERS = {
+    'cache': build_cache,
+    'aggregates': build_aggregates,
+    'rollups': build_rollups,
+    'summaries': build_summaries,
+    'rolling': build_rolling,
+    'decompositions': build_decompositions,
+}
+
+
+def _record(fingerprint, started, note=None, error=None):
+    record = {'fingerprint': fingerprint, 'seconds': round(time.perf_counter() - started, 3),
+              'built': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    if note:
+        record['note'] = note
+    if error:
+        record['error'] = error
+    return record
+
+
+def _current(built, fingerprint, check):
+    return not check and fingerprint is not None and built.get('fingerprint') == fingerprint and 'error' not in built
+
+
+def build_data(meter, built, check=False, models=tuple(forecast_engine.FITTERS)):
+    '''Runs the data stages of one meter whose inputs changed and returns their records
+
+    A stage runs after the one before it, its fingerprint is taken once its
+    inputs are built. The stages after a failed one are not run.
+    '''
+    paths = ingestion.meter_paths(meter)
+    records = {}
+    for stage in DATA_STAGES:
+        fingerprint = fingerprints(meter, models)[stage]
+        if _current(built.get(stage, {}), fingerprint, check):
+            continue
+        started = time.perf_counter()
+        try:
+            note = BUILDERS[stage](meter, paths)
+        except Exception as error:
+            records[stage] = _record(fingerprint, started, error=f'{type(error).__name__}: {error}')
+            break
+        # The cache stage is fingerprinted by its source, known before it runs
+        records[stage] = _record(fingerprints(meter, models)[stage], started, note)
+    return records
+
+
+def build_models(meters, built, check=False, models=tuple(forecast_engine.FITTERS)):
+    '''Fits the default split forecasts of every meter at once, then runs their backtests
+
+    The fits go to the forecast engine's worker processes and land in its disk
+    cache, where the forecasting page finds them. Returns the records per meter.
+    '''
+    records = {meter: {} for meter in meters}
+    todo = {}
+    for meter in meters:
+        prints = fingerprints(meter, models)
+        todo[meter] = [stage for stage in MODEL_STAGES
+                       if not _current(built.get(meter, {}).get(stage, {}), prints[stage], check)]
+
+    started = time.perf_counter()
+    data = {meter: forecast_engine.daily_data(meter) for meter in meters if todo[meter]}
+    futures = {}
+    for meter in meters:
+        for model in models if 'forecasts' in todo[meter] else ():
+            try:
+                futures[meter, model] = forecast_engine.submit(model, data[meter])
+            except ValueError as error:
+                # Data ending before the default split has nothing to forecast
+                futures[meter, model] = f'{model}: {error}'
+    for meter in meters:
+        if 'forecasts' not in todo[meter]:
+            continue
+        notes, errors = [], []
+        for model in models:
+            if isinstance(futures[meter, model], str):
+                notes.append(futures[meter, model])
+                continue
+            try:
+                futures[meter, model].result()
+            except Exception as error:
+                errors.append(f'{model}: {type(error).__name__}: {error}')
+        records[meter]['forecasts'] = _record(fingerprints(meter, models)['forecasts'], started,
+                                              '; '.join(notes), '; '.join(errors))
+
+    for meter in meters:
+        if 'backtest' not in todo[meter]:
+            continue
+        started = time.perf_counter()
+        paths = ingestion.meter_paths(meter)
+        # Keyed like the forecasting page: the version of the aggregates and the models of this run
+        version = ingestion.dataset_version(ingestion.build_aggregates(aggregate_dir=paths['aggregate_dir'],
+                                                                       cache_dir=paths['cache_dir']))
+        try:
+            backtest.run(data[meter], version, models)
+            error = None
+        except Exception as failure:
+            error = f'{type(failure).__name__}: {failure}'
+        records[meter]['backtest'] = _record(fingerprints(meter, models)['backtest'], started, error=error)
+    return records
+
+
+def run(meters=None, check=False, models=tuple(forecast_engine.FITTERS), skip_models=False, workers=WORKERS):
+    '''Builds every stage of the meters whose inputs changed and updates the manifest
+
+    Returns the manifest and the records of the stages that ran.
+    '''
+    manifest = read_manifest()
+    meters = list(meters or ingestion.meter_ids())
+    built = {meter: manifest['meters'].get(meter, {}).get('stages', {}) for meter in meters}
+
+    if len(meters) > 1 and workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(min(workers, len(meters))) as pool:
+            ran = dict(zip(meters, pool.map(build_data, meters, [built[meter] for meter in meters],
+                                            [check] * len(meters), [models] * len(meters))))
+    else:
+        ran = {meter: build_data(meter, built[meter], check, models) for meter in meters}
+
+    # Models need every data stage of their meter
+    ready = [meter for meter in meters if not any('error' in record for record in ran[meter].values())]
+    if not skip_models and ready:
+        for meter, records in build_models(ready, built, check, models).items():
+            ran[meter].update(records)
+
+    for meter in meters:
+        entry = manifest['meters'].setdefault(meter, {'stages': {}})
+        entry['stages'].update(ran[meter])
+        meta = ingestion.read_meta(ingestion.meter_paths(meter)['cache_dir'])
+        entry['dataset_version'] = meta and ingestion.dataset_version(meta)
+    # What the serving app checks its artifacts against
+    manifest['models'] = list(models)
+    manifest['stages'] = DATA_STAGES if skip_models else STAGES
+    if any(ran.values()):
+        manifest['version'] += 1
+        manifest['updated'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    write_manifest(manifest)
+    return manifest, ran
+
+
+def _copy_source(source):
+    '''Puts the local copy of the dataset where the app looks for it, keeping its mtime'''
+    if os.path.abspath(source) == os.path.abspath(ingestion.SOURCE_PATH):
+        return
+    if os.path.exists(ingestion.SOURCE_PATH):
+        stat, copied = os.stat(source), os.stat(ingestion.SOURCE_PATH)
+        if (stat.st_size, int(stat.st_mtime)) == (copied.st_size, int(copied.st_mtime)):
+            return
+    os.makedirs(os.path.dirname(ingestion.SOURCE_PATH) or '.', exist_ok=True)
+    tmp_path = ingestion.SOURCE_PATH + '.part'
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, ingestion.SOURCE_PATH)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Builds every artifact the pages read, only for the inputs that changed.')
+    parser.add_argument('--source', help='local copy of the UCI zip, copied into the data directory')
+    parser.add_argument('--download', action='store_true', help='downloads the UCI zip when there is no local copy')
+    parser.add_argument('--meters', nargs='*', help='meter ids, all meters by default')
+    parser.add_argument('--models', nargs='*', choices=list(forecast_engine.FITTERS), default=list(forecast_engine.FITTERS))
+    parser.add_argument('--skip-models', action='store_true', help='builds the data stages only')
+    parser.add_argument('--check', action='store_true',
+                        help='runs the up-to-date check of every stage, even those the manifest marks current')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='meters built at once')
+    parser.add_argument('--strict', action='store_true', help='fails when a model stage fails too')
+    args = parser.parse_args(argv)
+
+    if args.source:
+        _copy_source(args.source)
+    elif args.download:
+        ingestion.fetch_source()
+
+    started = time.perf_counter()
+    manifest, ran = run(args.meters, args.check, tuple(args.models), args.skip_models, args.workers)
+    failed = []
+    for meter, records in ran.items():
+        for stage in STAGES:
+            record = records.get(stage)
+            if record is None:
+                continue
+            status = 'failed' if 'error' in record else 'built'
+            print(f'{meter:<16} {stage:<16} {status:<8} {record["seconds"]:9.2f} s'
+                  f'  {record.get("error") or record.get("note") or ""}')
+            if 'error' in record:
+                failed.append(stage)
+    print(f'Artifacts version {manifest["version"]}, {sum(map(len, ran.values()))} stages built '
+          f'in {time.perf_counter() - started:.1f} s, the others were current')
+    # The pages cannot be served without the data stages, a failed model stage only leaves its section to compute
+    if any(stage in DATA_STAGES or args.strict for stage in failed):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
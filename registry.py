@@ -0,0 +1,101 @@
+# Load standard libraries
+import os
+import pickle
+import threading
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+import instrument
+
+# Forecast artifacts shipped with the app
+MODEL_DIR = os.environ.get('POWER_MODEL_DIR', os.path.dirname(os.path.abspath(__file__)))
+FORECASTS = {
+    'FBProphet': 'FBProphet_forecast.npz',
+    'ARIMA': 'ARIMA_forecast.npz',
+}
+# Pickles written by the notebooks, converted to .npz when no .npz exists yet
+LEGACY_PICKLES = {
+    'FBProphet': 'FBProphet_model_pickle.sav',
+    'ARIMA': 'ARIMA_model_pickle.sav',
+}
+
+_ARTIFACTS = {}
+_ARTIFACTS_LOCK = threading.Lock()
+
+
+class Artifact:
+    '''A loaded file together with the hash and version it was loaded from'''
+
+    def __init__(self, path, checksum, version, stat, value):
+        self.path = path
+        self.checksum = checksum
+        self.version = version
+        self.stat = stat
+        self.value = value
+
+
+def _stat_key(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_npz(path):
+    '''Loads every array of an .npz file into a dict'''
+    with np.load(path, allow_pickle=False) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def get_artifact(path, loader=load_npz):
+    '''Returns the artifact of a file, loading it once per process and again only when it changes'''
+    path = os.path.abspath(path)
+    stat = _stat_key(path)
+    with _ARTIFACTS_LOCK:
+        artifact = _ARTIFACTS.get(path)
+        if artifact is not None and artifact.stat == stat:
+            return artifact
+        checksum = ingestion.file_checksum(path)
+        if artifact is not None and artifact.checksum == checksum:
+            artifact.stat = stat
+            return artifact
+        version = artifact.version + 1 if artifact is not None else 1
+        with instrument.stage('model_load'):
+            value = loader(path)
+        artifact = _ARTIFACTS[path] = Artifact(path, checksum, version, stat, value)
+        return artifact
+
+
+def forecast_to_arrays(forecast):
+    '''Converts a pickled forecast, a DataFrame or a plain array, into named arrays'''
+    if isinstance(forecast, pd.DataFrame):
+        return {col: forecast[col].to_numpy(dtype=forecast[col].dtype.str) for col in forecast.columns}
+    return {'yhat': np.asarray(forecast, dtype=np.float64)}
+
+
+def convert_pickle(pickle_path, npz_path):
+    '''Rewrites a pickled forecast as a compressed .npz file'''
+    with open(pickle_path, 'rb') as f:
+        forecast = pickle.load(f)
+    tmp_path = npz_path + '.tmp.npz'
+    np.savez_compressed(tmp_path, **forecast_to_arrays(forecast))
+    os.replace(tmp_path, npz_path)
+
+
+def forecast_path(name, model_dir=MODEL_DIR):
+    '''Returns the .npz path of a forecast, converting the legacy pickle when needed'''
+    npz_path = os.path.join(model_dir, FORECASTS[name])
+    pickle_path = os.path.join(model_dir, LEGACY_PICKLES[name])
+    if not os.path.exists(npz_path) and os.path.exists(pickle_path):
+        convert_pickle(pickle_path, npz_path)
+    return npz_path
+
+
+def load_forecast(name, model_dir=MODEL_DIR):
+    '''Returns the stored forecast of a model as a dict of arrays'''
+    return get_artifact(forecast_path(name, model_dir)).value
+
+
+def forecasts_version(model_dir=MODEL_DIR):
+    '''Returns a label that changes whenever one of the forecast files changes'''
+    return '.'.join(get_artifact(forecast_path(name, model_dir)).checksum[:12] for name in FORECASTS)
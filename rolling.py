@@ -0,0 +1,115 @@
+# Load standard libraries
+import os
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+
+STATS = ['mean', 'sum', 'min', 'max', 'std']
+
+
+def rolling_dir(rollup_dir, level, measure, stat, windows, stats):
+    '''Rolling statistics are stored next to the rollup levels they are computed from'''
+    windows = '-'.join(str(window) for window in windows)
+    return os.path.join(rollup_dir, 'rolling', f'{measure}-{stat}-{level}-{windows}-{"-".join(stats)}')
+
+
+def _window_extreme(values, window, extreme):
+    '''Min or max of every trailing window with three operations per point, whatever the window
+
+    The series is cut into blocks of the window length. A window always spans
+    the tail of one block and the head of the next, so it is the extreme of a
+    running suffix and a running prefix (van Herk / Gil-Werman). The first
+    points get the extreme of the values so far.
+    '''
+    n = len(values)
+    blocks = -(-n // window)
+    padded = np.full(blocks * window, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(blocks, window)
+    prefix = extreme.accumulate(padded, axis=1).ravel()[:n]
+    suffix = extreme.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()[:n]
+    result = prefix.copy()
+    result[window - 1:] = extreme(suffix[:max(n - window + 1, 0)], prefix[window - 1:])
+    return result
+
+
+def rolling_stats(values, windows=(12,), stats=('mean',), history=0, min_periods=None):
+    '''Computes trailing window statistics for several windows in one pass
+
+    The first history values were already processed and only give the windows
+    of the following points their past, results start after them. A window
+    needs min_periods valid values, the window length by default.
+    Returns the columns <stat>_<window>.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    # Centering on one value keeps the running sums of squares small
+    shift = values[valid][0] if valid.any() else 0.0
+    centered = np.where(valid, values - shift, 0.0)
+    counts = np.r_[0, np.cumsum(valid)]
+    sums = np.r_[0.0, np.cumsum(centered)]
+    squares = np.r_[0.0, np.cumsum(centered * centered)]
+    ends = np.arange(history + 1, len(values) + 1)
+
+    columns = {}
+    for window in windows:
+        starts = np.maximum(ends - window, 0)
+        n = counts[ends] - counts[starts]
+        total = sums[ends] - sums[starts]
+        enough = n >= (min_periods or window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / n
+            if 'mean' in stats:
+                columns[f'mean_{window}'] = np.where(enough, mean + shift, np.nan)
+            if 'sum' in stats:
+                columns[f'sum_{window}'] = np.where(enough, total + n * shift, np.nan)
+            if 'std' in stats:
+                variance = (squares[ends] - squares[starts] - total * mean) / (n - 1)
+                columns[f'std_{window}'] = np.where(enough, np.sqrt(np.maximum(variance, 0)), np.nan)
+        for stat, extreme in (('min', np.fmin), ('max', np.fmax)):
+            if stat in stats:
+                columns[f'{stat}_{window}'] = np.where(enough, _window_extreme(values, window, extreme)[history:],
+                                                       np.nan)
+    return columns
+
+
+def rolling_frame(pyramid, level='day', measure='Global_active_power', windows=(12,), stats=('mean',), stat='sum'):
+    '''Returns a rollup series with its rolling statistics, kept on disk and extended on appends
+
+    Appended readings only change the last stored bucket and the buckets after
+    it, so only those are computed again, from the tail of the windows before.
+    '''
+    windows, stats = sorted(set(windows)), [name for name in STATS if name in stats]
+    _, source = pyramid.query(level, measures=[measure], stats=(stat,))
+    stamps = np.asarray(source[ingestion.TIMESTAMP], dtype=np.int64)
+    values = np.asarray(source[f'{measure}_{stat}'], dtype=np.float64)
+    names = [f'{name}_{window}' for window in windows for name in stats]
+    directory = rolling_dir(pyramid.rollup_dir, level, measure, stat, windows, stats)
+    checksum = pyramid.minute_store.meta['checksum']
+
+    # Chart jobs asking for the same moving averages compute them once
+    with ingestion.directory_lock(directory):
+        meta = ingestion.read_meta(directory)
+        if meta is None or meta['checksum'] != checksum or meta['version'] != pyramid.version:
+            keep = 0
+            if meta and meta['checksum'] == checksum and 0 < meta['rows'] <= len(stamps):
+                stored = ingestion.load_directory(directory, [ingestion.TIMESTAMP] + names)
+                keep = meta['rows'] - 1
+                # Rows are only reused while the buckets before them are unchanged
+                if stored[ingestion.TIMESTAMP][keep - 1:keep].tolist() != stamps[keep - 1:keep].tolist():
+                    keep = 0
+            history = min(keep, windows[-1] - 1)
+            columns = rolling_stats(values[keep - history:], windows, stats, history)
+            if keep:
+                columns = {name: np.concatenate([stored[name][:keep], columns[name]]) for name in names}
+            columns[ingestion.TIMESTAMP] = stamps
+            meta = {'format': ingestion.CACHE_FORMAT, 'checksum': checksum, 'version': pyramid.version,
+                    'rows': int(len(stamps)), 'reused': int(keep)}
+            ingestion.write_cache(columns, meta, directory)
+
+        columns = ingestion.load_directory(directory, names, mmap_mode='r')
+    data = pd.DataFrame({measure: values, **{name: columns[name] for name in names}})
+    data.insert(0, ingestion.TIMESTAMP, stamps.astype('datetime64[m]').astype('datetime64[ns]'))
+    return data
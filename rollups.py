@@ -0,0 +1,341 @@
+# Load standard libraries
+import os
+import threading
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+import gaps
+import instrument
+import store
+import timestamps
+
+ROLLUP_DIR = os.path.join(ingestion.DATA_DIR, 'rollups')
+
+# Statistics kept for every measure at every level
+STATS = ['sum', 'mean', 'min', 'max', 'count']
+
+# Levels from the finest, weeks start on Monday and months follow the calendar
+LEVELS = ['minute', '15min', 'hour', 'day', 'week', 'month']
+
+# Bucket width in minutes of the fixed width levels, months are handled by the calendar
+LEVEL_WIDTHS = {
+    'minute': 1,
+    '15min': 15,
+    'hour': 60,
+    'day': timestamps.MINUTES_PER_DAY,
+    'week': 7 * timestamps.MINUTES_PER_DAY,
+}
+LEVEL_TITLES = {'minute': 'Minute', '15min': '15 Minute', 'hour': 'Hourly',
+                'day': 'Daily', 'week': 'Weekly', 'month': 'Monthly'}
+
+# Every level above minute is reduced from a finer, already built level
+PARENT_LEVELS = {'15min': 'minute', 'hour': '15min', 'day': 'hour', 'week': 'day', 'month': 'day'}
+
+_PYRAMIDS = {}
+_PYRAMIDS_LOCK = threading.Lock()
+
+
+def bucket_starts(level, stamps):
+    '''Returns the start of the level bucket, in epoch minutes, of every timestamp'''
+    stamps = np.asarray(stamps, dtype=np.int64)
+    if level == 'week':
+        # The epoch starts on a Thursday, weeks start on Monday
+        days = stamps // timestamps.MINUTES_PER_DAY
+        return (days - (days + 3) % 7) * timestamps.MINUTES_PER_DAY
+    if level == 'month':
+        months = stamps.astype('datetime64[m]').astype('datetime64[M]')
+        return months.astype('datetime64[m]').astype(np.int64)
+    width = LEVEL_WIDTHS[level]
+    return stamps // width * width
+
+
+def bucket_widths(level, starts):
+    '''Returns the width in minutes of every bucket, months have their calendar length'''
+    starts = np.asarray(starts, dtype=np.int64)
+    if level == 'month':
+        months = starts.astype('datetime64[m]').astype('datetime64[M]')
+        return (months + 1).astype('datetime64[m]').astype(np.int64) - starts
+    return np.full(len(starts), LEVEL_WIDTHS[level], dtype=np.int64)
+
+
+def bucket_grid(level, first, last):
+    '''Returns the start of every bucket of the level between the buckets of first and last, empty ones included'''
+    low, high = bucket_starts(level, [first, last])
+    if level == 'month':
+        months = np.arange(np.datetime64(int(low), 'm').astype('datetime64[M]'),
+                           np.datetime64(int(high), 'm').astype('datetime64[M]') + 1)
+        return months.astype('datetime64[m]').astype(np.int64)
+    return np.arange(low, high + 1, LEVEL_WIDTHS[level], dtype=np.int64)
+
+
+def _minute_stats(values):
+    '''Turns raw minute values into sum/count/min/max arrays that can be reduced further'''
+    valid = ~np.isnan(values)
+    return {
+        'sum': np.where(valid, values, 0).astype(np.float64),
+        'count': valid.astype(np.int64),
+        'min': values,
+        'max': values,
+    }
+
+
+def _reduce(level, starts, stats):
+    '''Reduces finer buckets into the buckets of the level'''
+    keys = bucket_starts(level, starts)
+    if not len(keys):
+        return keys, {stat: values[:0] for stat, values in stats.items()}
+    first_rows = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1])
+    reduced = {
+        'sum': np.add.reduceat(stats['sum'], first_rows),
+        'count': np.add.reduceat(stats['count'], first_rows),
+        'min': np.fmin.reduceat(stats['min'], first_rows),
+        'max': np.fmax.reduceat(stats['max'], first_rows),
+    }
+    return keys[first_rows], reduced
+
+
+def _with_mean(stats):
+    '''Adds the mean, left as NaN for buckets without valid readings'''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats['mean'] = np.where(stats['count'] > 0, stats['sum'] / np.maximum(stats['count'], 1), np.nan)
+    return stats
+
+
+def _reduce_minutes(index, values, chunk_rows=ingestion.CHUNK_ROWS):
+    '''Reduces one minute column into 15 minute buckets, chunk by chunk'''
+    width = LEVEL_WIDTHS['15min']
+    starts, parts = [], []
+    lo = 0
+    while lo < len(index):
+        hi = min(lo + chunk_rows, len(index))
+        if hi < len(index):
+            # Ending the chunk on a bucket boundary keeps every bucket in one chunk,
+            # a chunk shorter than its bucket ends after the bucket instead
+            bucket = index[hi] // width * width
+            hi = int(index.searchsorted(bucket, 'left'))
+            if hi <= lo:
+                hi = int(index.searchsorted(bucket + width, 'left'))
+        chunk_starts, chunk_stats = _reduce('15min', index[lo:hi], _minute_stats(np.asarray(values[lo:hi])))
+        starts.append(chunk_starts)
+        parts.append(chunk_stats)
+        lo = hi
+    if not parts:
+        return np.zeros(0, dtype=np.int64), _minute_stats(np.zeros(0, dtype=np.float32))
+    return np.concatenate(starts), {stat: np.concatenate([part[stat] for part in parts]) for stat in parts[0]}
+
+
+@instrument.timed('groupby')
+def build_levels(index, column, measures):
+    '''Computes every level above minute as columns of per-measure statistics
+
+    column(name) returns the minute values of a measure aligned with index.
+    '''
+    levels = {level: {} for level in LEVELS[1:]}
+    for measure in measures:
+        built = {'15min': _reduce_minutes(index, column(measure))}
+        for level in LEVELS[2:]:
+            parent_starts, parent_stats = built[PARENT_LEVELS[level]]
+            built[level] = _reduce(level, parent_starts, parent_stats)
+        for level, (starts, stats) in built.items():
+            levels[level][ingestion.TIMESTAMP] = starts
+            for stat, values in _with_mean(stats).items():
+                levels[level][f'{measure}_{stat}'] = values
+    return levels
+
+
+def _merge_level(level, existing, new, measures):
+    '''Merges the buckets of newer readings into a level, re-reducing only the overlapping tail'''
+    new_starts = new[ingestion.TIMESTAMP]
+    if not len(new_starts):
+        return existing
+    old_starts = np.asarray(existing[ingestion.TIMESTAMP])
+    keep = int(np.searchsorted(old_starts, new_starts[0], 'left'))
+    tail_starts = np.concatenate([old_starts[keep:], new_starts])
+    merged = {ingestion.TIMESTAMP: None}
+    for measure in measures:
+        tail_stats = {stat: np.concatenate([np.asarray(existing[f'{measure}_{stat}'][keep:]),
+                                            new[f'{measure}_{stat}']])
+                      for stat in ('sum', 'count', 'min', 'max')}
+        starts, stats = _reduce(level, tail_starts, tail_stats)
+        merged[ingestion.TIMESTAMP] = np.concatenate([old_starts[:keep], starts])
+        for stat, values in _with_mean(stats).items():
+            merged[f'{measure}_{stat}'] = np.concatenate([np.asarray(existing[f'{measure}_{stat}'][:keep]), values])
+    return merged
+
+
+def _write_levels(levels, meta, rollup_dir):
+    '''Writes every level, the coarsest level is written last and marks the pyramid as complete'''
+    for level in LEVELS[1:]:
+        columns = levels[level]
+        ingestion.write_cache(columns, dict(meta, rows=int(len(columns[ingestion.TIMESTAMP]))),
+                              os.path.join(rollup_dir, level))
+
+
+@ingestion.locks_directory('rollup_dir')
+def update_rollups(cache_dir=ingestion.CACHE_DIR, rollup_dir=ROLLUP_DIR):
+    '''Merges the partitions appended since the rollups were written into every level'''
+    meta = ingestion.read_meta(os.path.join(rollup_dir, LEVELS[-1]))
+    cache_meta = ingestion.read_meta(cache_dir)
+    if meta is None or cache_meta is None or meta['checksum'] != cache_meta['checksum']:
+        return meta
+    partitions = [part for part in cache_meta['partitions'] if part['version'] > meta['version']]
+    if not partitions:
+        return meta
+
+    measures = meta['measures']
+    names = [ingestion.TIMESTAMP] + [f'{measure}_{stat}' for measure in measures for stat in STATS]
+    levels = {level: ingestion.load_directory(os.path.join(rollup_dir, level), names)
+              for level in LEVELS[1:]}
+    for part in partitions:
+        columns = ingestion.partition_columns(part['name'], measures, cache_dir)
+        new_levels = build_levels(columns[ingestion.TIMESTAMP], columns.get, measures)
+        # Only the buckets touched by the new readings are reduced again
+        levels = {level: _merge_level(level, levels[level], new_levels[level], measures)
+                  for level in LEVELS[1:]}
+    meta = dict(meta, version=cache_meta['version'])
+    _write_levels(levels, meta, rollup_dir)
+    return meta
+
+
+@ingestion.locks_directory('rollup_dir')
+def build_rollups(source=None, cache_dir=ingestion.CACHE_DIR, rollup_dir=ROLLUP_DIR):
+    '''Builds the rollup pyramid from the minute store unless it is already current'''
+    minute_store = store.open_store(source, cache_dir)
+    meta = ingestion.read_meta(os.path.join(rollup_dir, LEVELS[-1]))
+    if not (meta and meta['checksum'] == minute_store.meta['checksum']
+            and meta['version'] <= minute_store.meta['version'] and meta['measures'] == minute_store.measures):
+        meta = {
+            'format': ingestion.CACHE_FORMAT,
+            'checksum': minute_store.meta['checksum'],
+            'measures': minute_store.measures,
+            'version': minute_store.meta['version'],
+        }
+        levels = build_levels(minute_store.index, minute_store.column, minute_store.measures)
+        _write_levels(levels, meta, rollup_dir)
+    # Readings appended after the last build are merged in afterwards
+    return update_rollups(cache_dir, rollup_dir)
+
+
+class RollupPyramid:
+    '''Read access to the minute store and the precomputed rollup levels'''
+
+    def __init__(self, minute_store, rollup_dir=ROLLUP_DIR):
+        self.minute_store = minute_store
+        self.rollup_dir = rollup_dir
+        self.measures = minute_store.measures
+        self.version = minute_store.version
+        self._levels = {}
+
+    def _column(self, level, name):
+        '''Memory maps one column of a rollup level'''
+        key = (level, name)
+        if key not in self._levels:
+            path = os.path.join(self.rollup_dir, level, name + '.npy')
+            self._levels[key] = np.load(path, mmap_mode='r')
+        return self._levels[key]
+
+    def points(self, level, start=None, end=None):
+        '''Returns the number of stored buckets of the level between start and end, calendar months included'''
+        lo, hi = self._bounds(level, start, end)
+        return hi - lo
+
+    def choose_level(self, start=None, end=None, max_points=2000):
+        '''Returns the finest level whose number of points stays within max_points'''
+        for level in LEVELS:
+            if self.points(level, start, end) <= max_points:
+                return level
+        return LEVELS[-1]
+
+    def _bounds(self, level, start, end):
+        '''Returns the row positions of the buckets that start within [start, end)'''
+        if level == 'minute':
+            return self.minute_store.bounds(start, end)
+        index = self._column(level, ingestion.TIMESTAMP)
+        lo = 0 if start is None else int(index.searchsorted(bucket_starts(level, [timestamps.to_epoch_minutes(start)])[0], 'left'))
+        hi = len(index) if end is None else int(index.searchsorted(timestamps.to_epoch_minutes(end), 'left'))
+        return lo, max(lo, hi)
+
+    def query(self, level=None, start=None, end=None, measures=None, stats=('mean',), max_points=2000):
+        '''Returns the statistics of a range as columns named <measure>_<stat>
+
+        When no level is given, the finest level that fits max_points is used.
+        '''
+        level = level or self.choose_level(start, end, max_points)
+        measures = measures or self.measures
+        lo, hi = self._bounds(level, start, end)
+        if level == 'minute':
+            views = self.minute_store.take(lo, hi, measures)
+            columns = {ingestion.TIMESTAMP: views.pop(ingestion.TIMESTAMP)}
+            for measure, values in views.items():
+                minute_stats = _with_mean(_minute_stats(np.asarray(values)))
+                for stat in stats:
+                    columns[f'{measure}_{stat}'] = minute_stats[stat]
+            return level, columns
+        columns = {ingestion.TIMESTAMP: self._column(level, ingestion.TIMESTAMP)[lo:hi]}
+        for measure in measures:
+            for stat in stats:
+                columns[f'{measure}_{stat}'] = self._column(level, f'{measure}_{stat}')[lo:hi]
+        return level, columns
+
+    def frame(self, level=None, start=None, end=None, measures=None, stat='sum', max_points=2000,
+              gap_policy='zero', min_coverage=gaps.MIN_COVERAGE):
+        '''Returns one statistic per measure as a DataFrame with a Date_time column
+
+        gap_policy decides how buckets with missing readings are treated, see
+        gaps.POLICIES. With skip, a bucket is dropped when any measure lacks
+        coverage. With fill, buckets without a single row are added and filled.
+        '''
+        measures = measures or self.measures
+        stats = (stat,) if gap_policy == 'zero' else (stat, 'count')
+        level, columns = self.query(level, start, end, measures, stats, max_points)
+        stamps = np.asarray(columns[ingestion.TIMESTAMP], dtype=np.int64)
+        values = {measure: np.asarray(columns[f'{measure}_{stat}']) for measure in measures}
+        if gap_policy != 'zero' and len(stamps):
+            counts = {measure: np.asarray(columns[f'{measure}_count']) for measure in measures}
+            if gap_policy == 'fill':
+                grid = bucket_grid(level, stamps[0], stamps[-1])
+                positions = np.searchsorted(grid, stamps)
+                for measure in measures:
+                    values[measure] = np.full(len(grid), np.nan)
+                    values[measure][positions] = columns[f'{measure}_{stat}']
+                    counts[measure] = np.zeros(len(grid), dtype=np.int64)
+                    counts[measure][positions] = columns[f'{measure}_count']
+                stamps = grid
+            expected = gaps.expected_minutes(stamps, bucket_widths(level, stamps),
+                                             int(self.minute_store.index[0]), int(self.minute_store.index[-1]))
+            keep = np.ones(len(stamps), dtype=bool)
+            for measure in measures:
+                values[measure], _, kept = gaps.apply_policy(stamps, values[measure], counts[measure], expected,
+                                                             gap_policy, min_coverage, additive=stat == 'sum')
+                keep &= kept
+            stamps = stamps[keep]
+            values = {measure: column[keep] for measure, column in values.items()}
+        data = pd.DataFrame(values)
+        data.insert(0, ingestion.TIMESTAMP, stamps.astype('datetime64[m]').astype('datetime64[ns]'))
+        return data
+
+    def coverage(self, level=None, start=None, end=None, measures=None, max_points=2000):
+        '''Returns the share of the minutes of every bucket that have a reading, per measure'''
+        measures = measures or self.measures
+        level, columns = self.query(level, start, end, measures, ('count',), max_points)
+        stamps = np.asarray(columns[ingestion.TIMESTAMP], dtype=np.int64)
+        expected = gaps.expected_minutes(stamps, bucket_widths(level, stamps),
+                                         int(self.minute_store.index[0]), int(self.minute_store.index[-1]))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            data = pd.DataFrame({measure: np.asarray(columns[f'{measure}_count']) / expected
+                                 for measure in measures})
+        data.insert(0, ingestion.TIMESTAMP, stamps.astype('datetime64[m]').astype('datetime64[ns]'))
+        return data
+
+
+def open_pyramid(source=None, cache_dir=ingestion.CACHE_DIR, rollup_dir=ROLLUP_DIR):
+    '''Builds the rollups if needed and returns the process-wide pyramid for them'''
+    build_rollups(source, cache_dir, rollup_dir)
+    minute_store = store.open_store(source, cache_dir)
+    with _PYRAMIDS_LOCK:
+        pyramid = _PYRAMIDS.get(rollup_dir)
+        if pyramid is None or pyramid.version != minute_store.version:
+            pyramid = _PYRAMIDS[rollup_dir] = RollupPyramid(minute_store, rollup_dir)
+    return pyramid
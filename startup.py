@@ -0,0 +1,87 @@
+# Load standard libraries
+import argparse
+import collections
+import importlib
+import subprocess
+import sys
+import threading
+import time
+
+# Load Data libraries
+import pandas as pd
+
+# Import cost of every page module, recorded when the page is first selected
+_IMPORTS = {}
+_IMPORTS_LOCK = threading.Lock()
+
+
+def _top_level(name):
+    return name.split('.', 1)[0]
+
+
+def import_page(name):
+    '''Imports a page module on first use and records what the import cost'''
+    with _IMPORTS_LOCK:
+        if name in _IMPORTS:
+            return sys.modules[name]
+        before = set(sys.modules)
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        seconds = time.perf_counter() - started
+        loaded = collections.Counter(_top_level(mod) for mod in set(sys.modules) - before)
+        _IMPORTS[name] = {'seconds': seconds, 'modules': sum(loaded.values()), 'packages': loaded}
+        return module
+
+
+def import_report():
+    '''Returns one row per imported page with its import time and the packages it loaded first'''
+    with _IMPORTS_LOCK:
+        rows = [{
+            'page': name,
+            'seconds': round(record['seconds'], 3),
+            'modules': record['modules'],
+            'largest packages': ', '.join(f'{package} ({count})'
+                                          for package, count in record['packages'].most_common(5)),
+        } for name, record in _IMPORTS.items()]
+    return pd.DataFrame(rows, columns=['page', 'seconds', 'modules', 'largest packages'])
+
+
+def _import_trace(code):
+    '''Runs code in a fresh interpreter and sums the -X importtime self times per top level package'''
+    trace = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                           capture_output=True, text=True).stderr
+    totals = collections.Counter()
+    for line in trace.splitlines():
+        if not line.startswith('import time:') or '|' not in line or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        totals[_top_level(name.strip())] += int(self_us)
+    return totals
+
+
+def import_times(module):
+    '''Returns the seconds a cold import of a module spends in every top level package
+
+    Uses the interpreter's own -X importtime trace, so every nested import is
+    counted, minus what the bare interpreter imports at startup.
+    '''
+    totals = _import_trace(f'import {module}')
+    totals.subtract(_import_trace('pass'))
+    totals = {package: us for package, us in totals.items() if us > 0}
+    return pd.Series(totals, dtype='int64').sort_values(ascending=False) / 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reports the cold import cost of the app pages.')
+    parser.add_argument('modules', nargs='*', default=['about_data_app', 'exploratory_app', 'forecasting_app'])
+    parser.add_argument('--top', type=int, default=10, help='packages listed per module')
+    args = parser.parse_args(argv)
+    for module in args.modules:
+        seconds = import_times(module)
+        print(f'{module}: {seconds.sum():.2f} s')
+        for package, value in seconds.head(args.top).items():
+            print(f'    {package:<24}{value:8.3f} s')
+
+
+if __name__ == '__main__':
+    main()
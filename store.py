@@ -0,0 +1,240 @@
+# Load standard libraries
+import os
+import threading
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+import gaps
+import timestamps
+
+# One store per cache directory, shared by every session of the process
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+# Rows of one page of the full data table
+PAGE_ROWS = 100
+
+
+class ChainedColumn:
+    '''One column split over time ordered partitions, sliced without copies inside a partition'''
+
+    def __init__(self, parts):
+        self.parts = [part for part in parts if len(part)] or parts[:1]
+        self.offsets = np.cumsum([0] + [len(part) for part in self.parts])
+        self.dtype = self.parts[0].dtype
+        # Only meaningful for a sorted column such as the timestamps
+        self.lasts = np.array([part[-1] for part in self.parts if len(part)])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def nbytes(self):
+        return sum(part.nbytes for part in self.parts)
+
+    def _locate(self, position):
+        '''Returns the partition holding a row position'''
+        return int(np.searchsorted(self.offsets, position, 'right')) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('Only contiguous slices are supported')
+            if stop <= start:
+                return self.parts[0][:0]
+            first, last = self._locate(start), self._locate(stop - 1)
+            if first == last:
+                offset = self.offsets[first]
+                return self.parts[first][start - offset:stop - offset]
+            return np.concatenate([self.parts[i][max(start - self.offsets[i], 0):stop - self.offsets[i]]
+                                   for i in range(first, last + 1)])
+        if isinstance(key, (int, np.integer)):
+            position = int(key) + len(self) if key < 0 else int(key)
+            part = self._locate(position)
+            return self.parts[part][position - self.offsets[part]]
+        positions = np.asarray(key)
+        result = np.empty(len(positions), dtype=self.dtype)
+        owners = np.searchsorted(self.offsets, positions, 'right') - 1
+        for part in np.unique(owners):
+            rows = owners == part
+            result[rows] = self.parts[part][positions[rows] - self.offsets[part]]
+        return result
+
+    def searchsorted(self, value, side='left'):
+        '''Binary search over the last value of every partition, then inside one partition'''
+        part = int(np.searchsorted(self.lasts, value, side))
+        if part == len(self.parts):
+            return len(self)
+        return int(self.offsets[part] + np.searchsorted(self.parts[part], value, side))
+
+
+class MinuteStore:
+    '''Memory-mapped minute series with binary search time range slicing
+
+    Slices are zero-copy views as long as they stay inside one partition.
+    '''
+
+    def __init__(self, cache_dir=ingestion.CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.meta = ingestion.read_meta(cache_dir)
+        if self.meta is None:
+            raise FileNotFoundError(f'No columnar cache in {cache_dir}')
+        self.measures = [name for name in self.meta['columns'] if name != ingestion.TIMESTAMP]
+        self.index = self._open(ingestion.TIMESTAMP)
+        self._columns = {}
+        self._validity = None
+        self._gaps = None
+
+    def _open(self, name):
+        '''Memory maps one column in every partition'''
+        return ChainedColumn([np.load(os.path.join(self.cache_dir, part['name'], name + '.npy'), mmap_mode='r')
+                              for part in self.meta['partitions']])
+
+    def column(self, name):
+        '''Returns the memory map of one column'''
+        if name == ingestion.TIMESTAMP:
+            return self.index
+        if name not in self._columns:
+            if name not in self.measures:
+                raise KeyError(name)
+            self._columns[name] = self._open(name)
+        return self._columns[name]
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def version(self):
+        '''Dataset version, bumped by every append'''
+        return ingestion.dataset_version(self.meta)
+
+    def range_version(self, start=None, end=None):
+        '''Version of the data between start and end, unchanged by appends outside the range'''
+        return ingestion.range_version(
+            self.meta,
+            None if start is None else timestamps.to_epoch_minutes(start),
+            None if end is None else timestamps.to_epoch_minutes(end))
+
+    @property
+    def nbytes(self):
+        '''Size of all the column files'''
+        return sum(self.column(name).nbytes for name in [ingestion.TIMESTAMP] + self.measures)
+
+    @property
+    def first(self):
+        return pd.Timestamp(int(self.index[0]), unit='m')
+
+    @property
+    def last(self):
+        return pd.Timestamp(int(self.index[-1]), unit='m')
+
+    def bounds(self, start=None, end=None):
+        '''Returns the row positions of the half open range [start, end)'''
+        lo = 0 if start is None else self.index.searchsorted(timestamps.to_epoch_minutes(start), 'left')
+        hi = len(self.index) if end is None else self.index.searchsorted(timestamps.to_epoch_minutes(end), 'left')
+        return lo, max(lo, hi)
+
+    def take(self, lo, hi, columns=None):
+        '''Returns the rows lo..hi of the columns as zero-copy views'''
+        columns = columns or self.measures
+        return {name: self.column(name)[lo:hi] for name in [ingestion.TIMESTAMP] + list(columns)}
+
+    def slice(self, start=None, end=None, columns=None):
+        '''Returns the rows between start and end as zero-copy views'''
+        return self.take(*self.bounds(start, end), columns=columns)
+
+    def validity(self):
+        '''Returns the per row validity bitmask, bit i set when measure i is present'''
+        if self._validity is None:
+            self._validity = ChainedColumn([ingestion.partition_validity(part['name'], self.cache_dir)[ingestion.VALIDITY]
+                                            for part in self.meta['partitions']])
+        return self._validity
+
+    def gaps(self):
+        '''Returns the [start, end) minute intervals with a missing measure or no row, as an (n, 2) array'''
+        if self._gaps is None:
+            parts, previous = [], None
+            for part in self.meta['partitions']:
+                if not part['rows']:
+                    continue
+                if previous is not None and part['start'] > previous + 1:
+                    # Minutes between two partitions are missing too
+                    parts.append(np.array([[previous + 1, part['start']]], dtype=np.int64))
+                parts.append(np.asarray(ingestion.partition_validity(part['name'], self.cache_dir)[ingestion.GAPS]))
+                previous = part['end']
+            self._gaps = np.concatenate(parts) if parts else np.zeros((0, 2), dtype=np.int64)
+        return self._gaps
+
+    def coverage(self, start=None, end=None):
+        '''Returns the share of the minutes in [start, end) that have every measure, from the gap index alone'''
+        first, last = int(self.index[0]), int(self.index[-1])
+        start = first if start is None else max(timestamps.to_epoch_minutes(start), first)
+        end = last + 1 if end is None else min(timestamps.to_epoch_minutes(end), last + 1)
+        if end <= start:
+            return np.nan
+        return 1 - int(gaps.missing_minutes(self.gaps(), [start], [end])[0]) / (end - start)
+
+    def to_frame(self, views):
+        '''Copies views into a DataFrame with a Date_time column'''
+        data = pd.DataFrame({name: np.asarray(values) for name, values in views.items()
+                             if name != ingestion.TIMESTAMP})
+        stamps = np.asarray(views[ingestion.TIMESTAMP]).astype('datetime64[m]').astype('datetime64[ns]')
+        data.insert(0, ingestion.TIMESTAMP, stamps)
+        return data
+
+    def frame(self, start=None, end=None, columns=None):
+        '''Returns the rows between start and end as a DataFrame'''
+        return self.to_frame(self.slice(start, end, columns))
+
+    def _sorted_positions(self, lo, hi, first, last, sort_by, ascending):
+        '''Returns the row positions ranked first..last when lo..hi is ordered by a column'''
+        if sort_by in (None, ingestion.TIMESTAMP):
+            # The rows are stored in time order, so a page is a plain range
+            if ascending:
+                return np.arange(lo + first, lo + last)
+            return np.arange(hi - 1 - first, hi - 1 - last, -1)
+        values = np.asarray(self.column(sort_by)[lo:hi], dtype=np.float64)
+        key = values if ascending else -values
+        # Missing readings go last in both orders
+        key = np.where(np.isnan(key), np.inf, key)
+        # Partitioning on the last rank keeps only the rows up to the page, ties keep time order
+        boundary = key[np.argpartition(key, last - 1)[last - 1]]
+        below = np.flatnonzero(key < boundary)
+        tied = np.flatnonzero(key == boundary)[:last - len(below)]
+        candidates = np.concatenate([below, tied])
+        candidates = candidates[np.lexsort((candidates, key[candidates]))]
+        return lo + candidates[first:last]
+
+    def page(self, number=0, size=PAGE_ROWS, start=None, end=None, sort_by=None, ascending=True, columns=None):
+        '''Returns one page of the rows between start and end and the number of rows in the range
+
+        Pages in time order are read straight from the memory maps, pages sorted by
+        a measure partially sort that column over the range only.
+        '''
+        lo, hi = self.bounds(start, end)
+        total = hi - lo
+        first = min(number * size, total)
+        last = min(first + size, total)
+        if last <= first:
+            return self.to_frame(self.take(lo, lo, columns)), total
+        positions = self._sorted_positions(lo, hi, first, last, sort_by, ascending)
+        columns = columns or self.measures
+        views = {name: self.column(name)[positions] for name in [ingestion.TIMESTAMP] + list(columns)}
+        return self.to_frame(views), total
+
+    def head(self, rows=5, columns=None):
+        '''Returns the first rows as a DataFrame'''
+        return self.to_frame(self.take(0, rows, columns))
+
+
+def open_store(source=None, cache_dir=ingestion.CACHE_DIR):
+    '''Builds the cache if needed and returns the process-wide store for it'''
+    meta = ingestion.build_cache(source, cache_dir)
+    with _STORES_LOCK:
+        minute_store = _STORES.get(cache_dir)
+        if minute_store is None or minute_store.version != ingestion.dataset_version(meta):
+            minute_store = _STORES[cache_dir] = MinuteStore(cache_dir)
+    return minute_store
@@ -0,0 +1,289 @@
+# Load standard libraries
+import os
+
+# Load Data libraries
+import numpy as np
+import gaps
+import ingestion
+import rollups
+import timestamps
+
+# Centroids kept by a quantile sketch, more centroids give tighter quantiles
+COMPRESSION = 100
+
+MOMENT_COLUMNS = ['n', 'mean', 'm2']
+SKETCH_COLUMNS = ['centroid_mean', 'centroid_weight', 'offsets', 'min', 'max']
+
+
+def _day_groups(stamps):
+    '''Returns the start of every day of sorted timestamps and the day position of each row'''
+    days = np.asarray(stamps, dtype=np.int64) // timestamps.MINUTES_PER_DAY
+    first_rows = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(days) else np.zeros(0, dtype=np.int64)
+    groups = np.cumsum(np.r_[False, days[1:] != days[:-1]]) if len(days) else days
+    return days[first_rows] * timestamps.MINUTES_PER_DAY, groups
+
+
+class Moments:
+    '''Count, mean and co-moment matrix of rows with every measure valid, mergeable with Chan's formula'''
+
+    def __init__(self, n, mean, m2):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def empty(cls, k):
+        return cls(0, np.zeros(k), np.zeros((k, k)))
+
+    @classmethod
+    def from_values(cls, values):
+        '''Accumulates the rows of an (n, k) array in one centered pass'''
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values).any(axis=1)]
+        if not len(values):
+            return cls.empty(values.shape[1])
+        mean = values.mean(axis=0)
+        centered = values - mean
+        return cls(len(values), mean, centered.T @ centered)
+
+    @classmethod
+    def merge_all(cls, n, mean, m2):
+        '''Merges many accumulators at once, given as arrays with one row per accumulator'''
+        total = n.sum()
+        if not total:
+            return cls.empty(mean.shape[1])
+        merged_mean = (n[:, None] * mean).sum(axis=0) / total
+        spread = mean - merged_mean
+        return cls(int(total), merged_mean, m2.sum(axis=0) + np.einsum('d,di,dj->ij', n, spread, spread))
+
+    def merge(self, other):
+        '''Returns the accumulator of both sets of rows'''
+        return Moments.merge_all(np.array([self.n, other.n]), np.stack([self.mean, other.mean]),
+                                 np.stack([self.m2, other.m2]))
+
+    def covariance(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.m2 / (self.n - 1)
+
+    def std(self):
+        return np.sqrt(np.diag(self.covariance()))
+
+    def correlation(self):
+        std = self.std()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.covariance() / np.outer(std, std)
+
+
+def _compress(means, weights, compression):
+    '''Merges sorted centroids so that each covers one step of the arcsine scale, tails stay finer'''
+    if not len(means):
+        return means, weights
+    order = np.argsort(means, kind='stable')
+    means, weights = means[order], weights[order]
+    cumulative = np.cumsum(weights)
+    q = (cumulative - weights / 2) / cumulative[-1]
+    k = np.floor(compression * (np.arcsin(2 * q - 1) / np.pi + 0.5))
+    first_rows = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+    merged_weights = np.add.reduceat(weights, first_rows)
+    return np.add.reduceat(means * weights, first_rows) / merged_weights, merged_weights
+
+
+class Digest:
+    '''Mergeable quantile sketch in the spirit of a t-digest, with exact extremes'''
+
+    def __init__(self, means, weights, low=np.nan, high=np.nan, compression=COMPRESSION):
+        self.means = means
+        self.weights = weights
+        self.low = low
+        self.high = high
+        self.compression = compression
+
+    @classmethod
+    def from_values(cls, values, compression=COMPRESSION):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return cls(np.zeros(0), np.zeros(0), compression=compression)
+        means, weights = _compress(values, np.ones(len(values)), compression)
+        return cls(means, weights, values.min(), values.max(), compression)
+
+    @classmethod
+    def merge_all(cls, means, weights, lows, highs, compression=COMPRESSION):
+        '''Merges the centroids and extremes of many sketches at once'''
+        means, weights = _compress(np.asarray(means, dtype=np.float64), np.asarray(weights, dtype=np.float64),
+                                   compression)
+        return cls(means, weights, np.nanmin(lows) if len(lows) else np.nan,
+                   np.nanmax(highs) if len(highs) else np.nan, compression)
+
+    def merge(self, other):
+        return Digest.merge_all(np.concatenate([self.means, other.means]),
+                                np.concatenate([self.weights, other.weights]),
+                                [self.low, other.low], [self.high, other.high], self.compression)
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def quantile(self, q):
+        '''Interpolates quantiles between the centroid centers and the exact extremes'''
+        if not len(self.means):
+            return np.full(np.shape(q), np.nan)
+        cumulative = np.cumsum(self.weights)
+        centers = cumulative - self.weights / 2
+        positions = np.r_[0, centers, cumulative[-1]]
+        values = np.r_[self.low, self.means, self.high]
+        return np.interp(np.asarray(q) * cumulative[-1], positions, values)
+
+    def box(self):
+        '''Returns quartiles and Tukey fences, clipped to the extremes, ready for a Plotly box'''
+        q1, median, q3 = self.quantile([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        return {
+            'q1': q1, 'median': median, 'q3': q3,
+            'lowerfence': max(self.low, q1 - 1.5 * iqr),
+            'upperfence': min(self.high, q3 + 1.5 * iqr),
+            'mean': (self.means * self.weights).sum() / self.count,
+        }
+
+
+def day_summaries(stamps, columns, measures, compression=COMPRESSION):
+    '''Computes the moments and quantile sketches of every day in one vectorized pass per measure
+
+    Returns the columns of a summary directory: one row per day for the moments
+    and the extremes, and the concatenated centroids of every day per measure.
+    '''
+    day_starts, groups = _day_groups(stamps)
+    days = len(day_starts)
+    values = np.column_stack([np.asarray(columns[measure], dtype=np.float64) for measure in measures]) \
+        if len(measures) else np.zeros((len(groups), 0))
+    summary = {ingestion.TIMESTAMP: day_starts}
+
+    # Moments of the rows with every measure valid, centered on their own day
+    complete = ~np.isnan(values).any(axis=1)
+    n = np.bincount(groups[complete], minlength=days)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.column_stack([np.bincount(groups[complete], weights=values[complete, i], minlength=days)
+                                for i in range(len(measures))]) / n[:, None]
+    centered = values[complete] - mean[groups[complete]]
+    m2 = np.zeros((days, len(measures), len(measures)))
+    for i in range(len(measures)):
+        for j in range(i, len(measures)):
+            m2[:, i, j] = m2[:, j, i] = np.bincount(groups[complete], weights=centered[:, i] * centered[:, j],
+                                                    minlength=days)
+    summary['n'] = n
+    summary['mean'] = np.nan_to_num(mean)
+    summary['m2'] = m2
+
+    # Sketches: rank every value inside its day, then cut the day on the arcsine scale
+    for i, measure in enumerate(measures):
+        valid = ~np.isnan(values[:, i])
+        day, value = groups[valid], values[valid, i]
+        order = np.lexsort((value, day))
+        day, value = day[order], value[order]
+        per_day = np.bincount(day, minlength=days)
+        starts = np.cumsum(per_day) - per_day
+        q = (np.arange(len(value)) - starts[day] + 0.5) / np.maximum(per_day[day], 1)
+        k = np.floor(compression * (np.arcsin(2 * q - 1) / np.pi + 0.5))
+        first_rows = np.flatnonzero(np.r_[True, (k[1:] != k[:-1]) | (day[1:] != day[:-1])][:len(value)])
+        weights = np.add.reduceat(np.ones(len(value)), first_rows) if len(value) else np.zeros(0)
+        summary[f'{measure}_centroid_mean'] = np.add.reduceat(value, first_rows) / weights if len(value) else weights
+        summary[f'{measure}_centroid_weight'] = weights
+        summary[f'{measure}_offsets'] = np.searchsorted(day[first_rows], np.arange(days + 1))
+        # Values are sorted within their day, the extremes are the first and last of each day
+        present = per_day > 0
+        summary[f'{measure}_min'] = np.full(days, np.nan)
+        summary[f'{measure}_max'] = np.full(days, np.nan)
+        summary[f'{measure}_min'][present] = value[starts[present]]
+        summary[f'{measure}_max'][present] = value[starts[present] + per_day[present] - 1]
+    return summary
+
+
+def summary_dir(rollup_dir, partition):
+    '''Every partition of the cache has its own summaries, stored next to the rollups'''
+    return os.path.join(rollup_dir, 'summaries', partition)
+
+
+@ingestion.locks_directory('rollup_dir')
+def update_summaries(cache_dir=ingestion.CACHE_DIR, rollup_dir=rollups.ROLLUP_DIR):
+    '''Summarizes the partitions that have no current summaries yet
+
+    Partitions never change once written, so an append only summarizes the new
+    partition. Returns the number of partitions summarized.
+    '''
+    cache_meta = ingestion.read_meta(cache_dir)
+    if cache_meta is None:
+        return 0
+    measures = [name for name in cache_meta['columns'] if name != ingestion.TIMESTAMP]
+    written = 0
+    for part in cache_meta['partitions']:
+        directory = summary_dir(rollup_dir, part['name'])
+        meta = ingestion.read_meta(directory)
+        if meta and meta['checksum'] == cache_meta['checksum'] and meta['version'] == part['version'] \
+                and meta['measures'] == measures:
+            continue
+        columns = ingestion.partition_columns(part['name'], measures, cache_dir)
+        summary = day_summaries(columns[ingestion.TIMESTAMP], columns, measures)
+        meta = {'format': ingestion.CACHE_FORMAT, 'checksum': cache_meta['checksum'], 'version': part['version'],
+                'measures': measures, 'compression': COMPRESSION, 'days': int(len(summary[ingestion.TIMESTAMP]))}
+        ingestion.write_cache(summary, meta, directory)
+        written += 1
+    return written
+
+
+def _minute_summary(pyramid, start, end, measures):
+    '''Merges the day summaries of every partition for the days that start within [start, end)'''
+    minute_store = pyramid.minute_store
+    update_summaries(minute_store.cache_dir, pyramid.rollup_dir)
+    low = None if start is None else \
+        timestamps.to_epoch_minutes(start) // timestamps.MINUTES_PER_DAY * timestamps.MINUTES_PER_DAY
+    high = None if end is None else timestamps.to_epoch_minutes(end)
+    n, mean, m2, sketches = [], [], [], {measure: ([], [], [], []) for measure in measures}
+    for part in minute_store.meta['partitions']:
+        directory = summary_dir(pyramid.rollup_dir, part['name'])
+        stored = ingestion.read_meta(directory)['measures']
+        positions = [stored.index(measure) for measure in measures]
+        names = [ingestion.TIMESTAMP] + MOMENT_COLUMNS + [f'{measure}_{column}' for measure in measures
+                                                          for column in SKETCH_COLUMNS]
+        columns = ingestion.load_directory(directory, names, mmap_mode='r')
+        days = np.asarray(columns[ingestion.TIMESTAMP])
+        lo = 0 if low is None else int(np.searchsorted(days, low, 'left'))
+        hi = len(days) if high is None else int(np.searchsorted(days, high, 'left'))
+        if hi <= lo:
+            continue
+        n.append(np.asarray(columns['n'][lo:hi]))
+        mean.append(np.asarray(columns['mean'][lo:hi])[:, positions])
+        m2.append(np.asarray(columns['m2'][lo:hi])[:, positions][:, :, positions])
+        for measure in measures:
+            offsets = columns[f'{measure}_offsets']
+            centroids = slice(int(offsets[lo]), int(offsets[hi]))
+            parts = sketches[measure]
+            parts[0].append(np.asarray(columns[f'{measure}_centroid_mean'][centroids]))
+            parts[1].append(np.asarray(columns[f'{measure}_centroid_weight'][centroids]))
+            parts[2].append(np.asarray(columns[f'{measure}_min'][lo:hi]))
+            parts[3].append(np.asarray(columns[f'{measure}_max'][lo:hi]))
+    if not n:
+        return Moments.empty(len(measures)), {measure: Digest(np.zeros(0), np.zeros(0)) for measure in measures}
+    moments = Moments.merge_all(np.concatenate(n), np.concatenate(mean), np.concatenate(m2))
+    digests = {measure: Digest.merge_all(*(np.concatenate(part) for part in parts))
+               for measure, parts in sketches.items()}
+    return moments, digests
+
+
+def range_summary(pyramid, start=None, end=None, level='minute', measures=None, gap_policy='nan',
+                  min_coverage=gaps.MIN_COVERAGE):
+    '''Returns the moments and the quantile sketch of every measure over a time range and resolution
+
+    At minute resolution the stored day summaries are merged, so no reading is
+    scanned and the range is rounded out to whole days. Coarser resolutions
+    summarize the bucket sums of their rollup level under gap_policy, the same
+    coverage rule as RollupPyramid.frame, so buckets with less than
+    min_coverage of their readings are left out unless the policy is zero or
+    fill. Returns a Moments over the measures and a Digest per measure.
+    '''
+    measures = list(measures or pyramid.measures)
+    if level == 'minute':
+        return _minute_summary(pyramid, start, end, measures)
+    data = pyramid.frame(level, start, end, measures, gap_policy=gap_policy, min_coverage=min_coverage)
+    values = data[measures].to_numpy(dtype=np.float64).reshape(-1, len(measures))
+    return Moments.from_values(values), {measure: Digest.from_values(values[:, i])
+                                         for i, measure in enumerate(measures)}
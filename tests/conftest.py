@@ -0,0 +1,19 @@
+# Load standard libraries
+import os
+import sys
+
+# Load Data libraries
+import pytest
+
+# The modules of the app sit at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def meter_dirs(tmp_path):
+    '''The cache, aggregate and rollup directories of one meter, as ingestion.meter_paths returns them'''
+    return {
+        'cache_dir': str(tmp_path / 'cache'),
+        'aggregate_dir': str(tmp_path / 'aggregates'),
+        'rollup_dir': str(tmp_path / 'rollups'),
+    }
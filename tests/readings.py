@@ -0,0 +1,81 @@
+'''Small synthetic minute readings and the plain pandas references the tests compare with'''
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+import timestamps
+
+
+def epoch_minute(text):
+    return timestamps.to_epoch_minutes(pd.Timestamp(text))
+
+
+def minute_index(stamps, name=None):
+    '''Epoch minutes as a nanosecond DatetimeIndex, the unit the caches load as on every pandas version'''
+    return pd.DatetimeIndex(np.asarray(stamps).astype('datetime64[m]').astype('datetime64[ns]'), name=name)
+
+
+def minute_readings(start, minutes, seed=0, holes=(), outages=(), dropouts=0.0):
+    '''Random readings of every measure, one row per minute from start
+
+    holes are (offset, length) runs of minutes without a row, outages runs of
+    rows whose measures are all NaN like the '?' rows of the UCI file, and
+    dropouts the share of single readings missing at random.
+    '''
+    rng = np.random.default_rng(seed)
+    stamps = epoch_minute(start) + np.arange(minutes, dtype=np.int64)
+    values = rng.uniform(0, 5, (minutes, len(ingestion.MEASURES))).astype(np.float32)
+    values[rng.random(values.shape) < dropouts] = np.nan
+    for offset, length in outages:
+        values[offset:offset + length] = np.nan
+    keep = np.ones(minutes, dtype=bool)
+    for offset, length in holes:
+        keep[offset:offset + length] = False
+    columns = {ingestion.TIMESTAMP: stamps[keep]}
+    columns.update({col: values[keep, i] for i, col in enumerate(ingestion.MEASURES)})
+    return columns
+
+
+def split_readings(columns, *cuts):
+    '''Splits readings at the given timestamps into consecutive chunks'''
+    bounds = [0] + [int(np.searchsorted(columns[ingestion.TIMESTAMP], epoch_minute(cut))) for cut in cuts]
+    bounds.append(len(columns[ingestion.TIMESTAMP]))
+    return [{name: values[lo:hi] for name, values in columns.items()} for lo, hi in zip(bounds, bounds[1:])]
+
+
+def to_frame(columns, measures=None):
+    '''Readings as a float64 DataFrame on a DatetimeIndex'''
+    measures = measures or [name for name in columns if name not in (ingestion.TIMESTAMP, ingestion.VALIDITY,
+                                                                     ingestion.GAPS)]
+    index = minute_index(columns[ingestion.TIMESTAMP], ingestion.TIMESTAMP)
+    return pd.DataFrame({col: np.asarray(columns[col], dtype=np.float64) for col in measures}, index=index)
+
+
+def bucket_keys(index, level):
+    '''The start of the rollup bucket of every timestamp, computed by pandas'''
+    if level == 'week':
+        return index.to_period('W').start_time
+    if level == 'month':
+        return index.to_period('M').start_time
+    return index.floor({'minute': 'min', '15min': '15min', 'hour': 'h', 'day': 'D'}[level])
+
+
+def expected_minutes(index, rule):
+    '''Minutes of every resampled bucket within the first and last reading'''
+    span = pd.Series(1, index=pd.date_range(index[0], index[-1], freq='min'))
+    return span.resample(rule).sum()
+
+
+def policy_sums(frame, rule, policy, min_coverage=0.5):
+    '''Bucket sums under a gap policy, the way gaps.POLICIES describes them, with pandas alone'''
+    sums = frame.resample(rule).sum()
+    counts = frame.resample(rule).count()
+    coverage = counts.div(expected_minutes(frame.index, rule), axis=0)
+    if policy == 'zero':
+        return sums
+    scaled = (sums / coverage.clip(upper=1)).where(coverage >= min_coverage)
+    if policy == 'skip':
+        return scaled[(coverage >= min_coverage).all(axis=1)]
+    if policy == 'fill':
+        return scaled.interpolate(method='time', limit_direction='both')
+    return scaled
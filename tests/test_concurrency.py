@@ -0,0 +1,50 @@
+# Load standard libraries
+import concurrent.futures
+import os
+
+# Load Data libraries
+import numpy as np
+import ingestion
+import rollups
+import summaries
+import updates
+from readings import minute_readings, split_readings
+
+# Chart jobs run on threads, several of them may find the same derived cache stale
+THREADS = 8
+
+
+def run_together(fn, *args):
+    with concurrent.futures.ThreadPoolExecutor(THREADS) as pool:
+        return [future.result() for future in [pool.submit(fn, *args) for _ in range(THREADS)]]
+
+
+def test_concurrent_writers_leave_one_complete_cache(tmp_path):
+    directory = str(tmp_path / 'cache')
+    columns = {'a': np.arange(1000, dtype=np.float64), 'b': np.ones(1000)}
+    for _ in range(5):
+        run_together(ingestion.write_cache, columns, {'format': ingestion.CACHE_FORMAT, 'rows': 1000}, directory)
+        assert sorted(os.listdir(directory)) == ['a.npy', 'b.npy', 'meta.json']
+        # No temporary directory is left behind
+        assert os.listdir(tmp_path) == ['cache']
+
+
+def test_concurrent_summaries_are_built_once(meter_dirs):
+    first, second = split_readings(minute_readings('2010-05-01', 20 * 1440, dropouts=0.01), '2010-05-12 06:30')
+    ingestion.create_cache(first, meter_dirs['cache_dir'])
+    pyramid = rollups.open_pyramid(cache_dir=meter_dirs['cache_dir'], rollup_dir=meter_dirs['rollup_dir'])
+    built = run_together(summaries.update_summaries, meter_dirs['cache_dir'], meter_dirs['rollup_dir'])
+    assert sorted(built) == [0] * (THREADS - 1) + [1]
+
+    # After an append every job merges the new partition's summaries, written by one of them
+    updates.append_readings(second, **meter_dirs)
+    pyramid = rollups.open_pyramid(cache_dir=meter_dirs['cache_dir'], rollup_dir=meter_dirs['rollup_dir'])
+    for part in pyramid.minute_store.meta['partitions']:
+        summaries_dir = summaries.summary_dir(meter_dirs['rollup_dir'], part['name'])
+        ingestion.write_meta(dict(ingestion.read_meta(summaries_dir), version=-1), summaries_dir)
+    results = run_together(summaries.range_summary, pyramid, None, None, 'minute', ['Voltage'])
+    moments, digests = summaries.range_summary(pyramid, measures=['Voltage'])
+    for other, other_digests in results:
+        np.testing.assert_array_equal(other.n, moments.n)
+        np.testing.assert_allclose(other.mean, moments.mean)
+        np.testing.assert_allclose(other_digests['Voltage'].quantile(0.5), digests['Voltage'].quantile(0.5))
@@ -0,0 +1,160 @@
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import pytest
+import gaps
+import ingestion
+import rollups
+import store
+import summaries
+import updates
+from readings import minute_readings, split_readings, to_frame, epoch_minute, policy_sums
+
+# 20 days from the middle of a day, with two missing days, a short hole, an outage and
+# single missing readings, then an append after a hole of its own
+START = '2010-04-03 09:41'
+MINUTES = 20 * 1440
+HOLES = [(2000, 2 * 1440), (12000, 45), (21700, 600)]
+OUTAGES = [(8000, 700), (15000, 3)]
+
+
+@pytest.fixture
+def readings():
+    return minute_readings(START, MINUTES, holes=HOLES, outages=OUTAGES, dropouts=0.02)
+
+
+@pytest.fixture
+def cached(readings, meter_dirs):
+    first, second = split_readings(readings, '2010-04-18 12:00')
+    ingestion.create_cache(first, meter_dirs['cache_dir'])
+    ingestion.build_aggregates(aggregate_dir=meter_dirs['aggregate_dir'], cache_dir=meter_dirs['cache_dir'])
+    rollups.build_rollups(cache_dir=meter_dirs['cache_dir'], rollup_dir=meter_dirs['rollup_dir'])
+    updates.append_readings(second, **meter_dirs)
+    return meter_dirs
+
+
+def missing_runs(readings):
+    '''The [start, end) runs of minutes without a row or with a missing measure, found with pandas'''
+    frame = to_frame(readings, ingestion.MEASURES)
+    full = frame.reindex(pd.date_range(frame.index[0], frame.index[-1], freq='min'))
+    bad = full.isna().any(axis=1).to_numpy()
+    minutes = epoch_minute(frame.index[0]) + np.arange(len(bad))
+    edges = np.diff(np.r_[0, bad.astype(np.int8), 0])
+    return np.column_stack([minutes[np.flatnonzero(edges[:-1] == 1)], minutes[np.flatnonzero(edges[1:] == -1)] + 1])
+
+
+def test_validity_mask_matches_notna(readings):
+    mask = gaps.validity_mask(readings, ingestion.MEASURES)
+    assert mask.dtype == np.uint8
+    for bit, measure in enumerate(ingestion.MEASURES):
+        np.testing.assert_array_equal(gaps.measure_valid(mask, bit), pd.notna(readings[measure]))
+
+
+def test_validity_mask_holds_eight_measures():
+    columns = {str(i): np.zeros(3) for i in range(9)}
+    assert gaps.validity_mask(columns, list(columns)[:8]).max() == 255
+    with pytest.raises(ValueError):
+        gaps.validity_mask(columns, list(columns))
+
+
+def test_gap_intervals_match_pandas(readings):
+    mask = gaps.validity_mask(readings, ingestion.MEASURES)
+    intervals = gaps.gap_intervals(readings[ingestion.TIMESTAMP], mask, (1 << len(ingestion.MEASURES)) - 1)
+    np.testing.assert_array_equal(intervals, missing_runs(readings))
+
+
+def test_missing_minutes_match_a_count(readings):
+    intervals = missing_runs(readings)
+    missing = np.zeros(MINUTES + 2000, dtype=np.int64)
+    first = epoch_minute(START) - 1000
+    for start, end in intervals:
+        missing[start - first:end - first] = 1
+    rng = np.random.default_rng(1)
+    starts = first + rng.integers(0, len(missing), 500)
+    ends = starts + rng.integers(0, 5000, 500)
+    # Ranges before, inside, across and after the gaps, empty ones included
+    ends = np.minimum(ends, first + len(missing))
+    expected = [missing[start - first:end - first].sum() for start, end in zip(starts, ends)]
+    np.testing.assert_array_equal(gaps.missing_minutes(intervals, starts, ends), expected)
+    assert gaps.missing_minutes(np.zeros((0, 2)), starts, ends).sum() == 0
+
+
+def test_store_gaps_span_partitions(readings, cached):
+    minute_store = store.open_store(cache_dir=cached['cache_dir'])
+    np.testing.assert_array_equal(minute_store.gaps(), missing_runs(readings))
+
+    frame = to_frame(readings, ingestion.MEASURES)
+    complete = frame.notna().all(axis=1)
+    for start, end in [(None, None), ('2010-04-05', '2010-04-09'), ('2010-04-18', '2010-04-19'),
+                       ('2010-04-18 11:00', '2010-04-18 12:30'), ('2010-04-18 13:00', '2010-04-18 13:30')]:
+        lo = frame.index[0] if start is None else pd.Timestamp(start)
+        hi = frame.index[-1] + pd.Timedelta(minutes=1) if end is None else pd.Timestamp(end)
+        inside = complete[(complete.index >= lo) & (complete.index < hi)]
+        expected = inside.sum() / ((hi - lo) // pd.Timedelta(minutes=1))
+        assert minute_store.coverage(start, end) == pytest.approx(expected)
+    # Nothing to cover after the last reading
+    assert np.isnan(minute_store.coverage('2010-05-01', '2010-05-02'))
+
+
+def test_zero_policy_keeps_sums():
+    values, coverage, keep = gaps.apply_policy(np.arange(3), [1.0, 2.0, 3.0], [10, 0, 5], np.array([10, 10, 10]))
+    np.testing.assert_array_equal(values, [1, 2, 3])
+    np.testing.assert_allclose(coverage, [1, 0, 0.5])
+    assert keep.all()
+    with pytest.raises(KeyError):
+        gaps.apply_policy(np.arange(3), [1.0, 2.0, 3.0], [10, 0, 5], np.array([10, 10, 10]), 'drop')
+
+
+def test_fill_policy_stays_within_each_series():
+    stamps = np.array([0, 1, 2, 0, 1, 2])
+    values, _, _ = gaps.apply_policy(stamps, [1.0, 0, 3.0, 10.0, 0, 0], [1, 0, 1, 1, 0, 0], np.ones(6), 'fill',
+                                     series=np.array([0, 0, 0, 1, 1, 1]))
+    np.testing.assert_allclose(values, [1, 2, 3, 10, 10, 10])
+
+
+@pytest.mark.parametrize('policy', gaps.POLICIES)
+@pytest.mark.parametrize('level', ['daily', 'hourly'])
+def test_aggregate_policies_match_pandas(readings, cached, policy, level):
+    actual = ingestion.load_aggregate(level, aggregate_dir=cached['aggregate_dir'], cache_dir=cached['cache_dir'],
+                                      gap_policy=policy).set_index(ingestion.TIMESTAMP)
+    expected = policy_sums(to_frame(readings, ingestion.DAILY_MEASURES), 'D' if level == 'daily' else 'h', policy)
+    np.testing.assert_array_equal(actual.index.values, expected.index.values)
+    np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy(), rtol=1e-6)
+
+
+@pytest.mark.parametrize('policy', ['nan', 'skip', 'fill'])
+@pytest.mark.parametrize('level, rule', [('hour', 'h'), ('day', 'D')])
+def test_rollup_policies_match_pandas(readings, cached, policy, level, rule):
+    pyramid = rollups.open_pyramid(cache_dir=cached['cache_dir'], rollup_dir=cached['rollup_dir'])
+    actual = pyramid.frame(level, measures=ingestion.DAILY_MEASURES, gap_policy=policy).set_index(ingestion.TIMESTAMP)
+    expected = policy_sums(to_frame(readings, ingestion.DAILY_MEASURES), rule, policy)
+    if policy == 'nan':
+        # Buckets without a single row are not in the rollups, only fill adds them
+        expected = expected[to_frame(readings, ['Voltage']).resample(rule).size() > 0]
+    np.testing.assert_array_equal(actual.index.values, expected.index.values)
+    np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy(), rtol=1e-6)
+
+
+def test_coverage_matches_pandas(readings, cached):
+    pyramid = rollups.open_pyramid(cache_dir=cached['cache_dir'], rollup_dir=cached['rollup_dir'])
+    actual = pyramid.coverage('day', measures=['Voltage']).set_index(ingestion.TIMESTAMP)['Voltage']
+    frame = to_frame(readings, ['Voltage'])
+    expected = (frame.resample('D').count()['Voltage']
+                / pd.Series(1, pd.date_range(frame.index[0], frame.index[-1], freq='min')).resample('D').sum())
+    expected = expected[frame.resample('D').size() > 0]
+    np.testing.assert_array_equal(actual.index.values, expected.index.values)
+    np.testing.assert_allclose(actual, expected)
+
+
+@pytest.mark.parametrize('policy', ['nan', 'skip'])
+def test_range_summary_follows_the_policy(readings, cached, policy):
+    pyramid = rollups.open_pyramid(cache_dir=cached['cache_dir'], rollup_dir=cached['rollup_dir'])
+    moments, digests = summaries.range_summary(pyramid, level='day', measures=ingestion.DAILY_MEASURES,
+                                               gap_policy=policy)
+    expected = policy_sums(to_frame(readings, ingestion.DAILY_MEASURES), 'D', policy).dropna()
+    assert moments.n == len(expected)
+    np.testing.assert_allclose(moments.mean, expected.mean(), rtol=1e-6)
+    np.testing.assert_allclose(moments.correlation(), expected.corr(), rtol=1e-6)
+    power = expected['Global_active_power']
+    digest = digests['Global_active_power']
+    assert (digest.quantile(0), digest.quantile(1)) == pytest.approx((power.min(), power.max()))
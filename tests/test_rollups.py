@@ -0,0 +1,101 @@
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import pytest
+import ingestion
+import rollups
+import store
+from readings import minute_readings, minute_index, to_frame, bucket_keys, epoch_minute
+
+# 50 days from an odd minute of a Wednesday, across two month ends, with a missing day,
+# a few hours without rows and an outage of all-NaN rows
+START = '2010-01-27 13:07'
+MINUTES = 50 * 1440
+
+
+@pytest.fixture
+def pyramid(meter_dirs):
+    columns = minute_readings(START, MINUTES, holes=[(3000, 1440), (20000, 200)], outages=[(40000, 500)],
+                              dropouts=0.01)
+    ingestion.create_cache(columns, meter_dirs['cache_dir'])
+    return rollups.open_pyramid(cache_dir=meter_dirs['cache_dir'], rollup_dir=meter_dirs['rollup_dir'])
+
+
+def query_frame(pyramid, level, measures, stats=rollups.STATS):
+    '''A rollup level as a frame with (measure, stat) columns, like a pandas groupby aggregate'''
+    _, columns = pyramid.query(level, measures=measures, stats=stats)
+    index = minute_index(columns[ingestion.TIMESTAMP])
+    return pd.DataFrame({(measure, stat): np.asarray(columns[f'{measure}_{stat}'], dtype=np.float64)
+                         for measure in measures for stat in stats}, index=index)
+
+
+@pytest.mark.parametrize('level', rollups.LEVELS[1:])
+def test_levels_match_pandas_groupby(pyramid, level):
+    minutes = to_frame(pyramid.minute_store.take(0, len(pyramid.minute_store)), pyramid.measures)
+    expected = minutes.groupby(bucket_keys(minutes.index, level)).agg(rollups.STATS)
+    actual = query_frame(pyramid, level, pyramid.measures)
+    np.testing.assert_array_equal(actual.index.values, expected.index.values)
+    for column in actual.columns:
+        np.testing.assert_allclose(actual[column], expected[column], rtol=1e-6, err_msg=str(column))
+
+
+def test_frame_sums_match_pandas(pyramid):
+    minutes = to_frame(pyramid.minute_store.take(0, len(pyramid.minute_store)), ingestion.DAILY_MEASURES)
+    expected = minutes.groupby(bucket_keys(minutes.index, 'hour')).sum()
+    actual = pyramid.frame('hour', measures=ingestion.DAILY_MEASURES).set_index(ingestion.TIMESTAMP)
+    np.testing.assert_array_equal(actual.index.values, expected.index.values)
+    np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy(), rtol=1e-6)
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 97, 900, 10 ** 6])
+def test_chunked_minute_reduce_matches_one_pass(chunk_rows):
+    # Chunks ending inside a 15 minute bucket must not split it
+    columns = minute_readings(START, 5000, holes=[(100, 7), (2000, 31)], dropouts=0.05)
+    index, values = columns[ingestion.TIMESTAMP], columns['Voltage']
+    starts, stats = rollups._reduce_minutes(index, values, chunk_rows=chunk_rows)
+
+    minutes = to_frame(columns, ['Voltage'])['Voltage']
+    expected = minutes.groupby(bucket_keys(minutes.index, '15min')).agg(['sum', 'count', 'min', 'max'])
+    np.testing.assert_array_equal(starts.astype('datetime64[m]'), expected.index.values.astype('datetime64[m]'))
+    for stat in expected.columns:
+        np.testing.assert_allclose(stats[stat], expected[stat], rtol=1e-6, err_msg=stat)
+
+
+@pytest.mark.parametrize('level', ['week', 'month'])
+def test_calendar_buckets_match_pandas_periods(level):
+    stamps = np.arange(epoch_minute('2008-12-20'), epoch_minute('2009-04-10'), 97, dtype=np.int64)
+    index = minute_index(stamps)
+    starts = rollups.bucket_starts(level, stamps)
+    np.testing.assert_array_equal(starts.astype('datetime64[m]'), bucket_keys(index, level).values.astype('datetime64[m]'))
+
+    grid = rollups.bucket_grid(level, stamps[0], stamps[-1])
+    periods = pd.period_range(index[0], index[-1], freq='W' if level == 'week' else 'M')
+    np.testing.assert_array_equal(grid.astype('datetime64[m]'), periods.start_time.values.astype('datetime64[m]'))
+    widths = (periods.end_time.ceil('min') - periods.start_time) // pd.Timedelta(minutes=1)
+    np.testing.assert_array_equal(rollups.bucket_widths(level, grid), widths)
+
+
+def test_choose_level_keeps_within_max_points(pyramid):
+    for max_points in (10, 100, 5000, 10 ** 6):
+        level = pyramid.choose_level(max_points=max_points)
+        finer = rollups.LEVELS[:rollups.LEVELS.index(level)]
+        assert pyramid.points(level) <= max_points or level == rollups.LEVELS[-1]
+        assert all(pyramid.points(other) > max_points for other in finer)
+
+
+def test_points_count_the_calendar_buckets(pyramid):
+    minutes = to_frame(pyramid.minute_store.take(0, len(pyramid.minute_store)), ['Voltage'])
+    for level in rollups.LEVELS[1:]:
+        assert pyramid.points(level) == bucket_keys(minutes.index, level).nunique(), level
+    # One calendar month, of 28 days
+    assert pyramid.points('month', '2010-02-01', '2010-03-01') == 1
+    assert pyramid.points('day', '2010-02-01', '2010-03-01') == 28
+    assert all(isinstance(width, int) for width in rollups.LEVEL_WIDTHS.values())
+
+
+def test_rollups_are_reused_until_the_cache_changes(meter_dirs):
+    ingestion.create_cache(minute_readings(START, 3000), meter_dirs['cache_dir'])
+    meta = rollups.build_rollups(cache_dir=meter_dirs['cache_dir'], rollup_dir=meter_dirs['rollup_dir'])
+    assert meta['version'] == store.open_store(cache_dir=meter_dirs['cache_dir']).meta['version']
+    written = ingestion.read_meta(f"{meter_dirs['rollup_dir']}/month")
+    assert rollups.build_rollups(cache_dir=meter_dirs['cache_dir'], rollup_dir=meter_dirs['rollup_dir']) == written
@@ -0,0 +1,163 @@
+# Load standard libraries
+import os
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import pytest
+import ingestion
+import rollups
+import store
+import updates
+from readings import minute_readings, split_readings, to_frame, epoch_minute
+
+# 70 days from 2010-01-25, a Monday, with a missing day and an outage
+START = '2010-01-25 00:00'
+MINUTES = 70 * 1440
+HOLES = [(10000, 1440), (87370, 90)]
+
+# Appends cut inside a 15 minute bucket, an hour, a day, a week and a month, on a month
+# boundary and inside the last hole, so that no partition starts where a bucket does
+CUTS = ['2010-02-10 10:07', '2010-02-10 10:08', '2010-03-01 00:00', '2010-03-05 16:29', '2010-03-26 16:30']
+
+
+@pytest.fixture
+def readings():
+    return minute_readings(START, MINUTES, holes=HOLES, outages=[(30000, 300)], dropouts=0.01)
+
+
+@pytest.fixture
+def appended(readings, meter_dirs):
+    '''A cache built from the first readings, with the pages' artifacts, then appended to chunk by chunk'''
+    first, *rest = split_readings(readings, *CUTS)
+    ingestion.create_cache(first, meter_dirs['cache_dir'])
+    ingestion.build_aggregates(aggregate_dir=meter_dirs['aggregate_dir'], cache_dir=meter_dirs['cache_dir'])
+    rollups.build_rollups(cache_dir=meter_dirs['cache_dir'], rollup_dir=meter_dirs['rollup_dir'])
+    for chunk in rest:
+        updates.append_readings(chunk, **meter_dirs)
+    return meter_dirs
+
+
+@pytest.fixture
+def rebuilt(readings, tmp_path):
+    '''The same readings cached and rolled up at once'''
+    dirs = {name: str(tmp_path / 'rebuilt' / name) for name in ('cache', 'aggregates', 'rollups')}
+    ingestion.create_cache(readings, dirs['cache'])
+    ingestion.build_aggregates(aggregate_dir=dirs['aggregates'], cache_dir=dirs['cache'])
+    rollups.build_rollups(cache_dir=dirs['cache'], rollup_dir=dirs['rollups'])
+    return {'cache_dir': dirs['cache'], 'aggregate_dir': dirs['aggregates'], 'rollup_dir': dirs['rollups']}
+
+
+def test_appends_write_one_partition_each(appended):
+    meta = ingestion.read_meta(appended['cache_dir'])
+    assert meta['version'] == len(CUTS)
+    assert [part['version'] for part in meta['partitions']] == list(range(len(CUTS) + 1))
+    assert meta['rows'] == sum(part['rows'] for part in meta['partitions'])
+    assert all(before['end'] < after['start'] for before, after in zip(meta['partitions'], meta['partitions'][1:]))
+
+
+def test_store_reads_across_partitions(readings, appended):
+    minute_store = store.open_store(cache_dir=appended['cache_dir'])
+    expected = to_frame(readings, ingestion.MEASURES)
+    actual = minute_store.frame(columns=ingestion.MEASURES).set_index(ingestion.TIMESTAMP)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_names=False, check_freq=False)
+
+    # Ranges starting and ending in different partitions, and inside the hole between two of them
+    for start, end in [('2010-02-10 10:00', '2010-02-10 10:30'), ('2010-02-09', '2010-03-06'),
+                       ('2010-03-26 16:00', '2010-03-27'), (None, '2010-02-10 10:08'), ('2010-03-26 16:31', None)]:
+        sliced = minute_store.frame(start, end, ['Voltage']).set_index(ingestion.TIMESTAMP)['Voltage']
+        window = expected['Voltage']
+        if start is not None:
+            window = window[window.index >= pd.Timestamp(start)]
+        if end is not None:
+            window = window[window.index < pd.Timestamp(end)]
+        pd.testing.assert_series_equal(sliced, window, check_dtype=False, check_names=False, check_freq=False)
+
+
+@pytest.mark.parametrize('ascending', [True, False])
+def test_sorted_pages_span_partitions(readings, appended, ascending):
+    minute_store = store.open_store(cache_dir=appended['cache_dir'])
+    start, end = '2010-02-10', '2010-03-02'
+    window = to_frame(readings, ['Voltage']).loc[start:pd.Timestamp(end) - pd.Timedelta(minutes=1), 'Voltage']
+    # Missing readings go last, ties keep time order
+    values = window.to_numpy() if ascending else -window.to_numpy()
+    order = np.lexsort((np.arange(len(values)), np.where(np.isnan(values), np.inf, values)))
+    for number in (0, 7, len(window) // 100):
+        page, total = minute_store.page(number, 100, start, end, sort_by='Voltage', ascending=ascending,
+                                        columns=['Voltage'])
+        assert total == len(window)
+        expected = window.iloc[order[number * 100:(number + 1) * 100]]
+        np.testing.assert_array_equal(page[ingestion.TIMESTAMP].values, expected.index.values)
+        np.testing.assert_array_equal(page['Voltage'], expected.to_numpy(dtype=np.float32))
+
+
+@pytest.mark.parametrize('level', ['daily', 'hourly'])
+def test_appended_aggregates_match_pandas(readings, appended, rebuilt, level):
+    actual = ingestion.load_aggregate(level, aggregate_dir=appended['aggregate_dir'], cache_dir=appended['cache_dir'])
+    again = ingestion.load_aggregate(level, aggregate_dir=rebuilt['aggregate_dir'], cache_dir=rebuilt['cache_dir'])
+    pd.testing.assert_frame_equal(actual, again)
+
+    minutes = to_frame(readings, ingestion.DAILY_MEASURES)
+    expected = minutes.resample('D' if level == 'daily' else 'h').sum()
+    actual = actual.set_index(ingestion.TIMESTAMP)
+    np.testing.assert_array_equal(actual.index.values, expected.index.values)
+    np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy(), rtol=1e-6)
+
+
+@pytest.mark.parametrize('level', rollups.LEVELS[1:])
+def test_appended_rollups_match_a_full_build(appended, rebuilt, level):
+    names = [ingestion.TIMESTAMP] + [f'{measure}_{stat}' for measure in ingestion.MEASURES for stat in rollups.STATS]
+    merged = ingestion.load_directory(os.path.join(appended['rollup_dir'], level), names)
+    full = ingestion.load_directory(os.path.join(rebuilt['rollup_dir'], level), names)
+    for name in names:
+        np.testing.assert_allclose(merged[name], full[name], rtol=1e-9, err_msg=name)
+
+
+def test_appended_rollups_match_pandas(readings, appended):
+    pyramid = rollups.open_pyramid(cache_dir=appended['cache_dir'], rollup_dir=appended['rollup_dir'])
+    minutes = to_frame(readings, ['Global_active_power'])
+    for level, rule in [('hour', 'h'), ('day', 'D'), ('week', 'W-MON')]:
+        expected = minutes.resample(rule, label='left', closed='left').sum()['Global_active_power']
+        actual = pyramid.frame(level, measures=['Global_active_power']).set_index(ingestion.TIMESTAMP)
+        # The rollups hold the buckets with at least one row, pandas every bucket of the range
+        expected = expected[minutes.resample(rule, label='left', closed='left').size() > 0]
+        np.testing.assert_array_equal(actual.index.values, expected.index.values)
+        np.testing.assert_allclose(actual['Global_active_power'], expected, rtol=1e-6, err_msg=level)
+
+
+def test_versions_change_only_for_appended_ranges(readings, meter_dirs):
+    first, second = split_readings(readings, '2010-03-01')
+    meta = ingestion.create_cache(first, meter_dirs['cache_dir'])
+    before = ingestion.range_version(meta, epoch_minute('2010-02-01'), epoch_minute('2010-02-02'))
+    meta = updates.append_readings(second, **meter_dirs)
+    assert ingestion.dataset_version(meta).endswith('.1')
+    assert ingestion.range_version(meta, epoch_minute('2010-02-01'), epoch_minute('2010-02-02')) == before
+    assert ingestion.range_version(meta, epoch_minute('2010-03-01'), None) != before
+
+
+def test_append_rejects_older_readings(readings, meter_dirs):
+    first, second = split_readings(readings, '2010-03-01')
+    ingestion.create_cache(second, meter_dirs['cache_dir'])
+    with pytest.raises(ValueError):
+        updates.append_readings(first, **meter_dirs)
+
+
+def test_meter_readings_are_split_by_meter(readings, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, 'METER_DIR', str(tmp_path / 'meters'))
+    frame = to_frame(readings, ingestion.MEASURES).reset_index()
+    frame[ingestion.METER_ID] = np.where(np.arange(len(frame)) % 3, 'm2', 'm3')
+    # Shuffled rows, in two batches cut inside a day
+    frame = frame.sample(frac=1, random_state=0)
+    cut = frame[ingestion.TIMESTAMP] < pd.Timestamp('2010-02-20 12:34')
+    updates.append_meter_readings(frame[cut])
+    updates.append_meter_readings(frame[~cut])
+
+    assert ingestion.meter_ids() == [ingestion.DEFAULT_METER, 'm2', 'm3']
+    for meter in ('m2', 'm3'):
+        meta = ingestion.read_meta(ingestion.meter_paths(meter)['cache_dir'])
+        assert len(meta['partitions']) == 2
+        expected = frame[frame[ingestion.METER_ID] == meter].drop(columns=ingestion.METER_ID)
+        expected = expected.sort_values(ingestion.TIMESTAMP).set_index(ingestion.TIMESTAMP)
+        actual = store.open_store(cache_dir=ingestion.meter_paths(meter)['cache_dir']).frame(columns=ingestion.MEASURES)
+        pd.testing.assert_frame_equal(actual.set_index(ingestion.TIMESTAMP), expected,
+                                      check_dtype=False, check_names=False)
@@ -0,0 +1,83 @@
+# Load standard libraries
+import datetime
+
+# Load Data libraries
+import pandas as pd
+import numpy as np
+
+# The UCI file stores 'd/m/yyyy' dates (day first, not always zero padded)
+# and 'hh:mm:ss' times with one row per minute
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+MINUTES_PER_DAY = 1440
+NANOSECONDS_PER_MINUTE = 60 * 10 ** 9
+
+# Expected time label for every minute of the day
+TIME_LABELS = np.array(['%02d:%02d:00' % divmod(minute, 60) for minute in range(MINUTES_PER_DAY)],
+                       dtype=object)
+
+
+def parse_date(text):
+    '''Converts one dd/mm/yyyy string into days since the epoch'''
+    day, month, year = text.split('/')
+    return datetime.date(int(year), int(month), int(day)).toordinal() - EPOCH_ORDINAL
+
+
+def parse_time(text):
+    '''Converts one hh:mm:ss string into minutes since midnight'''
+    hour, minute, _ = text.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def _parse_column(values, parser):
+    '''Parses each distinct string once and broadcasts the result back to every row'''
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    parsed = np.fromiter((parser(text) for text in uniques), dtype=np.int64, count=len(uniques))
+    return parsed[codes]
+
+
+def regular_range(dates, times):
+    '''Returns the epoch minutes as a range when the rows are consecutive minutes, else None'''
+    dates = np.asarray(dates, dtype=object)
+    times = np.asarray(times, dtype=object)
+    n = len(dates)
+    start = parse_date(dates[0]) * MINUTES_PER_DAY + parse_time(times[0])
+    end = parse_date(dates[-1]) * MINUTES_PER_DAY + parse_time(times[-1])
+    if end - start != n - 1:
+        return None
+
+    stamps = np.arange(start, start + n, dtype=np.int64)
+    # Every time label has to follow the minute of day cycle
+    if not (times == TIME_LABELS[stamps % MINUTES_PER_DAY]).all():
+        return None
+    # The date has to change exactly at midnight and match the expected day
+    codes, uniques = pd.factorize(dates)
+    day_starts = np.flatnonzero(stamps % MINUTES_PER_DAY == 0)
+    day_starts = day_starts[day_starts > 0]
+    if not np.array_equal(np.flatnonzero(np.diff(codes)) + 1, day_starts):
+        return None
+    first_rows = np.concatenate([[0], day_starts])
+    expected_days = stamps[first_rows] // MINUTES_PER_DAY
+    if len(uniques) != len(first_rows):
+        return None
+    if any(parse_date(uniques[code]) != day for code, day in zip(codes[first_rows], expected_days)):
+        return None
+    return stamps
+
+
+def parse_date_time(dates, times):
+    '''Converts the Date and Time columns into int64 epoch minutes'''
+    if len(dates) == 0:
+        return np.empty(0, dtype=np.int64)
+    stamps = regular_range(dates, times)
+    if stamps is not None:
+        return stamps
+    days = _parse_column(dates, parse_date)
+    minutes = _parse_column(times, parse_time)
+    return days * MINUTES_PER_DAY + minutes
+
+
+def to_epoch_minutes(value):
+    '''Converts a date string, datetime or integer minutes into epoch minutes'''
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return pd.Timestamp(value).value // NANOSECONDS_PER_MINUTE
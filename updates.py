@@ -0,0 +1,68 @@
+# Load Data libraries
+import pandas as pd
+import numpy as np
+import ingestion
+import instrument
+import rollups
+import summaries
+import timestamps
+
+
+def _to_columns(readings):
+    '''Accepts a UCI style file, a DataFrame or a dict of columns'''
+    if isinstance(readings, str):
+        return ingestion.read_source(readings)
+    if isinstance(readings, pd.DataFrame):
+        with instrument.stage('datetime_build'):
+            if ingestion.TIMESTAMP in readings:
+                stamps = readings[ingestion.TIMESTAMP].values.astype('datetime64[m]').astype(np.int64)
+            else:
+                stamps = timestamps.parse_date_time(readings['Date'].to_numpy(dtype=object),
+                                                    readings['Time'].to_numpy(dtype=object))
+        columns = {ingestion.TIMESTAMP: stamps}
+        with instrument.stage('numeric_coercion'):
+            for col in ingestion.MEASURES:
+                if col in readings:
+                    columns[col] = pd.to_numeric(readings[col], errors='coerce').to_numpy(dtype=np.float32)
+        return columns
+    return dict(readings)
+
+
+def append_readings(readings, cache_dir=ingestion.CACHE_DIR, aggregate_dir=ingestion.AGGREGATE_DIR,
+                    rollup_dir=rollups.ROLLUP_DIR):
+    '''Appends new meter readings as a partition and updates the aggregates, rollups and summaries in place
+
+    Returns the new manifest of the cache, its version is bumped by one.
+    '''
+    meta = ingestion.append_partition(_to_columns(readings), cache_dir, aggregate_dir)
+    rollups.update_rollups(cache_dir, rollup_dir)
+    summaries.update_summaries(cache_dir, rollup_dir)
+    return meta
+
+
+def append_meter_readings(readings, meter_column=ingestion.METER_ID):
+    '''Splits the readings of many meters by meter id and appends every meter's rows as a time partition
+
+    readings is a DataFrame or a dict of columns with a meter id column. Meters
+    seen for the first time get a new cache. Returns the manifest of every meter.
+    '''
+    meter_ids = np.asarray(readings[meter_column]).astype(str)
+    if isinstance(readings, pd.DataFrame):
+        columns = _to_columns(readings.drop(columns=[meter_column]))
+    else:
+        columns = _to_columns({name: values for name, values in readings.items() if name != meter_column})
+
+    # One sort groups every meter's rows together in time order
+    codes, meters = pd.factorize(meter_ids)
+    order = np.lexsort((columns[ingestion.TIMESTAMP], codes))
+    bounds = np.searchsorted(codes[order], np.arange(len(meters) + 1))
+    manifests = {}
+    for code, meter in enumerate(meters):
+        rows = order[bounds[code]:bounds[code + 1]]
+        meter_columns = {name: np.asarray(values)[rows] for name, values in columns.items()}
+        paths = ingestion.meter_paths(meter)
+        if ingestion.read_meta(paths['cache_dir']) is None:
+            manifests[meter] = ingestion.create_cache(meter_columns, paths['cache_dir'])
+        else:
+            manifests[meter] = append_readings(meter_columns, **paths)
+    return manifests